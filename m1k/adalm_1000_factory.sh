@@ -39,36 +39,51 @@ fi
 #----------------------------------#
 
 inc_fail_stats() {
-	local serial="$1"
-	let FAILED_CNT='FAILED_CNT + 1'
-	echo "PASSED_CNT=$PASSED_CNT" > $STATSFILE
-	echo "FAILED_CNT=$FAILED_CNT" >> $STATSFILE
+	local serials="$1"
+	local serial
 	console_ascii_failed
-	if [ -n "$serial" ] ; then
+	if [ -z "$serials" ] ; then
+		let FAILED_CNT='FAILED_CNT + 1'
+		save_stats
+		cat "$LOGFILE" > "$LOGDIR/_errors_${RUN_TIMESTAMP}.log"
+		cat /dev/null > "$LOGFILE"
+		return
+	fi
+	# With M1K_PARALLEL=1 the run stops for all its boards
+	for serial in $serials ; do
+		let FAILED_CNT='FAILED_CNT + 1'
 		mkdir -p "$LOGDIR/${serial}_${RUN_TIMESTAMP}"
 		cat "$LOGFILE" > "$LOGDIR/${serial}_${RUN_TIMESTAMP}/execlog.txt"
 		echo "FAILED $serial - ${RUN_TIMESTAMP}" >> $RESULTSFILE
+		${PYTHON} results_db.py result "$serial" FAILED
 		mv -f "$LOGDIR/${serial}_${RUN_TIMESTAMP}" \
 			"$LOGDIR/failed_${serial}_${RUN_TIMESTAMP}"
-	else
-		cat "$LOGFILE" > "$LOGDIR/_errors_${RUN_TIMESTAMP}.log"
-	fi
+	done
+	save_stats
 	cat /dev/null > "$LOGFILE"
 }
 
 inc_pass_stats() {
-	local serial="$1"
-	let PASSED_CNT='PASSED_CNT + 1'
-	echo "PASSED_CNT=$PASSED_CNT" > $STATSFILE
-	echo "FAILED_CNT=$FAILED_CNT" >> $STATSFILE
-	echo "PASSED $serial - ${RUN_TIMESTAMP}" >> $RESULTSFILE
+	local serials="$1"
+	local serial
 	clear
 	console_ascii_passed
-	mkdir -p "$LOGDIR/${serial}_${RUN_TIMESTAMP}"
-	cat "$LOGFILE" > "$LOGDIR/${serial}_${RUN_TIMESTAMP}/execlog.txt"
+	for serial in $serials ; do
+		let PASSED_CNT='PASSED_CNT + 1'
+		echo "PASSED $serial - ${RUN_TIMESTAMP}" >> $RESULTSFILE
+		${PYTHON} results_db.py result "$serial" PASSED
+		mkdir -p "$LOGDIR/${serial}_${RUN_TIMESTAMP}"
+		cat "$LOGFILE" > "$LOGDIR/${serial}_${RUN_TIMESTAMP}/execlog.txt"
+		mv -f "$LOGDIR/${serial}_${RUN_TIMESTAMP}" \
+			"$LOGDIR/passed_${serial}_${RUN_TIMESTAMP}"
+	done
+	save_stats
 	cat /dev/null > "$LOGFILE"
-	mv -f "$LOGDIR/${serial}_${RUN_TIMESTAMP}" \
-		"$LOGDIR/passed_${serial}_${RUN_TIMESTAMP}"
+}
+
+save_stats() {
+	echo "PASSED_CNT=$PASSED_CNT" > $STATSFILE
+	echo "FAILED_CNT=$FAILED_CNT" >> $STATSFILE
 }
 
 console_ascii_passed() {
@@ -126,10 +141,26 @@ handle_button() {
 	fi
 }
 
-update_serial() {
-	serial="$(get_device_serial_num)"
-	[ -n "$serial" ] || return 1
-	export serial
+update_serials() {
+	# The runner keeps the devices open, so take the serial numbers
+	# from the log directories created by the first stage, one per board
+	local dir
+	serials=""
+	for dir in "$LOGDIR"/*_"${RUN_TIMESTAMP}" ; do
+		[ -d "$dir" ] || continue
+		serials="$serials $(basename "$dir" "_${RUN_TIMESTAMP}")"
+	done
+	[ -n "$serials" ] || serials="$(get_device_serial_num)"
+	[ -n "$serials" ] || return 1
+	export serials
+}
+
+# Stages before the one a calibration checkpoint resumes at are skipped
+stage_pending() {
+	local stage="$1"
+	[ -n "$RESUME" ] || return 0
+	[ "$RESUME" != "$stage" ] || RESUME=""
+	[ -z "$RESUME" ]
 }
 
 #----------------------------------#
@@ -152,6 +183,9 @@ fi
 exec &> >(tee -a "$LOGFILE")
 
 pushd $SCRIPT_DIR &> /dev/null
+# One process keeps the M1K session and the jig handles between stages
+${PYTHON} m1k_runner.py --serve &
+RUNNER="${PYTHON} m1k_runner.py"
 while :
 do
 	wait_for_firmware_files
@@ -166,7 +200,7 @@ do
 		echo
 		echo_blue "Last run took '$ELAPSED' seconds total"
 	}
-	button="$(${PYTHON} wait_button_pressed.py 2> /dev/null)"
+	button="$(${RUNNER} wait_button_pressed.py 2> /dev/null)"
 	LAST_TIME="$(date +%s)"
 	[ -n "$button" ] || {
 		echo_red "Error while for button to be pressed"
@@ -176,44 +210,55 @@ do
 	}
 	handle_button "$button"
 	export RUN_TIMESTAMP="$(date +"%Y-%m-%d_%H-%M-%S")"
-	run_with_timeout 25.0 ${PYTHON} main_measure_voltage.py "$M1000_BIN" || {
-		echo_red "Measure voltage step failed..."
-		inc_fail_stats
-		sleep 2
-		continue
+	# A board failed by the last run resumes at the failed stage
+	RESUME="$(${RUNNER} checkpoint.py resume 2> /dev/null)"
+	[ -z "$RESUME" ] || echo_green "Resume calibration at $RESUME"
+	stage_pending main_measure_voltage.py && {
+		run_with_timeout 25.0 ${RUNNER} main_measure_voltage.py "$M1000_BIN" || {
+			echo_red "Measure voltage step failed..."
+			inc_fail_stats
+			sleep 2
+			continue
+		}
 	}
-	retry 10 update_serial || {
-		echo_red "Failed to obtain device serial number"
+	retry 10 update_serials || {
+		echo_red "Failed to obtain device serial numbers"
 		inc_fail_stats
 		sleep 2
 		continue
 	}
-	run_with_timeout 20.0 ${PYTHON} main_source_voltage.py || {
-		echo_red "Source voltage step failed..."
-		inc_fail_stats "$serial"
-		sleep 2
-		continue
+	stage_pending main_source_voltage.py && {
+		run_with_timeout 20.0 ${RUNNER} main_source_voltage.py || {
+			echo_red "Source voltage step failed..."
+			inc_fail_stats "$serials"
+			sleep 2
+			continue
+		}
 	}
-	run_with_timeout 20.0 ${PYTHON} main_measure_current.py || {
-		echo_red "Measure current step failed..."
-		inc_fail_stats "$serial"
-		sleep 2
-		continue
+	stage_pending main_measure_current.py && {
+		run_with_timeout 20.0 ${RUNNER} main_measure_current.py || {
+			echo_red "Measure current step failed..."
+			inc_fail_stats "$serials"
+			sleep 2
+			continue
+		}
 	}
-	run_with_timeout 20.0 ${PYTHON} main_source_current.py || {
-		echo_red "Source current step failed..."
-		inc_fail_stats "$serial"
-		sleep 2
-		continue
+	stage_pending main_source_current.py && {
+		run_with_timeout 20.0 ${RUNNER} main_source_current.py || {
+			echo_red "Source current step failed..."
+			inc_fail_stats "$serials"
+			sleep 2
+			continue
+		}
 	}
 	clear
-	run_with_timeout 35.0 ${PYTHON} main_check_performances.py "$FW_VERSION" || {
+	run_with_timeout 35.0 ${RUNNER} main_check_performances.py "$FW_VERSION" || {
 		echo_red "Performance check step failed..."
-		inc_fail_stats "$serial"
+		inc_fail_stats "$serials"
 		sleep 2
 		continue
 	}
-	inc_pass_stats "$serial"
+	inc_pass_stats "$serials"
 done
 # reboot
 popd &> /dev/null
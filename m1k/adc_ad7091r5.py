@@ -1,43 +1,184 @@
 """Module to control ADC AD7091R5."""
 
-from numpy import mean
+from math import sqrt
+
+from numpy import array, mean, uint16
 
 import global_
 
 global_.init()
 
+CONVERSION_RESULT_REG = 0x00
+CHANNEL_REG = 0x01
+CONFIGURATION_REG = 0x02
+CHANNEL_SELECTION = [0x01, 0x02, 0x04, 0x08]
+
+# Linux accepts at most 42 messages in one I2C_RDWR transfer,
+# one of them is used to point at the conversion result register
+RDWR_MAX_READS = 41
+
+# Adaptive averaging reads conversions in blocks and stops when the
+# CONFIDENCE_Z interval of the mean is clear of the check limits by
+# CLEARANCE times its half width, or when the half width is below
+# ADAPTIVE_RESOLUTION codes if there are no limits
+ADAPTIVE_BLOCK = RDWR_MAX_READS
+ADAPTIVE_MIN_SAMPLES = 2 * ADAPTIVE_BLOCK
+CONFIDENCE_Z = 3.0
+CLEARANCE = 2.0
+ADAPTIVE_RESOLUTION = 0.5
+
+# Live view: conversions are streamed in blocks and each one updates an
+# exponentially weighted mean and variance with weight LIVE_ALPHA, a
+# window of about 1 / LIVE_ALPHA conversions
+LIVE_ALPHA = 0.005
+
 
 def init():
     """Initialize the ADC in command mode configuration."""
-    configuration_reg = 0x02
     command_mode_configuration = [0x04, 0xc0]
     global_.bus.write_i2c_block_data(
-        global_.ADC_ID, configuration_reg, command_mode_configuration)
+        global_.ADC_ID, CONFIGURATION_REG, command_mode_configuration)
+
+
+def select_channels(channels):
+    """Select the channels converted by the sequencer.
+
+    In command mode every read of the conversion result register starts
+    a conversion on the next selected channel, so the channel register
+    is written once per burst instead of once per sample.
+    """
+    channel_mask = 0x00
+    for channel in channels:
+        channel_mask |= CHANNEL_SELECTION[channel]
+    global_.bus.write_i2c_block_data(
+        global_.ADC_ID, CHANNEL_REG, [channel_mask])
+
+
+def read_conversions(count):
+    """Read raw conversion words from the conversion result register.
+
+    When the bus supports combined transfers the reads are packed in
+    I2C_RDWR blocks, else each conversion is one block read.
+    """
+    words = []
+    if global_.i2c_msg is not None and hasattr(global_.bus, 'i2c_rdwr'):
+        pointer = global_.i2c_msg.write(
+            global_.ADC_ID, [CONVERSION_RESULT_REG])
+        while len(words) < count:
+            reads = [global_.i2c_msg.read(global_.ADC_ID, 2)
+                     for _ in range(min(count - len(words), RDWR_MAX_READS))]
+            global_.bus.i2c_rdwr(pointer, *reads)
+            for message in reads:
+                conversion_result_bytes = list(message)
+                words.append(
+                    (conversion_result_bytes[0] << 8) |
+                    conversion_result_bytes[1])
+    else:
+        while len(words) < count:
+            conversion_result_bytes = global_.bus.read_i2c_block_data(
+                global_.ADC_ID, CONVERSION_RESULT_REG, 2)
+            words.append(
+                (conversion_result_bytes[0] << 8) |
+                conversion_result_bytes[1])
+    return array(words, dtype=uint16)
+
+
+def burst(channels, sample_count):
+    """Acquire conversions for all channels in one sequencer pass.
+
+    Return a dictionary with a NumPy array of 12 bit codes for each channel.
+    Multi-channel results are split using the channel ID of each conversion.
+    """
+    select_channels(channels)
+    words = read_conversions(sample_count * len(channels))
+    codes = words & 0x0fff
+    if len(channels) == 1:
+        return {channels[0]: codes}
+    channel_ids = (words >> 13) & 0x03
+    return dict(
+        (channel, codes[channel_ids == channel]) for channel in channels)
+
+
+def adaptive_codes(channel, code_limits, max_count):
+    """Average conversions of channel until the check result is clear.
+
+    code_limits is the accepted (low, high) interval in codes or None.
+    Running mean and variance are updated after each block of
+    conversions, at most max_count conversions are read.
+    Return mean code and number of conversions.
+    """
+    if code_limits is not None:
+        code_limits = sorted(code_limits)
+    select_channels([channel])
+    count, mean_code, squares = 0, 0.0, 0.0
+    while count < max_count:
+        codes = read_conversions(
+            min(ADAPTIVE_BLOCK, max_count - count)) & 0x0fff
+        block_mean = codes.mean()
+        block_squares = ((codes - block_mean) ** 2).sum()
+        # Combine block statistics with the running ones
+        delta = block_mean - mean_code
+        total = count + len(codes)
+        mean_code += delta * len(codes) / total
+        squares += block_squares + delta ** 2 * count * len(codes) / total
+        count = total
+        if count < ADAPTIVE_MIN_SAMPLES:
+            continue
+        half_width = CONFIDENCE_Z * sqrt(squares / (count - 1) / count)
+        if code_limits is None:
+            if half_width <= ADAPTIVE_RESOLUTION:
+                break
+        elif min(abs(mean_code - code_limits[0]),
+                 abs(mean_code - code_limits[1])) >= CLEARANCE * half_width:
+            break
+    return mean_code, count
+
+
+def stream_codes(channel):
+    """Yield blocks of codes converted continuously on channel."""
+    select_channels([channel])
+    while True:
+        yield read_conversions(ADAPTIVE_BLOCK) & 0x0fff
+
+
+def ewma_update(statistics, codes, alpha=LIVE_ALPHA):
+    """Update exponentially weighted statistics with codes.
+
+    statistics is (count, mean, variance), (0, 0.0, 0.0) at start. The
+    first 1 / alpha conversions are averaged with equal weights, so the
+    mean is settled before the window is full.
+    Return updated statistics.
+    """
+    count, mean_code, variance = statistics
+    for code in codes:
+        count += 1
+        weight = max(alpha, 1.0 / count)
+        delta = code - mean_code
+        mean_code += weight * delta
+        variance = (1 - weight) * (variance + weight * delta ** 2)
+    return count, mean_code, variance
 
 
 def convert_input(index):
     """Measure voltage from selected input."""
-    conversion_result_reg = 0x00
-    channel_reg = 0x01
-    channel_selection = [0x01, 0x02, 0x04, 0x08]
-    global_.bus.write_i2c_block_data(
-        global_.ADC_ID, channel_reg, [channel_selection[index]])
-    conversion_result_bytes = global_.bus.read_i2c_block_data(
-        global_.ADC_ID, conversion_result_reg, 2)
-    conversion_result_data = (
-        (conversion_result_bytes[0] << 8) |
-        conversion_result_bytes[1]) & 0x0fff
-    return conversion_result_data
+    return int(burst([index], 1)[index][0])
+
+
+def scale_voltage(counts, calibration_factors):
+    """Convert ADC counts in voltage using calibration factors."""
+    adc_1v2_ref = calibration_factors[0]
+    offset = calibration_factors[1]
+    scaling = calibration_factors[2]
+    gain = calibration_factors[3]
+
+    v_lsb = adc_1v2_ref / 4096
+    return round((((counts - offset) * v_lsb) * scaling) * gain, 4)
 
 
 def current_value(offset_current, adc_i_ref, i_ref, sample_count, debug=False):
     """Measure current using calibration factors."""
     i_lsb = i_ref / (adc_i_ref - offset_current)
-    get_crt_val = sample_count
-    conversion_data = []
-    while get_crt_val > 0:
-        conversion_data.append(convert_input(0))
-        get_crt_val -= 1
+    conversion_data = burst([0], sample_count)[0]
     if debug:
         print '\n', 'min', int(min(conversion_data)), \
             'avg', int(mean(conversion_data)), \
@@ -48,21 +189,65 @@ def current_value(offset_current, adc_i_ref, i_ref, sample_count, debug=False):
 
 def voltage_input(channel, calibration_factors, sample_count, debug=False):
     """Measure voltage using calibration factors."""
-    adc_1v2_ref = calibration_factors[0]
-    offset = calibration_factors[1]
-    scaling = calibration_factors[2]
-    gain = calibration_factors[3]
-
-    v_lsb = adc_1v2_ref / 4096
-    get_crt_val = sample_count
-    conversion_data = []
-    while get_crt_val > 0:
-        conversion_data.append(convert_input(channel))
-        get_crt_val -= 1
+    conversion_data = burst([channel], sample_count)[channel]
     if debug:
         print '\n', 'min', int(min(conversion_data)), \
             'avg', int(mean(conversion_data)), \
             'max', int(max(conversion_data))
     counts = int(mean(conversion_data))
-    rezult = round((((counts - offset) * v_lsb) * scaling) * gain, 4)
-    return [rezult, counts]
+    return [scale_voltage(counts, calibration_factors), counts]
+
+
+def voltage_code(voltage, calibration_factors):
+    """Convert voltage in ADC counts, inverse of scale_voltage."""
+    adc_1v2_ref, offset, scaling, gain = calibration_factors
+    return voltage / ((adc_1v2_ref / 4096) * scaling * gain) + offset
+
+
+def adaptive_voltage_input(channel, calibration_factors, limits, max_count):
+    """Measure voltage like voltage_input with adaptive averaging.
+
+    limits is the accepted (low, high) voltage interval of the check
+    made with the result, or None.
+    """
+    code_limits = None
+    if limits is not None:
+        code_limits = [voltage_code(voltage, calibration_factors)
+                       for voltage in limits]
+    counts = int(adaptive_codes(channel, code_limits, max_count)[0])
+    return [scale_voltage(counts, calibration_factors), counts]
+
+
+def adaptive_current_value(offset_current, adc_i_ref, i_ref, limits,
+                           max_count):
+    """Measure current like current_value with adaptive averaging.
+
+    limits is the accepted (low, high) current interval of the check
+    made with the result, or None.
+    """
+    i_lsb = i_ref / (adc_i_ref - offset_current)
+    code_limits = None
+    if limits is not None:
+        code_limits = [current / i_lsb + offset_current for current in limits]
+    counts = int(adaptive_codes(0, code_limits, max_count)[0])
+    return [(counts - offset_current) * i_lsb, hex(counts)]
+
+
+def voltage_inputs(channels, calibration_factors, sample_count, debug=False):
+    """Measure voltage on several channels in one sequencer pass.
+
+    calibration_factors is a dictionary with the factors of each channel.
+    Return a dictionary with [voltage, counts] for each channel.
+    """
+    conversion_data = burst(channels, sample_count)
+    results = {}
+    for channel in channels:
+        if debug:
+            print '\n', 'channel', channel, \
+                'min', int(min(conversion_data[channel])), \
+                'avg', int(mean(conversion_data[channel])), \
+                'max', int(max(conversion_data[channel]))
+        counts = int(mean(conversion_data[channel]))
+        results[channel] = [
+            scale_voltage(counts, calibration_factors[channel]), counts]
+    return results
@@ -59,14 +59,33 @@ _______________________________________________________________________________
 |_____________|_______________________________________|_______________________|
 """
 
-import calibration_file
 import control_m1k
 import debug
 import global_
 import ioxp_adp5589
+import results_db
 
 global_.init()
 
+# Limits of the external 2.5 V reference read by the channels
+EXTERNAL_2V5_LIMITS = (2.4, 2.6)
+
+
+def record_v_i(args, step, raw):
+    """Record voltage and current means of the channel in raw."""
+    index = args['channel_index'] * 2
+    results_db.record(args['device'], step + '_V', args['channel_name'],
+                      raw[index], unit='V')
+    results_db.record(args['device'], step + '_I', args['channel_name'],
+                      raw[index + 1], unit='A')
+
+
+def record_m1k_2v5(args, step, index):
+    """Record M1K 2V5 mean of the channel at index, read during step."""
+    results_db.record(
+        args['device'], step + '_2V5', args['channel_name'],
+        args['m1k_2v5'][args['channel_index'] * 5 + index], unit='V')
+
 
 def measure_chx_external_2v5(args, text):
     """MEASURE CHA/B EXTERNAL 2V5.
@@ -93,7 +112,14 @@ def measure_chx_external_2v5(args, text):
             text['default'])
     args['chx_2v5_ex_ref_raw'][args['channel_index']] = \
         global_.CHX_2V5_EX_REF[args['channel_index'] * 2]
-    if 2.4 > global_.CHX_2V5_EX_REF[args['channel_index'] * 2] < 2.6:
+    passed = EXTERNAL_2V5_LIMITS[0] <= \
+        global_.CHX_2V5_EX_REF[args['channel_index'] * 2] <= \
+        EXTERNAL_2V5_LIMITS[1]
+    results_db.record(
+        args['device'], 'cal_external_2V5', args['channel_name'],
+        global_.CHX_2V5_EX_REF[args['channel_index'] * 2], 2.5,
+        EXTERNAL_2V5_LIMITS, 'V', passed)
+    if not passed:
         print text['red'] + 'FAIL measure external 2.5V channel ' + \
             args['channel_name'] + ':\t' + \
             str(global_.CHX_2V5_EX_REF[args['channel_index'] * 2]) + \
@@ -114,11 +140,9 @@ def measure_chx_external_2v5(args, text):
         print 'ST_0.', args['channel_name'], \
             text['turquoise'] + 'Mean of buffer data:' + text['default'], \
             args['chx_2v5_ex_ref_raw']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Measure external 2V5 with channel ' +
-        args['channel_name'] + ' -> [chx_2v5_ex_ref_raw]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_2v5_ex_ref_raw'], '\n')
+    args['journal'].record(
+        'Measure external 2V5', args['channel_name'],
+        means={'chx_2v5_ex_ref_raw': args['chx_2v5_ex_ref_raw']})
     return args['chx_2v5_ex_ref_raw']
 
 
@@ -154,11 +178,10 @@ def measure_chx_gnd(args, text):
         print 'ST_1.', args['channel_name'], \
             text['turquoise'] + 'Mean of buffer data:' + text['default'], \
             args['chx_v_i_gnd_raw']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Measure GND value with channel ' +
-        args['channel_name'] + ' -> [chx_v_i_gnd_raw]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_v_i_gnd_raw'], '\n')
+    args['journal'].record(
+        'Measure GND value', args['channel_name'],
+        means={'chx_v_i_gnd_raw': args['chx_v_i_gnd_raw']})
+    record_v_i(args, 'cal_gnd', args['chx_v_i_gnd_raw'])
     return args['chx_v_i_gnd_raw']
 
 
@@ -197,11 +220,10 @@ def source_chx_0v_without_load(args, text):
         print 'ST_3.', args['channel_name'], \
             text['turquoise'] + 'Mean of buffer data:' + text['default'], \
             args['chx_f0v_raw']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Source 0V with channel ' +
-        args['channel_name'] + ' -> [chx_f0v_raw]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_f0v_raw'], '\n')
+    args['journal'].record(
+        'Source 0V', args['channel_name'],
+        means={'chx_f0v_raw': args['chx_f0v_raw']})
+    record_v_i(args, 'cal_source_0V', args['chx_f0v_raw'])
     return args['chx_f0v_raw']
 
 
@@ -237,11 +259,10 @@ def source_chx_2v5_without_load(args, text):
         print 'ST_4.', args['channel_name'], \
             text['turquoise'] + 'Mean of buffer data:' + text['default'], \
             args['chx_f2v5_raw']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Source 2V5 with channel ' +
-        args['channel_name'] + ' -> [chx_f2v5_raw]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_f2v5_raw'], '\n')
+    args['journal'].record(
+        'Source 2V5', args['channel_name'],
+        means={'chx_f2v5_raw': args['chx_f2v5_raw']})
+    record_v_i(args, 'cal_source_2V5', args['chx_f2v5_raw'])
     return args['chx_f2v5_raw']
 
 
@@ -323,16 +344,18 @@ def measure_chx_positive_current(args, text):
             args['m1k_2v5'], '\n\t' + \
             text['orange'] + 'M1K_HI_Z_CHX' + text['default'], \
             args['m1k_hi_z_chx']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+',
-        'Measure positive current and M1K CHX with channel ' +
-        args['channel_name'] + ' -> [chx_s5v_raw] [m1k_hi_z_chx] [m1k_2v5]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_s5v_raw'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_hi_z_chx'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_2v5'], '\n')
+    args['journal'].record(
+        'Measure positive current and M1K CHX', args['channel_name'],
+        inputs={'svmi_setpoint': args['svmi_setpoint_poz'],
+                'comp': args['comp_poz']},
+        means={'chx_s5v_raw': args['chx_s5v_raw'],
+               'm1k_hi_z_chx': args['m1k_hi_z_chx'],
+               'm1k_2v5': args['m1k_2v5']})
+    record_v_i(args, 'cal_positive_current', args['chx_s5v_raw'])
+    results_db.record(
+        args['device'], 'cal_positive_current_hi_z', args['channel_name'],
+        args['m1k_hi_z_chx'][args['channel_index'] * 2], unit='V')
+    record_m1k_2v5(args, 'cal_positive_current', 0)
     return args['chx_s5v_raw'], args['m1k_hi_z_chx'], args['m1k_2v5']
 
 
@@ -414,14 +437,18 @@ def measure_chx_negative_current(args, text):
             text['default'], args['m1k_2v5'], '\n\t' + \
             text['orange'] + 'M1K_HI_Z_CHX' + text['default'], \
             args['m1k_hi_z_chx']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+',
-        'Measure negative current and M1K CHX with channel ' +
-        args['channel_name'] + ' -> [chx_s0v_raw] [m1k_hi_z_chx] [m1k_2v5]')
-    calibration_file.write_in_log(args['log_name'], 'a+', args['chx_s0v_raw'])
-    calibration_file.write_in_log(args['log_name'], 'a+', args['m1k_hi_z_chx'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_2v5'], '\n')
+    args['journal'].record(
+        'Measure negative current and M1K CHX', args['channel_name'],
+        inputs={'svmi_setpoint': args['svmi_setpoint_neg'],
+                'comp': args['comp_neg']},
+        means={'chx_s0v_raw': args['chx_s0v_raw'],
+               'm1k_hi_z_chx': args['m1k_hi_z_chx'],
+               'm1k_2v5': args['m1k_2v5']})
+    record_v_i(args, 'cal_negative_current', args['chx_s0v_raw'])
+    results_db.record(
+        args['device'], 'cal_negative_current_hi_z', args['channel_name'],
+        args['m1k_hi_z_chx'][args['channel_index'] * 2 + 1], unit='V')
+    record_m1k_2v5(args, 'cal_negative_current', 1)
     return args['chx_s0v_raw'], args['m1k_hi_z_chx'], args['m1k_2v5']
 
 
@@ -471,12 +498,12 @@ def source_chx_0a_current(args, text):
             args['chx_s0a_raw'], '\n\t' + \
             text['purple'] + 'M1K_2V5' + text['default'], \
             args['m1k_2v5']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Source 0A with channel ' +
-        args['channel_name'] + ' -> [chx_s0a_raw] [m1k_2v5]')
-    calibration_file.write_in_log(args['log_name'], 'a+', args['chx_s0a_raw'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_2v5'], '\n')
+    args['journal'].record(
+        'Source 0A', args['channel_name'], inputs={'srs_i_setpoint': 0.0},
+        means={'chx_s0a_raw': args['chx_s0a_raw'],
+               'm1k_2v5': args['m1k_2v5']})
+    record_v_i(args, 'cal_source_0A', args['chx_s0a_raw'])
+    record_m1k_2v5(args, 'cal_source_0A', 2)
     return args['chx_s0a_raw'], args['m1k_2v5']
 
 
@@ -522,13 +549,13 @@ def source_chx_positive_current(args, text):
             args['chx_s_poz_raw'], '\n\t' + \
             text['purple'] + 'M1K_2V5' + text['default'], \
             args['m1k_2v5']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Source positive current with channel ' +
-        args['channel_name'] + ' -> [chx_s_poz_raw] [m1k_2v5]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_s_poz_raw'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_2v5'], '\n')
+    args['journal'].record(
+        'Source positive current', args['channel_name'],
+        inputs={'srs_i_setpoint': args['srs_i_setpoint_poz']},
+        means={'chx_s_poz_raw': args['chx_s_poz_raw'],
+               'm1k_2v5': args['m1k_2v5']})
+    record_v_i(args, 'cal_source_positive_current', args['chx_s_poz_raw'])
+    record_m1k_2v5(args, 'cal_source_positive_current', 3)
     return args['chx_s_poz_raw'], args['m1k_2v5']
 
 
@@ -574,13 +601,13 @@ def source_chx_negative_current(args, text):
             args['chx_s_neg_raw'], '\n\t' + \
             text['purple'] + 'M1K_2V5' + text['default'], \
             args['m1k_2v5']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', 'Source negative current with channel ' +
-        args['channel_name'] + ' -> [chx_s_neg_raw] [m1k_2v5]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['chx_s_neg_raw'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['m1k_2v5'], '\n')
+    args['journal'].record(
+        'Source negative current', args['channel_name'],
+        inputs={'srs_i_setpoint': args['srs_i_setpoint_neg']},
+        means={'chx_s_neg_raw': args['chx_s_neg_raw'],
+               'm1k_2v5': args['m1k_2v5']})
+    record_v_i(args, 'cal_source_negative_current', args['chx_s_neg_raw'])
+    record_m1k_2v5(args, 'cal_source_negative_current', 4)
     return args['chx_s_neg_raw'], args['m1k_2v5']
 
 
@@ -619,13 +646,17 @@ def calculate_currents(args, text):
             args['m1k_2v5'][args['channel_index'] * 5 + 1],
             args['r_ch_snk'])
         print text['default']
-    calibration_file.write_in_log(
-        args['log_name'], 'a+',
-        'Current calculation for SVMI mode for channel ' +
-        args['channel_name'] +
-        ' -> [calculated_i_poz_ref] [calculated_i_neg_ref]')
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['calculated_i_poz_ref'])
-    calibration_file.write_in_log(
-        args['log_name'], 'a+', args['calculated_i_neg_ref'], '\n')
+    args['journal'].record(
+        'Current calculation for SVMI mode', args['channel_name'],
+        inputs={'r_ch_srs': args['r_ch_srs'], 'r_ch_snk': args['r_ch_snk'],
+                'm1k_hi_z_chx': args['m1k_hi_z_chx'],
+                'm1k_2v5': args['m1k_2v5']},
+        factors={'calculated_i_poz_ref': args['calculated_i_poz_ref'],
+                 'calculated_i_neg_ref': args['calculated_i_neg_ref']})
+    results_db.record(
+        args['device'], 'cal_positive_current_ref', args['channel_name'],
+        args['calculated_i_poz_ref'][args['channel_index']], unit='A')
+    results_db.record(
+        args['device'], 'cal_negative_current_ref', args['channel_name'],
+        args['calculated_i_neg_ref'][args['channel_index']], unit='A')
     return args['calculated_i_poz_ref'], args['calculated_i_neg_ref']
@@ -24,101 +24,114 @@ ____________________________________________________________________________
 |    factors       |   default   |   default   |   default   |   computed  |
 |   channel A&B    |   factors   |   factors   |   factors   |   factors   |
 |__________________|_____________|_____________|_____________|_____________|
-"""
 
+The calibration file is loaded in a CalibrationFile, factors of all
+channels are updated in memory and the file is written once per stage.
+"""
 
-def extract_data_from_log(file_name, line_number):
-    """Extract mean on buffer data from a log file."""
-    with open(file_name, 'r') as text_file:
-        read_lines = text_file.readlines()
-    for char in ' []':
-        read_lines[line_number - 1] = \
-            read_lines[line_number - 1].replace(char, '')
-    resulted_list = read_lines[line_number - 1].split(',')
-    return resulted_list
-
-
-def write_in_log(file_name, mode, data, extra_content=''):
-    """Write mean on buffer data in a log file."""
-    with open(file_name, mode) as log_file:
-        log_file.write(str(data) + '\n' + extra_content)
-
-
-def create_log(file_name):
-    """Create a log file."""
-    with open(file_name, 'w+') as log_file:
-        log_file.write('')
-
-
-def replace_line(file_name, line_number, replace_string, debug=False):
-    """Replace line from text file."""
-    with open(file_name, 'r') as text_file:
-        read_lines = text_file.readlines()
-    with open(file_name, 'w') as text_file:
-        for i, line in enumerate(read_lines, 1):
-            if i == line_number:
-                text_file.writelines(replace_string + '\n')
-            else:
-                text_file.writelines(line)
-    if debug:
+import os
+import re
+
+# Section header, e.g. '# Channel A, measure V'
+SECTION_HEADER = re.compile(r'# Channel ([AB]),? (measure|source) ([VI])')
+PAIR_LINE = re.compile(r'<(\S+), (\S+)>')
+PAIR_FORMAT = '<{0:.4f}, {1:.4f}>\n'
+
+
+class CalibrationFile(object):
+    """Calibration file parsed in sections of <reference, raw> pairs.
+
+    Sections are keyed by channel index and 'measure V', 'measure I',
+    'source V' or 'source I'. Lines other than pairs are kept as read.
+    """
+
+    def __init__(self, text):
+        self.lines = text.splitlines(True)
+        self.pairs = {}
+        self.sections = {}
+        section = None
+        for number, line in enumerate(self.lines):
+            header = SECTION_HEADER.match(line)
+            pair = PAIR_LINE.match(line)
+            if header:
+                section = (ord(header.group(1)) - 65,
+                           header.group(2) + ' ' + header.group(3))
+                self.sections[section] = []
+            elif pair and section is not None:
+                self.sections[section].append(number)
+                self.pairs[number] = (float(pair.group(1)),
+                                      float(pair.group(2)))
+
+    @classmethod
+    def load(cls, file_name):
+        """Read calibration file."""
         with open(file_name, 'r') as text_file:
-            read_lines = text_file.readlines()
-            print read_lines[line_number - 1]
-
-
-def copy_text_file(source, dest):
-    """Copy text file."""
-    with open(source, 'r') as srs, open(dest, 'w') as dst:
-        dst.write(srs.read())
-
-
-def measure_voltage_factors(index, calib_file, factors):
-    """Write calibration factors for measure voltage."""
-    replace_line(calib_file, 3 + index * 26, '<0.0000, {0:.4f}>'.format(
-        factors['chx_v_i_gnd_raw'][index]))
-    replace_line(calib_file, 4 + index * 26, '<{0:.4f}, {1:.4f}>'.format(
-        factors['ex_2v5_ref'], factors['chx_2v5_ex_ref_raw'][index]))
-
-
-def measure_current_factors(index, calib_file, factors):
-    """Write calibration factors for measure current."""
-    replace_line(calib_file, 9 + index * 26, '<0.0000, {0:.4f}>'.format(
-        factors['chx_f0v_raw'][index * 2 + 1]))
-    replace_line(calib_file, 10 + index * 26, '<{0:.4f}, {1:.4f}>'.format(
-        factors['calculated_i_poz_ref'][index],
-        factors['chx_s5v_raw'][index * 2 + 1]))
-    replace_line(calib_file, 11 + index * 26, '<{0:.4f}, {1:.4f}>'.format(
-        factors['calculated_i_neg_ref'][index],
-        factors['chx_s0v_raw'][index * 2 + 1]))
-
-
-def source_voltage_factors(index, calib_file, factors):
-    """Write calibration factors for source voltage."""
-    replace_line(calib_file, 16 + index * 26, '<0.0000, {0:.4f}>'.format(
-        factors['chx_f0v_raw'][index * 2]))
-    replace_line(calib_file, 17 + index * 26, '<2.5000, {0:.4f}>'.format(
-        factors['chx_f2v5_raw'][index * 2]))
-
-
-def source_current_factors(index, calib_file, factors):
-    """Write calibration factors for source current."""
-    replace_line(calib_file, 22 + index * 26, '<0.0000, {0:.4f}>'.format(
-        factors['chx_s0a_raw'][index * 2 + 1]))
-    replace_line(calib_file, 23 + index * 26, '<{0:.4f}, {1:.4f}>'.format(
-        factors['srs_i_setpoint_poz'],
-        factors['chx_s_poz_raw'][index * 2 + 1]))
-    replace_line(calib_file, 24 + index * 26, '<{0:.4f}, {1:.4f}>'.format(
-        factors['srs_i_setpoint_neg'],
-        factors['chx_s_neg_raw'][index * 2 + 1]))
-
-
-def update(channel_index, calib_file, stages, data):
-    """Update calibration file."""
+            return cls(text_file.read())
+
+    def get(self, channel_index, section, row):
+        """Return <reference, raw> pair of a section row."""
+        return self.pairs[self.sections[channel_index, section][row]]
+
+    def set(self, channel_index, section, row, reference, raw):
+        """Change <reference, raw> pair of a section row."""
+        self.pairs[self.sections[channel_index, section][row]] = \
+            (reference, raw)
+
+    def serialize(self):
+        """Return calibration file text."""
+        return ''.join(
+            PAIR_FORMAT.format(*self.pairs[number])
+            if number in self.pairs else line
+            for number, line in enumerate(self.lines))
+
+    def save(self, file_name):
+        """Write calibration file, the file is replaced atomically."""
+        temporary_file = file_name + '.tmp'
+        with open(temporary_file, 'w') as text_file:
+            text_file.write(self.serialize())
+        os.rename(temporary_file, file_name)
+
+
+def measure_voltage_factors(index, calib, factors):
+    """Set calibration factors for measure voltage."""
+    calib.set(index, 'measure V', 0, 0.0, factors['chx_v_i_gnd_raw'][index])
+    calib.set(index, 'measure V', 1, factors['ex_2v5_ref'],
+              factors['chx_2v5_ex_ref_raw'][index])
+
+
+def measure_current_factors(index, calib, factors):
+    """Set calibration factors for measure current."""
+    calib.set(index, 'measure I', 0, 0.0,
+              factors['chx_f0v_raw'][index * 2 + 1])
+    calib.set(index, 'measure I', 1, factors['calculated_i_poz_ref'][index],
+              factors['chx_s5v_raw'][index * 2 + 1])
+    calib.set(index, 'measure I', 2, factors['calculated_i_neg_ref'][index],
+              factors['chx_s0v_raw'][index * 2 + 1])
+
+
+def source_voltage_factors(index, calib, factors):
+    """Set calibration factors for source voltage."""
+    calib.set(index, 'source V', 0, 0.0, factors['chx_f0v_raw'][index * 2])
+    calib.set(index, 'source V', 1, 2.5, factors['chx_f2v5_raw'][index * 2])
+
+
+def source_current_factors(index, calib, factors):
+    """Set calibration factors for source current."""
+    calib.set(index, 'source I', 0, 0.0,
+              factors['chx_s0a_raw'][index * 2 + 1])
+    calib.set(index, 'source I', 1, factors['srs_i_setpoint_poz'],
+              factors['chx_s_poz_raw'][index * 2 + 1])
+    calib.set(index, 'source I', 2, factors['srs_i_setpoint_neg'],
+              factors['chx_s_neg_raw'][index * 2 + 1])
+
+
+def update(channel_index, calib, stages, data):
+    """Update factors of CalibrationFile calib."""
     if stages['first_stage']:
-        measure_voltage_factors(channel_index, calib_file, data)
+        measure_voltage_factors(channel_index, calib, data)
     if stages['second_stage']:
-        source_voltage_factors(channel_index, calib_file, data)
+        source_voltage_factors(channel_index, calib, data)
     if stages['third_stage']:
-        measure_current_factors(channel_index, calib_file, data)
+        measure_current_factors(channel_index, calib, data)
     if stages['fourth_stage']:
-        source_current_factors(channel_index, calib_file, data)
+        source_current_factors(channel_index, calib, data)
@@ -0,0 +1,172 @@
+"""Module to load the calibration board record stored in EEPROM M24C02.
+
+Factors are stored as ASCII text at fixed addresses. The CRC32 of bytes
+0x00-0xF7 is stored as 8 hex characters at CHECKSUM_ADDRESS, it seals
+the record and keys the parsed record cached on disk.
+"""
+
+import json
+import os
+import string
+import zlib
+from collections import namedtuple
+
+import eeprom_m24c02
+import global_
+
+TEXT = global_.TEXT_COLOR_MAP
+
+CHECKSUM_ADDRESS = 0xF8
+CHECKSUM_BYTES = 8
+
+# name, address, number of bytes, type
+FIELDS = [
+    ('ex_2v5_ref', 0x00, 6, 'float'),
+    ('ex_1v2_ref', 0x08, 6, 'float'),
+    ('r_ch_srs', 0x10, 8, 'float'),
+    ('r_ch_snk', 0x18, 8, 'float'),
+    ('msb_dac_srs_1v25', 0x20, 2, 'hex'),
+    ('lsb_dac_srs_1v25', 0x22, 2, 'hex'),
+    ('msb_dac_srs_3v75', 0x25, 2, 'hex'),
+    ('lsb_dac_srs_3v75', 0x27, 2, 'hex'),
+    ('adc_offset_vin1', 0x30, 2, 'int'),
+    ('adc_scale_vin1', 0x33, 6, 'float'),
+    ('adc_gain_vin1', 0x3A, 6, 'float'),
+    ('adc_offset_vin2', 0x40, 2, 'int'),
+    ('adc_scale_vin2', 0x43, 6, 'float'),
+    ('adc_gain_vin2', 0x4A, 6, 'float'),
+    ('adc_offset_vin3', 0x50, 2, 'int'),
+    ('adc_scale_vin3', 0x53, 6, 'float'),
+    ('adc_gain_vin3', 0x5A, 6, 'float'),
+    ('comp_poz', 0x61, 6, 'float'),
+    ('comp_neg', 0x68, 7, 'float'),
+    ('adc_offset_poz', 0x70, 3, 'hex'),
+    ('adc_gain_poz', 0x75, 3, 'hex'),
+    ('i_gain_poz', 0x7A, 6, 'float'),
+    ('adc_offset_neg', 0x80, 3, 'hex'),
+    ('adc_gain_neg', 0x85, 3, 'hex'),
+    ('i_gain_neg', 0x89, 7, 'float')]
+
+
+class CalibrationRecord(
+        namedtuple('CalibrationRecord', [field[0] for field in FIELDS])):
+    """Calibration board factors."""
+
+    __slots__ = ()
+
+    def adc_factors(self, vin):
+        """Return ADC calibration factors for VIN1, VIN2 or VIN3."""
+        return [self.ex_1v2_ref,
+                getattr(self, 'adc_offset_vin' + str(vin)),
+                getattr(self, 'adc_scale_vin' + str(vin)),
+                getattr(self, 'adc_gain_vin' + str(vin))]
+
+    def dac_srs_1v25_cmd(self):
+        """Return DAC command to source 1V25."""
+        return [self.msb_dac_srs_1v25, self.lsb_dac_srs_1v25]
+
+    def dac_srs_3v75_cmd(self):
+        """Return DAC command to source 3V75."""
+        return [self.msb_dac_srs_3v75, self.lsb_dac_srs_3v75]
+
+
+def checksum(memory_content):
+    """Return CRC32 of the sealed part of the memory content."""
+    return zlib.crc32(
+        str(bytearray(memory_content[:CHECKSUM_ADDRESS]))) & 0xffffffff
+
+
+def stored_checksum(checksum_bytes):
+    """Return checksum stored in memory or None if the record is unsealed."""
+    text = str(bytearray(checksum_bytes))
+    if len(text) != CHECKSUM_BYTES or \
+            not all(char in string.hexdigits for char in text):
+        return None
+    return int(text, 16)
+
+
+def parse_field(text, field_type):
+    """Convert field text in value, None if text is not valid."""
+    try:
+        if field_type == 'hex':
+            return int('0x' + text, 16)
+        elif field_type == 'int':
+            return int(float(text))
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse(memory_content):
+    """Parse memory content in calibration record."""
+    return CalibrationRecord(*[
+        parse_field(eeprom_m24c02.unpack_memory_data(
+            memory_content, address, address + nr_of_bytes), field_type)
+        for (_, address, nr_of_bytes, field_type) in FIELDS])
+
+
+def cache_file(crc):
+    """Return path of the cached record for checksum."""
+    return os.path.join(
+        global_.CACHEDIR, 'calibration_record_%08x.json' % crc)
+
+
+def load_cached(crc):
+    """Return cached record for checksum or None."""
+    try:
+        with open(cache_file(crc)) as record_file:
+            return CalibrationRecord(**json.load(record_file))
+    except (IOError, ValueError, TypeError):
+        return None
+
+
+def save_cached(crc, record):
+    """Save record in cache, file is replaced atomically."""
+    temporary_file = cache_file(crc) + '.tmp'
+    with open(temporary_file, 'w') as record_file:
+        json.dump(record._asdict(), record_file)
+    os.rename(temporary_file, cache_file(crc))
+
+
+def load():
+    """Load calibration record.
+
+    For a sealed record only the checksum is read when the record is
+    cached, else the whole memory array is read in one sequential read
+    and the checksum is validated.
+    """
+    crc = stored_checksum(eeprom_m24c02.read_sequential(
+        CHECKSUM_ADDRESS, CHECKSUM_BYTES))
+    if crc is not None:
+        record = load_cached(crc)
+        if record is not None:
+            return record
+    memory_content = eeprom_m24c02.read_sequential(
+        0x00, global_.MEMORY_ARRAY_BYTES)
+    record = parse(memory_content)
+    if crc is None:
+        print TEXT['orange'] + 'Calibration board EEPROM is not sealed, ' \
+            'run configure_calibration_board.py to seal it' + \
+            TEXT['default']
+    elif checksum(memory_content) != crc:
+        print TEXT['red'] + 'Calibration board EEPROM checksum fail... ' + \
+            'Check EEPROM content' + TEXT['default']
+        exit(1)
+    else:
+        save_cached(crc, record)
+    return record
+
+
+def seal():
+    """Write checksum of the current memory content."""
+    memory_content = eeprom_m24c02.read_sequential(
+        0x00, global_.MEMORY_ARRAY_BYTES)
+    crc = checksum(memory_content)
+    eeprom_m24c02.read_write(CHECKSUM_ADDRESS, '%08x' % crc)
+    return crc
+
+
+def is_sealed():
+    """Check if memory contains a checksum."""
+    return stored_checksum(eeprom_m24c02.read_sequential(
+        CHECKSUM_ADDRESS, CHECKSUM_BYTES)) is not None
@@ -1,19 +1,97 @@
 """Module used to check M1K board calibration."""
 
+from collections import namedtuple
+
 import adc_ad7091r5
 import control_m1k
 import dac_ad5647r
 import debug
 import global_
 import ioxp_adp5589
+import parallel_boards
+import reference_cache
+import results_db
 
 global_.init()
-# Init DAC and ADC
-adc_ad7091r5.init()
-dac_ad5647r.init()
+# Init DAC and ADC, once for all the stages run by m1k_runner
+global_.init_device(global_.ADC_ID, adc_ad7091r5.init)
+global_.init_device(global_.DAC_ID, dac_ad5647r.init)
 
 TEXT = global_.TEXT_COLOR_MAP
 
+# Verification steps made for each channel, in the order they are reported.
+# The relays, DAC command and M1K mode of a step are set by run_plan only
+# when they differ from the previous step.
+# name, function relay, aux input, DAC command, M1K mode, setpoint key,
+# ADC input, compared value ('measure': M1K measurement, 'setpoint')
+Step = namedtuple('Step', ['name', 'relay', 'aux', 'dac', 'mode', 'setpoint',
+                           'adc', 'compare'])
+
+PLAN = [
+    Step('measure_2V5', 'GPIO_0__1', False, None, 'HI_Z', None,
+         'vin2', 'measure'),
+    Step('aux_measure_2V5', 'GPIO_0__1', True, None, 'HI_Z', None,
+         'vin2', 'measure'),
+    Step('measure_1V25', 'GPIO_2__1', False, 'dac_srs_1v25_cmd', 'HI_Z',
+         None, 'vin2', 'measure'),
+    Step('measure_3V75', 'GPIO_2__1', False, 'dac_srs_3v75_cmd', 'HI_Z',
+         None, 'vin2', 'measure'),
+    Step('source_0V8', 'GPIO_3__1', False, None, 'SVMI', 'srs_0v8_setpoint',
+         'vin2', 'setpoint'),
+    Step('source_2V5', 'GPIO_3__1', False, None, 'SVMI', 'srs_2v5_setpoint',
+         'vin2', 'setpoint'),
+    Step('source_4V5', 'GPIO_3__1', False, None, 'SVMI', 'srs_4v5_setpoint',
+         'vin2', 'setpoint'),
+    Step('measure_positive_current', 'GPIO_1__1', False, None, 'SVMI',
+         'svmi_setpoint_poz', 'poz', 'measure'),
+    Step('measure_negative_current', 'GPIO_1__1', False, None, 'SVMI',
+         'svmi_setpoint_neg', 'neg', 'measure'),
+    Step('source_positive_current', 'GPIO_1__1', False, None, 'SIMV',
+         'srs_i_setpoint_poz', 'poz', 'setpoint'),
+    Step('source_negative_current', 'GPIO_1__1', False, None, 'SIMV',
+         'srs_i_setpoint_neg', 'neg', 'setpoint')]
+
+# Relay connecting channel A (0) or B (1), or its aux input, to the board
+CHANNEL_RELAYS = {(0, False): 'GPIO_8__1', (1, False): 'GPIO_7__1',
+                  (0, True): 'GPIO_10__1', (1, True): 'GPIO_9__1'}
+
+# DIO test: M1K PIO 0 to 3 (ctrl_transfer pins 4 to 7) are read back on
+# expander port B bits 7 to 4, bit 2 is the M1K 3V3. The pins are driven
+# low one after the other, then high again in the same order, so each
+# step changes one pin and shorted pins follow a unique pattern.
+DIO_LOW = 0x50
+DIO_HIGH = 0x51
+DIO_PINS = [4, 5, 6, 7]
+DIO_BITS = [0x80, 0x40, 0x20, 0x10]
+DIO_3V3_BIT = 0x04
+DIO_PATTERN = [(pin, DIO_LOW) for pin in DIO_PINS] + \
+    [(pin, DIO_HIGH) for pin in DIO_PINS]
+
+# Transition costs used to order the steps, relays are the slowest
+RELAY_TOGGLE_COST = 2
+DAC_CHANGE_COST = 1
+MODE_CHANGE_COST = 1
+
+# Samples discarded after a DAC change with relays already settled and
+# both channels kept in HI_Z, other transitions discard SAMPLES_OFFSET
+DAC_SETTLE_SAMPLES = 250
+
+
+def rail_voltage(name, channel, limits, calibration_factors, adc_samples,
+                 args):
+    """Measure M1K rail on ADC channel, shortened by the reference cache."""
+    def full_measure():
+        """Measure rail with all the ADC samples."""
+        if args['adaptive_adc_averaging']:
+            return adc_ad7091r5.adaptive_voltage_input(
+                channel, calibration_factors, limits, adc_samples)[0]
+        return adc_ad7091r5.voltage_input(
+            channel, calibration_factors, adc_samples)[0]
+    return reference_cache.measure(
+        name, limits, full_measure,
+        lambda: adc_ad7091r5.voltage_input(
+            channel, calibration_factors, adc_ad7091r5.ADAPTIVE_BLOCK)[0])
+
 
 def supply_output_5v0(
         min_lim, max_lim, calibration_factors_vin1, adc_samples, args):
@@ -21,9 +99,13 @@ def supply_output_5v0(
 
     Compare M1K 5V0 with a min and a max value and return PASS or FAIL message
     """
-    m1k_5v0_rail = \
-        adc_ad7091r5.voltage_input(1, calibration_factors_vin1, adc_samples)[0]
-    if m1k_5v0_rail >= min_lim and m1k_5v0_rail < max_lim:
+    m1k_5v0_rail = rail_voltage(
+        'supply_5V0', 1, (min_lim, max_lim), calibration_factors_vin1,
+        adc_samples, args)
+    passed = m1k_5v0_rail >= min_lim and m1k_5v0_rail < max_lim
+    results_db.record(args['device'], 'supply_5V0', None, m1k_5v0_rail,
+                      limits=(min_lim, max_lim), unit='V', passed=passed)
+    if passed:
         result = TEXT['green'] + '5V0 CHECK PASS' + TEXT['default']
         args['status'].append(True)
         args['status_values'].append('{0:.4f}'.format(m1k_5v0_rail))
@@ -45,9 +127,13 @@ def supply_output_2v5(
 
     Compare M1K 2V5 with a min and a max value and return PASS or FAIL message
     """
-    m1k_2v5_rail = \
-        adc_ad7091r5.voltage_input(3, calibration_factors_vin3, adc_samples)[0]
-    if m1k_2v5_rail >= min_lim and m1k_2v5_rail < max_lim:
+    m1k_2v5_rail = rail_voltage(
+        'supply_2V5', 3, (min_lim, max_lim), calibration_factors_vin3,
+        adc_samples, args)
+    passed = m1k_2v5_rail >= min_lim and m1k_2v5_rail < max_lim
+    results_db.record(args['device'], 'supply_2V5', None, m1k_2v5_rail,
+                      limits=(min_lim, max_lim), unit='V', passed=passed)
+    if passed:
         result = TEXT['green'] + '2V5 CHECK PASS' + TEXT['default']
         args['status'].append(True)
         args['status_values'].append('{0:.4f}'.format(m1k_2v5_rail))
@@ -63,643 +149,287 @@ def supply_output_2v5(
     return args['status']
 
 
+def dio_expected():
+    """Return expected PIO 0 to 3 levels after each DIO_PATTERN step."""
+    levels, expected = [1] * len(DIO_PINS), []
+    for pin, request in DIO_PATTERN:
+        levels[DIO_PINS.index(pin)] = int(request == DIO_HIGH)
+        expected.append(tuple(levels))
+    return expected
+
+
+def dio_faults(statuses):
+    """Return faults found in the port B statuses read by the DIO test.
+
+    A pin which does not follow its pattern is stuck low or high, or
+    shorted to the pins whose levels it follows (wired AND or OR).
+    """
+    expected = zip(*dio_expected())
+    observed = [tuple(int(bool(status & bit)) for status in statuses)
+                for bit in DIO_BITS]
+    faults = []
+    for pin, levels in enumerate(observed):
+        if levels == expected[pin]:
+            continue
+        if not any(levels):
+            faults.append('PIO_%d stuck low' % pin)
+        elif all(levels):
+            faults.append('PIO_%d stuck high' % pin)
+        else:
+            shorted = [
+                'PIO_%d' % other for other in range(len(DIO_PINS))
+                if other != pin and levels in (
+                    tuple(a & b for a, b in zip(expected[pin],
+                                                expected[other])),
+                    tuple(a | b for a, b in zip(expected[pin],
+                                                expected[other])))]
+            if shorted:
+                faults.append('PIO_%d short to ' % pin + ', '.join(shorted))
+            else:
+                faults.append('PIO_%d fault' % pin)
+    if not all(status & DIO_3V3_BIT for status in statuses):
+        faults.append('M1K 3V3 low')
+    return faults
+
+
 def user_digital_in_out(device, args):
-    """Digital IO test sequence."""
-    reference_status = \
-        ['0x74', '0x34', '0x14', '0x4', '0x84', '0xc4', '0xe4', '0xf4']
-    repeat = 0
-    while repeat <= 1:
-        status = []
-        ioxp_adp5589.setup_digital_in_out()
-
-        # device.ctrl_transfer(0x40, 0x50, 0, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x50, 4, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x50, 1, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x50, 5, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x50, 2, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x50, 6, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x50, 3, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x50, 7, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x51, 0, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x51, 4, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x51, 1, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x51, 5, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x51, 2, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x51, 6, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-
-        # device.ctrl_transfer(0x40, 0x51, 3, 0, 0, 0, 100)
-        device.ctrl_transfer(0x40, 0x51, 7, 0, 0, 0, 100)
-        status.append(ioxp_adp5589.get_status_digital_in_out())
-        repeat += 1
+    """Digital IO test sequence.
 
+    DIO_PATTERN is driven once, port B is read after each step and
+    faults of the pins are reported.
+    """
+    ioxp_adp5589.setup_digital_in_out()
+    statuses = []
+    for pin, request in DIO_PATTERN:
+        device.ctrl_transfer(0x40, request, pin, 0, 0, 0, 100)
+        statuses.append(ioxp_adp5589.read_status_digital_in_out())
     ioxp_adp5589.direction_port_b(0x00)
 
-    if status == reference_status:
+    faults = dio_faults(statuses)
+    results_db.record(device, 'dio_faults', None, len(faults),
+                      limits=(0, 0), passed=not faults)
+    if not faults:
         result = TEXT['green'] + 'DIO TEST PASS' + TEXT['default']
         args['status'].append(True)
     else:
-        result = TEXT['red'] + 'DIO TEST FAIL' + TEXT['default']
+        result = TEXT['red'] + 'DIO TEST FAIL: ' + ', '.join(faults) + \
+            TEXT['default']
         args['status'].append(False)
         if not args['enable_debug_mode']:
             print result
             exit(1)
     if args['view_short_debug_messages']:
         print result
-    # print status
-    return args['status']
-
-
-def voltage_measurement_2v5(args, text):
-    """MEASURE CHA/B EXTERNAL REFERENCE 2V5.
-
-    Disconnect channels from GND and 2V5 using internal M1K switches
-    Connect channel A or B at 2V5 external reference
-    Set both channels to high impedance mode and get samples
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    control_m1k.set_switches_chs_2v5_gnd(
-        'open', 'open', 'open', 'open', args['device'])
-    if args['restart_verification'] == 0:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_8__1', 'GPIO_0__1', 'EN_1V2__1'])
-    if args['restart_verification'] == 1:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_7__1', 'GPIO_0__1', 'EN_1V2__1'])
-    control_m1k.channels_in_hi_z()
-    control_m1k.get_samples_find_average(args['device'])
-    adc_meas = \
-        adc_ad7091r5.voltage_input(
-            2, args['calibration_factors_vin2'],
-            args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '1__P__CH_' +
-            args['channel_name'] + '_measure_2V5',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
     if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas), \
-            'should be <=', adc_meas * args['tolerance_voltage']
-    if abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas) <= \
-            adc_meas * args['tolerance_voltage']:
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
+        print [hex(status) for status in statuses]
     return args['status']
 
 
-def voltage_measurement_2v5_aux(args, text):
-    """MEASURE CHA/B AUX EXTERNAL REFERENCE 2V5.
-
-    Connect channel A or B auxiliary input at 2V5 external reference
-    Set both channels to high impedance mode and get samples
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    if args['restart_verification'] == 0:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_10__1', 'GPIO_0__1', 'EN_1V2__1'])
-    if args['restart_verification'] == 1:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_9__1', 'GPIO_0__1', 'EN_1V2__1'])
-    control_m1k.channels_in_hi_z()
-    control_m1k.get_samples_find_average(args['device'])
-    adc_meas = \
-        adc_ad7091r5.voltage_input(
-            2, args['calibration_factors_vin2'],
-            args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'),
-            '2__P__CH_' + args['channel_name'] + '_aux_measure_2V5',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas), \
-            'should be <=', adc_meas * args['tolerance_voltage']
-    if abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas) <= \
-            adc_meas * args['tolerance_voltage']:
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_AUX_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_AUX_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
-
+def step_state(step, channel):
+    """Return relays, DAC command and M1K mode needed by step."""
+    return {'relays': frozenset(
+                [CHANNEL_RELAYS[channel, step.aux], step.relay, 'EN_1V2__1']),
+            'dac': step.dac,
+            'mode': ('HI_Z', None) if step.mode == 'HI_Z' else
+                    (step.mode, channel)}
 
-def voltage_measurement_1v25(args, text):
-    """MEASURE CHA/B EXTERNAL 1V25.
 
-    Connect channel A or B at amplified DAC output
-    Set DAC to generate reference voltage
-    Set both channels to high impedance mode and get samples
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    if args['restart_verification'] == 0:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_8__1', 'GPIO_2__1', 'EN_1V2__1'])
-    if args['restart_verification'] == 1:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_7__1', 'GPIO_2__1', 'EN_1V2__1'])
-    dac_ad5647r.set_output(args['dac_srs_1v25_cmd'])
-    control_m1k.channels_in_hi_z()
-    control_m1k.get_samples_find_average(args['device'])
-    adc_meas = \
-        adc_ad7091r5.voltage_input(
-            2, args['calibration_factors_vin2'],
-            args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '3__P__CH_' +
-            args['channel_name'] + '_measure_1V25',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas), \
-            'should be <=', adc_meas * args['tolerance_voltage']
-    if abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas) <= \
-            adc_meas * args['tolerance_voltage']:
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
+def transition_cost(state, new_state):
+    """Return cost of the transition from state to new_state."""
+    if state['relays'] is None:
+        cost = RELAY_TOGGLE_COST * len(new_state['relays'])
     else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
+        cost = RELAY_TOGGLE_COST * \
+            len(state['relays'] ^ new_state['relays'])
+    # DAC output is used only by steps with a DAC command
+    if new_state['dac'] is not None and new_state['dac'] != state['dac']:
+        cost += DAC_CHANGE_COST
+    if new_state['mode'] != state['mode']:
+        cost += MODE_CHANGE_COST
+    return cost
 
 
-def voltage_measurement_3v75(args, text):
-    """MEASURE CHA/B EXTERNAL 3V75.
+def order_steps(steps, state):
+    """Order (channel, PLAN index) steps starting from state.
 
-    Set DAC to generate reference voltage
-    Set both channels to high impedance mode and get samples
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
+    The next step is always the cheapest transition from the current
+    state, ties are kept in PLAN order.
     """
-    dac_ad5647r.set_output(args['dac_srs_3v75_cmd'])
-    control_m1k.channels_in_hi_z()
-    control_m1k.get_samples_find_average(args['device'])
-    adc_meas = \
-        adc_ad7091r5.voltage_input(
-            2, args['calibration_factors_vin2'],
-            args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '4__P__CH_' +
-            args['channel_name'] + '_measure_3V75',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas), \
-            'should be <=', adc_meas * args['tolerance_voltage']
-    if abs(global_.CHX_V_I[args['channel_index'] * 2] - adc_meas) <= \
-            adc_meas * args['tolerance_voltage']:
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [V] CH_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
-
-
-def source_0v8(args, text):
-    """SOURCE CHA/B 0v8.
-
-    Connect channel A or B at 1 Mega load and enable ADC external reference
-    Set channel A or B to source reference voltage and get samples
-    Set again channel A or B to source reference voltage
-    and measure sourced voltage with external ADC
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
+    state = dict(state)
+    remaining = list(steps)
+    ordered = []
+    while remaining:
+        step = min(remaining, key=lambda step: transition_cost(
+            state, step_state(PLAN[step[1]], step[0])))
+        remaining.remove(step)
+        ordered.append(step)
+        new_state = step_state(PLAN[step[1]], step[0])
+        state['relays'] = new_state['relays']
+        state['mode'] = new_state['mode']
+        state['dac'] = new_state['dac'] or state['dac']
+    return ordered
+
+
+def run_plan(args, text, channels=(0, 1)):
+    """Run PLAN steps for channels with the fewest transitions.
+
+    Steps are run in the order returned by order_steps, results are added
+    to the status lists in PLAN order, channel A first, as expected by
+    tft_check_status.
     """
-    if args['restart_verification'] == 0:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_8__1', 'GPIO_3__1', 'EN_1V2__1'])
-    if args['restart_verification'] == 1:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_7__1', 'GPIO_3__1', 'EN_1V2__1'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI,
-        args['srs_0v8_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['srs_0v8_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.voltage_input(
-        2, args['calibration_factors_vin2'], args['adc_samples'])
-    if args['brake_script']:
-        debug.add_break_point(
-            text['orange'] + 'Measure sourced 0v8 with channel ' +
-            args['channel_name'] + ' ... Press ENTER to continue... ' +
-            text['default'])
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '5__P__CH_' +
-            args['channel_name'] + '_source_0V8',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', 'ADC measurement', adc_meas, \
-            'tolerance', args['tolerance_voltage']
-    if abs(adc_meas[0] - args['srs_0v8_setpoint']) <= \
-            args['tolerance_voltage']:
-        debug_message = text['green'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_0v8_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-    else:
-        debug_message = text['red'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_0v8_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
+    steps = [(channel, index)
+             for channel in channels for index in range(len(PLAN))]
+    # Port C relays are unknown before the first step
+    state = {'relays': None, 'dac': None, 'mode': None}
+    results = {}
+    for channel, index in order_steps(steps, state):
+        results[channel, index] = run_step(channel, index, state, args, text)
+    for step in steps:
+        args['status'].append(results[step][0])
+        args['status_values'].append(results[step][1])
     return args['status']
 
 
-def source_2v5(args, text):
-    """SOURCE CHA/B 2V5.
-
-    Set channel A or B to source reference voltage and get samples
-    Set again channel A or B to source reference voltage
-    and measure sourced voltage with external ADC
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['srs_2v5_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['srs_2v5_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.voltage_input(
-        2, args['calibration_factors_vin2'], args['adc_samples'])
-    if args['brake_script']:
-        debug.add_break_point(
-            text['orange'] + 'Measure sourced 2v5 with channel ' +
-            args['channel_name'] + ' ... Press ENTER to continue... ' +
-            text['default'])
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '6__P__CH_' +
-            args['channel_name'] + '_source_2V5',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', 'ADC measurement', adc_meas, \
-            'tolerance', args['tolerance_voltage']
-    if abs(adc_meas[0] - args['srs_2v5_setpoint']) <= \
-            args['tolerance_voltage']:
-        debug_message = text['green'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_2v5_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-    else:
-        debug_message = text['red'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_2v5_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
-
+def relative_limits(reference, tolerance):
+    """Return interval of x with abs(reference - x) <= abs(x * tolerance)."""
+    return sorted([reference / (1 + tolerance), reference / (1 - tolerance)])
 
-def source_4v5(args, text):
-    """SOURCE CHA/B 4V5.
 
-    Set channel A or B to source reference voltage and get samples
-    Set again channel A or B to source reference voltage
-    and measure sourced voltage with external ADC
-    Optional is possible to generate plot images and display debug messages
-    Compare voltage difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['srs_4v5_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['srs_4v5_setpoint'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.voltage_input(
-        2, args['calibration_factors_vin2'], args['adc_samples'])
-    if args['brake_script']:
-        debug.add_break_point(
-            text['orange'] + 'Measure sourced 4v5 with channel ' +
-            args['channel_name'] + ' ... Press ENTER to continue... ' +
-            text['default'])
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '7__P__CH_' +
-            args['channel_name'] + '_source_4V5',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2))
-    if args['view_debug_messages']:
-        print '\n', 'ADC measurement', adc_meas, \
-            'tolerance', args['tolerance_voltage']
-    if abs(adc_meas[0] - args['srs_4v5_setpoint']) <= \
-            args['tolerance_voltage']:
-        debug_message = text['green'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_4v5_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-    else:
-        debug_message = text['red'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_4v5_setpoint']) + \
-            ' [V] CH_' + args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:.4f}'.format(adc_meas[0]))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
+def check_limits(reference, unit, compare, tolerance):
+    """Return interval of ADC results passing a PLAN step check."""
+    if unit == 'V' and compare == 'setpoint':
+        return (reference - tolerance, reference + tolerance)
+    return relative_limits(reference, tolerance)
 
 
-def positive_current_measurement(args, text):
-    """MEASURE POSITIVE CURRENT CHA/B.
+def adc_input(adc, limits, args):
+    """Measure ADC input of a PLAN step, 'vin2', 'poz' or 'neg'.
 
-    Connect channel A or B at Load and enable ADC external reference
-    Set channel A or B to source voltage setpoint and get samples
-    Set again channel A or B to source voltage setpoint
-    and measure resulted current with external ADC and CSA
-    Optional is possible to generate plot images and display debug messages
-    Compare current difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
+    Adaptive averaging stops when the result is clearly inside or
+    outside limits, with args['adc_samples'] conversions at most.
     """
-    if args['restart_verification'] == 0:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_8__1', 'GPIO_1__1', 'EN_1V2__1'])
-    if args['restart_verification'] == 1:
-        ioxp_adp5589.gpo_set_ac(
-            ['GPIO_7__1', 'GPIO_1__1', 'EN_1V2__1'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['svmi_setpoint_poz'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['svmi_setpoint_poz'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.current_value(
-        args['adc_offset_poz'], args['adc_gain_poz'],
-        args['i_gain_poz'], args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '8__P__CH_' +
-            args['channel_name'] + '_measure_positive_current',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2 + 1))
-    if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2 + 1], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2 + 1] - adc_meas), \
-            'should be <=', abs(adc_meas * args['tolerance_current'])
-    if abs(global_.CHX_V_I[args['channel_index'] * 2 + 1] - adc_meas) <= \
-            abs(adc_meas * args['tolerance_current']):
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [A] CH_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [A] CH_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
-
-
-def negative_current_measurement(args, text):
-    """MEASURE NEGATIVE CURRlENT CHA/B.
-
-    Set channel A or B to source voltage setpoint and get samples
-    Set again channel A or B to source voltage setpoint
-    and measure resulted current with external ADC and CSA
-    Optional is possible to generate plot images and display debug messages
-    Compare current difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
+    if adc == 'vin2':
+        if args['adaptive_adc_averaging']:
+            return adc_ad7091r5.adaptive_voltage_input(
+                2, args['calibration_factors_vin2'], limits,
+                args['adc_samples'])[0]
+        return adc_ad7091r5.voltage_input(
+            2, args['calibration_factors_vin2'], args['adc_samples'])[0]
+    factors = [args['adc_offset_' + adc], args['adc_gain_' + adc],
+               args['i_gain_' + adc]]
+    if args['adaptive_adc_averaging']:
+        return adc_ad7091r5.adaptive_current_value(
+            *(factors + [limits, args['adc_samples']]))[0]
+    return adc_ad7091r5.current_value(*(factors + [args['adc_samples']]))[0]
+
+
+def run_step(channel, index, state, args, text):
+    """Make the transition to PLAN step on channel and check the result.
+
+    Only the settings that differ from state are changed, state is
+    updated. M1K samples and the external ADC are measured at the same
+    time. Return status and value reported for the step.
     """
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['svmi_setpoint_neg'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SVMI, args['svmi_setpoint_neg'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.current_value(
-        args['adc_offset_neg'], args['adc_gain_neg'],
-        args['i_gain_neg'], args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '9__P__CH_' +
-            args['channel_name'] + '_measure_negative_current',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2 + 1))
+    step = PLAN[index]
+    new_state = step_state(step, channel)
+    channel_name = chr(channel + 65)
+    if step.adc == 'vin2':
+        unit, value_format, m1k_index = 'V', '{0:.4f}', channel * 2
+        tolerance = args['tolerance_voltage']
+    else:
+        unit, value_format, m1k_index = 'A', '{0:+.4f}', channel * 2 + 1
+        tolerance = args['tolerance_current']
+    # Limits of checks against the M1K measurement are known only after
+    # the capture, their overlapped ADC averaging has no limits
+    limits = None
+    if step.compare == 'setpoint':
+        limits = check_limits(args[step.setpoint], unit, step.compare,
+                              tolerance)
+
+    # Only the relays, DAC and capture use the calibration board, the
+    # other workers run their steps in between
+    with parallel_boards.calibration_board():
+        if parallel_boards.BOARD_LOCK is not None:
+            # Relays and DAC may have been set by another worker
+            state['relays'] = state['dac'] = None
+        settle_samples = global_.SAMPLES_OFFSET
+        if new_state['relays'] != state['relays']:
+            ioxp_adp5589.gpo_set_ac(sorted(new_state['relays']))
+        elif new_state['mode'] == state['mode'] == ('HI_Z', None):
+            settle_samples = min(DAC_SETTLE_SAMPLES, global_.SAMPLES_OFFSET)
+        if step.dac is not None and step.dac != state['dac']:
+            dac_ad5647r.set_output(args[step.dac])
+            state['dac'] = step.dac
+        if step.mode == 'HI_Z':
+            control_m1k.set_switches_chs_2v5_gnd(
+                'open', 'open', 'open', 'open', args['device'])
+            control_m1k.channels_in_hi_z()
+        else:
+            mode = getattr(global_.Mode, step.mode)
+            control_m1k.source(channel, mode, args[step.setpoint],
+                               global_.Mode.HI_Z, args['device'])
+        state['relays'] = new_state['relays']
+        state['mode'] = new_state['mode']
+
+        measurement = control_m1k.capture_with_adc(
+            args['device'], lambda: adc_input(step.adc, limits, args),
+            settle_samples)
+        adc_meas = measurement.adc
+        if step.compare == 'measure':
+            reference = global_.CHX_V_I[m1k_index]
+        else:
+            reference = args[step.setpoint]
+        if step.mode != 'HI_Z' and measurement.overran():
+            # Output may stop with sampling, source again for the ADC
+            control_m1k.source(channel, mode, args[step.setpoint],
+                               global_.Mode.HI_Z, args['device'])
+            adc_meas = adc_input(step.adc, check_limits(
+                reference, unit, step.compare, tolerance), args)
     if args['view_debug_messages']:
-        print '\n', global_.CHX_V_I[args['channel_index'] * 2 + 1], '-', \
-            adc_meas, '=> abs():', \
-            abs(global_.CHX_V_I[args['channel_index'] * 2 + 1] - adc_meas), \
-            'should be <=', abs(adc_meas * args['tolerance_current'])
-    if abs(global_.CHX_V_I[args['channel_index'] * 2 + 1] - adc_meas) <= \
-            abs(adc_meas * args['tolerance_current']):
-        debug_message = text['green'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [A] CH_' + \
-            args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Measure ' + \
-            '{0:+.4f}'.format(adc_meas) + ' [A] CH_' + \
-            args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
-        print debug_message
-    return args['status']
-
+        print '\n', 'M1K during ADC measurement', \
+            measurement.adc_window()[m1k_index].mean()
 
-def positive_current_source(args, text):
-    """SOURCE POSITIVE CURRENT CHA/B.
-
-    Set channel A or B to source reference current and get samples
-    Set again channel A or B to source reference current
-    and measure resulted current with external ADC and CSA
-    Optional is possible to generate plot images and display debug messages
-    Compare current difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SIMV, args['srs_i_setpoint_poz'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SIMV, args['srs_i_setpoint_poz'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.current_value(
-        args['adc_offset_poz'], args['adc_gain_poz'],
-        args['i_gain_poz'], args['adc_samples'])[0]
+    if args['brake_script'] and step.compare == 'setpoint' and unit == 'V':
+        debug.add_break_point(
+            text['orange'] + 'Measure sourced ' +
+            step.name.split('_')[1].lower() + ' with channel ' +
+            channel_name + ' ... Press ENTER to continue... ' +
+            text['default'])
     if args['log_samples']:
         debug.log_samples(
-            str(args['device_id'] + '/Performance'), '10__P__CH_' +
-            args['channel_name'] + '_source_positive_current',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2 + 1))
-    if args['view_debug_messages']:
-        print '\n', 'adc_meas', adc_meas
-    if abs(adc_meas - args['srs_i_setpoint_poz']) <= \
-            abs(adc_meas * args['tolerance_current']):
-        debug_message = text['green'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_i_setpoint_poz']) + \
-            ' [A] CH_' + args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_i_setpoint_poz']) + \
-            ' [A] CH_' + args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
-    if args['view_short_debug_messages']:
+            str(args['device_id'] + '/Performance'),
+            str(index + 1) + '__P__CH_' + channel_name + '_' + step.name,
+            global_.CHX_V_I[4], str(m1k_index))
+
+    error = abs(adc_meas - reference)
+    if step.compare == 'measure':
+        label, value = 'Measure ', adc_meas
+        limit = adc_meas * tolerance
+        if unit == 'A':
+            limit = abs(limit)
+        if args['view_debug_messages']:
+            print '\n', reference, '-', adc_meas, \
+                '=> abs():', error, 'should be <=', limit
+    else:
+        label, value = 'Source  ', reference
+        limit = tolerance if unit == 'V' else abs(adc_meas * tolerance)
+        if args['view_debug_messages']:
+            print '\n', 'ADC measurement', adc_meas, 'tolerance', limit
+
+    passed = error <= limit
+    results_db.record(
+        args['device'], step.name, channel_name, adc_meas, reference,
+        (reference - limit, reference + limit), unit, passed)
+    debug_message = (text['green'] if passed else text['red']) + label + \
+        '{0:+.4f}'.format(value) + ' [' + unit + '] CH_' + \
+        ('AUX_' if step.aux else '') + channel_name + \
+        (' PASS' if passed else ' FAIL') + text['default']
+    if not passed and not args['enable_debug_mode']:
         print debug_message
-    return args['status']
-
-
-def negative_current_source(args, text):
-    """SOURCE NEGATIVE CURRENT CHA/B.
-
-    Set channel A or B to source reference current and get samples
-    Set again channel A or B to source reference current
-    and measure resulted current with external ADC and CSA
-    Optional is possible to generate plot images and display debug messages
-    Compare current difference between measurement and reference
-    to be in reference range then print PASS or FAIL message
-    """
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SIMV, args['srs_i_setpoint_neg'],
-        global_.Mode.HI_Z, args['device'])
-    control_m1k.get_samples_find_average(args['device'])
-    control_m1k.source(
-        args['channel_index'], global_.Mode.SIMV, args['srs_i_setpoint_neg'],
-        global_.Mode.HI_Z, args['device'])
-    adc_meas = adc_ad7091r5.current_value(
-        args['adc_offset_neg'], args['adc_gain_neg'],
-        args['i_gain_neg'], args['adc_samples'])[0]
-    if args['log_samples']:
-        debug.log_samples(
-            str(args['device_id'] + '/Performance'), '11__P__CH_' +
-            args['channel_name'] + '_source_negative_current',
-            global_.CHX_V_I[4], str(args['channel_index'] * 2 + 1))
-    if args['view_debug_messages']:
-        print '\n', 'adc_meas', adc_meas
-    if abs(adc_meas - args['srs_i_setpoint_neg']) <= \
-            abs(adc_meas * args['tolerance_current']):
-        debug_message = text['green'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_i_setpoint_neg']) + \
-            ' [A] CH_' + args['channel_name'] + ' PASS' + text['default']
-        args['status'].append(True)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-    else:
-        debug_message = text['red'] + 'Source  ' + \
-            '{0:+.4f}'.format(args['srs_i_setpoint_neg']) + \
-            ' [A] CH_' + args['channel_name'] + ' FAIL' + text['default']
-        args['status'].append(False)
-        args['status_values'].append('{0:+.4f}'.format(adc_meas))
-        if not args['enable_debug_mode']:
-            print debug_message
-            exit(1)
+        exit(1)
     if args['view_short_debug_messages']:
         print debug_message
-    return args['status']
+    return passed, value_format.format(adc_meas)
 
 
 def check_current_offset(args, text):
@@ -0,0 +1,119 @@
+"""Module used to resume the calibration of a board at the failed stage.
+
+At the end of each calibration stage the calibration file and the
+journal (raw means and factors) of the device are saved in a checkpoint
+per serial number. When a run fails, the next run restores them in its
+log directory and starts at the stage after the last one saved, if:
+- the checkpoint is not older than M1K_CHECKPOINT_MAX_AGE seconds,
+- the board is still held by the session of m1k_runner that saved it
+  and the USB power was not switched off since (no power cycle).
+
+Usage: python checkpoint.py resume
+    Print the stage script to run next, nothing if the calibration
+    starts again from the first stage.
+"""
+import json
+import os
+import sys
+from time import time
+
+import global_
+
+CHECKPOINT_DIR = os.path.join(global_.CACHEDIR, 'checkpoints')
+if not os.path.exists(CHECKPOINT_DIR):
+    os.makedirs(CHECKPOINT_DIR)
+
+MAX_AGE = float(os.getenv('M1K_CHECKPOINT_MAX_AGE', '600'))
+
+# Stage scripts, in the order run by adalm_1000_factory.sh
+STAGES = ['main_measure_voltage.py', 'main_source_voltage.py',
+          'main_measure_current.py', 'main_source_current.py',
+          'main_check_performances.py']
+
+
+def file_name(serial):
+    """Return checkpoint file name of the device with serial number."""
+    return os.path.join(CHECKPOINT_DIR, serial + '.json')
+
+
+def save(restart_calibration, calibration_file_name, journal):
+    """Save checkpoint of the stage ended at restart_calibration index."""
+    journal.flush()
+    with open(calibration_file_name, 'r') as calibration:
+        calibration_text = calibration.read()
+    with open(journal.file_name, 'r') as journal_file:
+        journal_text = journal_file.read()
+    checkpoint = {'serial': global_.dev.serial,
+                  'stage': STAGES[restart_calibration // 2],
+                  'next': STAGES[restart_calibration // 2 + 1],
+                  'time': round(time(), 3),
+                  'session': global_.session_id,
+                  'run': os.getenv('RUN_TIMESTAMP', 'unknown_time'),
+                  'calibration': calibration_text,
+                  'journal': journal_text}
+    # Written in a temporary file, a stage killed by its timeout does
+    # not leave a partial checkpoint
+    temporary = file_name(global_.dev.serial) + '.tmp'
+    with open(temporary, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.rename(temporary, file_name(global_.dev.serial))
+
+
+def load(serial):
+    """Return checkpoint of the device, None if there is none."""
+    try:
+        with open(file_name(serial), 'r') as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (IOError, ValueError):
+        return None
+
+
+def discard(serial):
+    """Remove checkpoint of the device."""
+    if os.path.exists(file_name(serial)):
+        os.remove(file_name(serial))
+
+
+def is_valid(checkpoint):
+    """Check if checkpoint was saved for the board still powered in the
+    current session, less than MAX_AGE seconds ago."""
+    if checkpoint is None or global_.session_id is None or \
+            checkpoint['session'] != global_.session_id:
+        return False
+    if global_.usb is None or not global_.usb.value:
+        return False
+    if time() - checkpoint['time'] > MAX_AGE:
+        return False
+    # The board must still be attached, not only held by the session
+    global_.session.scan()
+    return checkpoint['serial'] in \
+        [device.serial for device in global_.session.available_devices]
+
+
+def resume():
+    """Restore checkpoint of the device held by the session.
+
+    Calibration file and journal are written in the log directory of the
+    current run. Return the stage script to run next, None if the
+    calibration starts again.
+    """
+    if global_.session is None or len(global_.session.devices) != 1:
+        return None
+    device = global_.session.devices[0]
+    checkpoint = load(device.serial)
+    if not is_valid(checkpoint):
+        return None
+    global_.dev = device
+    device_dir = global_.device_log_dir()
+    with open(os.path.join(device_dir, 'calib.txt'), 'w') as calibration:
+        calibration.write(checkpoint['calibration'])
+    with open(os.path.join(device_dir, 'log.jsonl'), 'w') as journal_file:
+        journal_file.write(checkpoint['journal'])
+    return checkpoint['next']
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['resume']:
+        NEXT_STAGE = resume()
+        if NEXT_STAGE:
+            print NEXT_STAGE
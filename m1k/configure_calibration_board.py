@@ -2,9 +2,12 @@
 import signal
 import sys
 import types
-from time import sleep
+from math import sqrt
+from select import select
+from time import time
 
 import adc_ad7091r5
+import calibration_record
 import dac_ad5647r
 import eeprom_m24c02
 import global_
@@ -20,6 +23,12 @@ usb.on()
 COMMANDS = ['a', 'b', 'c', 'd', 'e', 'f', 'g',
             'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o']
 
+# ADC checks stream conversions and refresh the reading every
+# LIVE_REFRESH_SAMPLES conversions, else each reading is a new
+# measurement of up to 1000 conversions
+LIVE_VIEW = True
+LIVE_REFRESH_SAMPLES = 100
+
 
 def load_lists():
     """Define commands and settings."""
@@ -42,6 +51,7 @@ def write_in_eeprom(flag, memmory_address, memmory_data):
         key_2 = wait_key('\r\tWrite in EEPROM? <y/n>: ', 1)
         if key_2 == 'y':
             eeprom_m24c02.read_write(memmory_address, memmory_data)
+            calibration_record.seal()
             break
         if key_2 == 'n':
             break
@@ -96,12 +106,48 @@ def menu():
     print TEXT['turquoise'], menu.__doc__, TEXT['default']
 
 
+def live_view(channel, offset, lsb, unit):
+    """Display ADC channel reading until ENTER is pressed.
+
+    Reading is (code - offset) * lsb with the exponentially weighted
+    mean code, its standard deviation and trend per second. Return
+    [reading, code] of the last mean.
+    """
+    statistics = (0, 0.0, 0.0)
+    trend, last, shown = 0.0, None, 0
+    for codes in adc_ad7091r5.stream_codes(channel):
+        statistics = adc_ad7091r5.ewma_update(statistics, codes)
+        count, mean_code, variance = statistics
+        if count - shown < LIVE_REFRESH_SAMPLES:
+            continue
+        shown = count
+        reading = (mean_code - offset) * lsb
+        if last is not None:
+            # Slope of the mean, smoothed over the window of the mean
+            slope = (reading - last[1]) / max(time() - last[0], 1e-6)
+            trend += (slope - trend) * min(
+                1.0, adc_ad7091r5.LIVE_ALPHA * LIVE_REFRESH_SAMPLES)
+        last = (time(), reading)
+        output('\t ADC: {0:+.5f} {1}  std {2:.5f}  trend {3:+.5f} {1}/s  '
+               .format(reading, unit, sqrt(variance) * abs(lsb), trend))
+        sys.stdout.flush()
+        if select([sys.stdin], [], [], 0)[0] and \
+                sys.stdin.readline().strip() == '':
+            break
+    print
+    return [reading, int(mean_code)]
+
+
 def check_adc(channel, ex_1v2_ref, adc_offset, adc_scale, adc_gain):
     """Check ADC calibration for selected channel."""
+    if LIVE_VIEW:
+        return live_view(channel, adc_offset,
+                         ex_1v2_ref / 4096 * adc_scale * adc_gain, 'V')
     done = False
     while not done:
         adc_params = [ex_1v2_ref, adc_offset, adc_scale, adc_gain]
-        adc = adc_ad7091r5.voltage_input(channel, adc_params, 1000)
+        adc = adc_ad7091r5.adaptive_voltage_input(
+            channel, adc_params, None, 1000)
         key = wait_key('\t ADC: {:<20}              \r'.format(adc), 1)
         if key == '':
             done = True
@@ -111,9 +157,13 @@ def check_adc(channel, ex_1v2_ref, adc_offset, adc_scale, adc_gain):
 
 def check_adc_csa(offset_i, adc_i_ref, i_ref):
     """Check ADC calibration for selected channel."""
+    if LIVE_VIEW:
+        live_view(0, offset_i, float(i_ref) / (adc_i_ref - offset_i), 'A')
+        return
     done = False
     while not done:
-        adc = adc_ad7091r5.current_value(offset_i, adc_i_ref, i_ref, 1000)
+        adc = adc_ad7091r5.adaptive_current_value(
+            offset_i, adc_i_ref, i_ref, None, 1000)
         key = wait_key('\t ADC: {:<20}              \r'.format(adc), 1)
         if key == '':
             done = True
@@ -122,43 +172,36 @@ def check_adc_csa(offset_i, adc_i_ref, i_ref):
 
 def predetermine_resistance(polarity):
     """Calculate resistance besed on ADC measurements after calibration."""
-    ex_1v2_ref = eeprom_m24c02.read_write(0x08, '', 8, 'float')
+    record = calibration_record.load()
+    adc_offset_poz = record.adc_offset_poz
+    adc_gain_poz = record.adc_gain_poz
+    i_gain_poz = record.i_gain_poz
 
-    adc_offset_vin3 = int(eeprom_m24c02.read_write(0x50, '', 2, 'float'))
-    adc_scale_vin3 = eeprom_m24c02.read_write(0x53, '', 6, 'float')
-    adc_gain_vin3 = eeprom_m24c02.read_write(0x5A, '', 6, 'float')
-    adc_params_3 = [ex_1v2_ref, adc_offset_vin3, adc_scale_vin3, adc_gain_vin3]
+    adc_offset_neg = record.adc_offset_neg
+    adc_gain_neg = record.adc_gain_neg
+    i_gain_neg = record.i_gain_neg
 
-    adc_offset_vin2 = int(eeprom_m24c02.read_write(0x40, '', 2, 'float'))
-    adc_scale_vin2 = eeprom_m24c02.read_write(0x43, '', 6, 'float')
-    adc_gain_vin2 = eeprom_m24c02.read_write(0x4A, '', 6, 'float')
-    adc_params_2 = [ex_1v2_ref, adc_offset_vin2, adc_scale_vin2, adc_gain_vin2]
-
-    adc_offset_poz = int(eeprom_m24c02.read_write(0x70, '', 3, 'hex'), 16)
-    adc_gain_poz = int(eeprom_m24c02.read_write(0x75, '', 3, 'hex'), 16)
-    i_gain_poz = eeprom_m24c02.read_write(0x7A, '', 6, 'float')
-
-    adc_offset_neg = int(eeprom_m24c02.read_write(0x80, '', 3, 'hex'), 16)
-    adc_gain_neg = int(eeprom_m24c02.read_write(0x85, '', 3, 'hex'), 16)
-    i_gain_neg = eeprom_m24c02.read_write(0x89, '', 7, 'float')
+    comp_poz = record.comp_poz
+    comp_neg = record.comp_neg
 
-    comp_poz = eeprom_m24c02.read_write(0x61, '', 6, 'float')
-    comp_neg = eeprom_m24c02.read_write(0x68, '', 7, 'float')
+    adc_params = {2: record.adc_factors(2), 3: record.adc_factors(3)}
 
     if polarity == 'poz':
-        ref_2v5_srs = adc_ad7091r5.voltage_input(3, adc_params_3, 1000)[0]
-        chx_voltage_srs = adc_ad7091r5.voltage_input(2, adc_params_2, 1000)[0]
-        current_chx_poz = adc_ad7091r5.current_value(
-            adc_offset_poz, adc_gain_poz, i_gain_poz, 1000)[0]
+        voltages = adc_ad7091r5.voltage_inputs([2, 3], adc_params, 1000)
+        ref_2v5_srs = voltages[3][0]
+        chx_voltage_srs = voltages[2][0]
+        current_chx_poz = adc_ad7091r5.adaptive_current_value(
+            adc_offset_poz, adc_gain_poz, i_gain_poz, None, 1000)[0]
         voltage = chx_voltage_srs + comp_poz - ref_2v5_srs
         resistance_srs = voltage / current_chx_poz
         print(resistance_srs)
 
     if polarity == 'neg':
-        ref_2v5_snc = adc_ad7091r5.voltage_input(3, adc_params_3, 1000)[0]
-        chx_voltage_snc = adc_ad7091r5.voltage_input(2, adc_params_2, 1000)[0]
-        current_chx_neg = adc_ad7091r5.current_value(
-            adc_offset_neg, adc_gain_neg, i_gain_neg, 1000)[0]
+        voltages = adc_ad7091r5.voltage_inputs([2, 3], adc_params, 1000)
+        ref_2v5_snc = voltages[3][0]
+        chx_voltage_snc = voltages[2][0]
+        current_chx_neg = adc_ad7091r5.adaptive_current_value(
+            adc_offset_neg, adc_gain_neg, i_gain_neg, None, 1000)[0]
         voltage = chx_voltage_snc + comp_neg - ref_2v5_snc
         resistance_snc = voltage / current_chx_neg
         print(resistance_snc)
@@ -755,19 +798,14 @@ def output(string_text):
 
 def format_eeprom_with_spaces_if_empty():
     """Format EEPROM with spaces."""
-    add, memory_content = 0x00, []
-    while add <= global_.MEMORY_ARRAY_BYTES - global_.PAGE_SIZE:
-        sleep(0.01)
-        read_data = global_.bus.read_i2c_block_data(
-            global_.EEPROM_ID, add, global_.PAGE_SIZE)
-        memory_content.append(eeprom_m24c02.unpack_memory_data(
-            read_data, 0, global_.PAGE_SIZE))
-        add += global_.PAGE_SIZE
-    if all(list_item == memory_content[0] for list_item in memory_content):
+    memory_content = eeprom_m24c02.read_sequential(
+        0x00, global_.MEMORY_ARRAY_BYTES)
+    pages = [memory_content[add:add + global_.PAGE_SIZE] for add in range(
+        0, global_.MEMORY_ARRAY_BYTES, global_.PAGE_SIZE)]
+    if all(page == pages[0] for page in pages):
         print 'Format EEPROM since is empty'
-        for memory_index in range(16):
-            memory_address = int(hex(memory_index) + '0', 16)
-            eeprom_m24c02.read_write(memory_address, '                ')
+        eeprom_m24c02.write_sequential(
+            0x00, bytearray(' ' * global_.MEMORY_ARRAY_BYTES))
         eeprom_m24c02.read_memory_content()
     else:
         print 'Skip EEPROM formatting'
@@ -788,6 +826,8 @@ def set_channel_a_mode(received_mode, setpoint):
 
 if __name__ == "__main__":
     format_eeprom_with_spaces_if_empty()
+    if not calibration_record.is_sealed():
+        calibration_record.seal()
 
     SESSION = Session()
     VALID_SETPOINT = 0.0
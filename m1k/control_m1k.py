@@ -1,43 +1,139 @@
 """Module used to control M1K board."""
-import commands
-from time import sleep
+import os
+import subprocess
+from collections import namedtuple
+from threading import Thread
+from time import sleep, time
 
-from numpy import mean
+from numpy import array
 
 import global_
 from gpiozero import LED
+from pysmu import Session
+
+try:
+    # udev events wake the device detection as soon as the M1K enumerates
+    import pyudev
+except ImportError:
+    pyudev = None
 
 global_.init()
 
+# ADALM1000 USB vendor and product ID
+M1K_USB_ID = ('064b', '784c')
+ENUMERATION_TIMEOUT = 10
+# Session is checked again at this interval if no udev event wakes it
+SESSION_POLL_INTERVAL = 0.5
+# Default M1K sample rate and the delay before samples start streaming
+SAMPLE_RATE = 100000
+STREAM_START_DELAY = 0.005
+# smu firmware upload messages: no board in SAM-BA mode yet, to retry,
+# or upload failed
+FLASH_RETRY_MESSAGES = [
+    'smu: failed updating firmware: no devices found in SAM-BA mode',
+    'smu: failed updating firmware: failed to read SAM-BA response: ' +
+    'Operation timed out']
+FLASH_EXIT_MESSAGES = [
+    'smu: failed updating firmware: failed to open firmware file',
+    'smu: error initializing session: Device or resource busy',
+    'smu: failed updating firmware: failed to read SAM-BA response: ' +
+    'Input/Output Error']
+# Switches connecting channel A to 2V5 and GND, channel B to 2V5 and GND
+SWITCH_PINS = [32, 33, 37, 38]
+
+# Switch positions and channel modes last set on each M1K, by serial
+# number. A new session may hold re-enumerated boards in their power on
+# state, so the state is forgotten when a session is created.
+m1k_state = {}
+
+# udev monitor of the process. pyudev closes its netlink socket only
+# when the monitor is collected, so one monitor is kept and reused
+# instead of one per wait_for_device call.
+event_monitor = None
+
+
+class OverlappedMeasurement(namedtuple(
+        'OverlappedMeasurement',
+        ['samples', 'adc', 'settle_samples', 'capture_start', 'capture_end',
+         'adc_start', 'adc_end'])):
+    """M1K samples and ADC result measured at the same time.
+
+    Times are time() values, samples are the used samples returned by
+    get_samples_array.
+    """
+
+    __slots__ = ()
+
+    def overran(self):
+        """Check if the ADC measurement ended after the M1K capture."""
+        return self.adc_end > self.capture_end
+
+    def adc_window(self):
+        """Return used samples taken while the ADC was measuring."""
+        stream_start = self.capture_start + STREAM_START_DELAY
+        first = int((self.adc_start - stream_start) * SAMPLE_RATE) - \
+            self.settle_samples
+        last = int((self.adc_end - stream_start) * SAMPLE_RATE) - \
+            self.settle_samples
+        return self.samples[:, max(first, 0):max(last, 1)]
+
+
+def output_lines(stream):
+    """Yield lines of stream as soon as they are written.
+
+    Progress lines ended by a carriage return are yielded too.
+    """
+    line = ''
+    while True:
+        char = stream.read(1)
+        if not char:
+            break
+        if char in '\r\n':
+            if line:
+                yield line
+            line = ''
+        else:
+            line += char
+    if line:
+        yield line
+
+
+def flash_firmware(firmware_file, progress=None):
+    """Run firmware upload command, return its last output line.
+
+    Each output line is passed to progress while smu is running.
+    """
+    process = subprocess.Popen(['smu', '-f', firmware_file],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    message = ''
+    for message in output_lines(process.stdout):
+        if progress is not None:
+            progress(message)
+    process.wait()
+    return message
+
 
 def upload_firmware(firwmare_file, retry, text):
     """Upload firmware.
 
-    Run firmare upload command and print returned message.
+    Run firmare upload command and print its messages while it runs.
     Loop every seccond firmware upload command maximum n attempts
     then exit or continue depending on returned message
     """
-    err_msg_retry = [
-        'smu: failed updating firmware: no devices found in SAM-BA mode',
-        'smu: failed updating firmware: failed to read SAM-BA response: ' +
-        'Operation timed out']
-    err_msg_exit = [
-        'smu: failed updating firmware: failed to open firmware file',
-        'smu: error initializing session: Device or resource busy',
-        'smu: failed updating firmware: failed to read SAM-BA response: ' +
-        'Input/Output Error']
+    def progress(line):
+        """Print upload progress, errors are handled below."""
+        if line not in FLASH_RETRY_MESSAGES + FLASH_EXIT_MESSAGES:
+            print text['green'] + line + text['default']
+
     print text['green'] + '\nStart flash device...' + text['default']
 
-    firmware_update_msg = commands.getstatusoutput(
-        'smu -f ' + firwmare_file)[1]
-    if firmware_update_msg in err_msg_exit:
+    firmware_update_msg = flash_firmware(firwmare_file, progress)
+    if firmware_update_msg in FLASH_EXIT_MESSAGES:
         print text['red'] + firmware_update_msg + text['default']
         exit(1)
-    if firmware_update_msg not in err_msg_retry:
-        print text['green'] + firmware_update_msg + text['default']
-    while firmware_update_msg in err_msg_retry:
-        firmware_update_msg = commands.getstatusoutput(
-            'smu -f ' + firwmare_file)[1]
+    while firmware_update_msg in FLASH_RETRY_MESSAGES:
+        firmware_update_msg = flash_firmware(firwmare_file, progress)
         sleep(1)
         retry -= 1
         if retry <= 0:
@@ -45,102 +141,215 @@ def upload_firmware(firwmare_file, retry, text):
             exit(1)
 
 
+def usb_power():
+    """Return the output switching the M1K USB power.
+
+    The pin is reserved once per process, so stages run by m1k_runner
+    share it.
+    """
+    if global_.usb is None:
+        global_.usb = LED(12)
+    return global_.usb
+
+
+def usb_event_monitor():
+    """Return udev monitor for USB devices, None if pyudev is missing.
+
+    Events received since the last wait are discarded.
+    """
+    global event_monitor
+    if pyudev is None:
+        return None
+    if event_monitor is None:
+        event_monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        event_monitor.filter_by(subsystem='usb', device_type='usb_device')
+        event_monitor.start()
+    while event_monitor.poll(timeout=0) is not None:
+        pass
+    return event_monitor
+
+
+def is_m1k_added(event):
+    """Check if udev event is an ADALM1000 enumeration."""
+    return event is not None and event.action == 'add' and \
+        (event.get('ID_VENDOR_ID'), event.get('ID_MODEL_ID')) == M1K_USB_ID
+
+
+def wait_for_device(text, timeout=ENUMERATION_TIMEOUT):
+    """Wait for the M1K to be detected in a session.
+
+    The session is created again when udev reports the ADALM1000 or,
+    without pyudev, at every poll interval. Exit if the device is not
+    detected in timeout seconds, else log enumeration latency.
+    """
+    if global_.session is not None and global_.session.devices:
+        return global_.session
+    start = time()
+    monitor = usb_event_monitor()
+    forget_m1k_state()
+    global_.session = Session()
+    last_check = time()
+    while not global_.session.devices:
+        remaining = start + timeout - time()
+        if remaining <= 0:
+            print text['red'] + 'M1K not detected after ' + str(timeout) + \
+                ' seconds' + text['default']
+            exit(1)
+        wait = min(remaining, SESSION_POLL_INTERVAL)
+        if monitor is None:
+            sleep(wait)
+        elif not is_m1k_added(monitor.poll(timeout=wait)) and \
+                time() - last_check < SESSION_POLL_INTERVAL:
+            continue
+        global_.session = Session()
+        last_check = time()
+    global_.session_id = '%d-%.3f' % (os.getpid(), time())
+    log_enumeration_latency(time() - start)
+    return global_.session
+
+
+def log_enumeration_latency(latency):
+    """Append enumeration latency to the jig metrics log."""
+    with open(os.path.join(global_.LOGDIR, '_enumeration.log'), 'a') as log:
+        log.write(os.getenv('RUN_TIMESTAMP', 'unknown_time') + ' ' +
+                  str(round(latency, 3)) + '\n')
+
+
+def forget_m1k_state():
+    """Forget switch positions and channel modes set on the M1K boards."""
+    m1k_state.clear()
+
+
+def set_switch(device, pin, position):
+    """Close or open an M1K switch unless it is already in position."""
+    state = m1k_state.setdefault(device.serial, {})
+    if state.get(pin) == position:
+        return
+    device.ctrl_transfer(
+        0x40, 0x50 if position == 'close' else 0x51, pin, 0, 0, 0, 100)
+    state[pin] = position
+
+
+def set_channel_mode(channel_name, mode):
+    """Set mode of channel 'A' or 'B' unless it is already set."""
+    state = m1k_state.setdefault(global_.dev.serial, {})
+    if state.get(channel_name) == mode:
+        return
+    if channel_name == 'A':
+        global_.CHA.mode = mode
+    else:
+        global_.CHB.mode = mode
+    state[channel_name] = mode
+
+
 def channels_in_hi_z():
     """Set channel A and B in HI_Z mode."""
-    global_.CHA.mode = global_.Mode.HI_Z
-    global_.CHB.mode = global_.Mode.HI_Z
+    set_channel_mode('A', global_.Mode.HI_Z)
+    set_channel_mode('B', global_.Mode.HI_Z)
 
 
 def set_switches_chs_2v5_gnd(cha_2v5, cha_gnd, chb_2v5, chb_gnd, device):
-    """Set M1K switches state."""
+    """Set M1K switches state.
+
+    Only switches which are not already in the requested state are
+    changed, each change is one USB control transfer.
+    """
     function_name = set_switches_chs_2v5_gnd.__name__
-    if cha_2v5 == 'close':
-        device.ctrl_transfer(0x40, 0x50, 32, 0, 0, 0, 100)
-    elif cha_2v5 == 'open':
-        device.ctrl_transfer(0x40, 0x51, 32, 0, 0, 0, 100)
-    else:
-        print 'invalid value 1st arg ' + function_name
+    positions = [cha_2v5, cha_gnd, chb_2v5, chb_gnd]
+    for number, (pin, position) in enumerate(zip(SWITCH_PINS, positions)):
+        if position in ('close', 'open'):
+            set_switch(device, pin, position)
+        else:
+            print 'invalid value ' + ['1st', '2nd', '3rd', '4th'][number] + \
+                ' arg ' + function_name
 
-    if cha_gnd == 'close':
-        device.ctrl_transfer(0x40, 0x50, 33, 0, 0, 0, 100)
-    elif cha_gnd == 'open':
-        device.ctrl_transfer(0x40, 0x51, 33, 0, 0, 0, 100)
-    else:
-        print 'invalid value 2nd arg ' + function_name
 
-    if chb_2v5 == 'close':
-        device.ctrl_transfer(0x40, 0x50, 37, 0, 0, 0, 100)
-    elif chb_2v5 == 'open':
-        device.ctrl_transfer(0x40, 0x51, 37, 0, 0, 0, 100)
-    else:
-        print 'invalid value 3rd arg ' + function_name
+def get_samples_array(device, settle_samples=None):
+    """Get used samples as a 2-D array.
 
-    if chb_gnd == 'close':
-        device.ctrl_transfer(0x40, 0x50, 38, 0, 0, 0, 100)
-    elif chb_gnd == 'open':
-        device.ctrl_transfer(0x40, 0x51, 38, 0, 0, 0, 100)
-    else:
-        print 'invalid value 4th arg ' + function_name
+    Rows are channel A voltage, channel A current, channel B voltage and
+    channel B current, columns are the samples after SAMPLES_OFFSET, or
+    after settle_samples when given.
+    Mean, min, max and standard deviation of the rows are saved in
+    global_.CHX_STATS.
+    """
+    if settle_samples is None:
+        settle_samples = global_.SAMPLES_OFFSET
+    buffer_data = array(
+        device.get_samples(settle_samples + global_.SAMPLES_USED),
+        dtype=float)
+    samples = buffer_data[settle_samples:]
+    samples = samples.reshape(len(samples), 4).T
+    global_.CHX_STATS = {'mean': samples.mean(axis=1),
+                         'min': samples.min(axis=1),
+                         'max': samples.max(axis=1),
+                         'std': samples.std(axis=1)}
+    return samples
 
 
 def get_external_2v5_samples(device):
     """Get channels voltage value and return mean and buffer data."""
-    voltage_channel_a_list = []
-    voltage_channel_b_list = []
-    buffer_data = device.get_samples(global_.SAMPLES)
-    for index in range(global_.SAMPLES_USED):
-        channel_a_data = buffer_data[index + global_.SAMPLES_OFFSET][0]
-        channel_b_data = buffer_data[index + global_.SAMPLES_OFFSET][1]
-
-        voltage_channel_a = float(channel_a_data[0])
-        voltage_channel_a_list.append(voltage_channel_a)
-
-        voltage_channel_b = float(channel_b_data[0])
-        voltage_channel_b_list.append(voltage_channel_b)
-
+    samples = get_samples_array(device)
+    samples[[1, 3]] = 0.0
     global_.CHX_2V5_EX_REF = [
-        mean(voltage_channel_a_list), 0.0,
-        mean(voltage_channel_b_list), 0.0,
-        [voltage_channel_a_list, [0.0] * global_.SAMPLES_USED,
-         voltage_channel_b_list, [0.0] * global_.SAMPLES_USED]]
+        float(global_.CHX_STATS['mean'][0]), 0.0,
+        float(global_.CHX_STATS['mean'][2]), 0.0,
+        samples]
     return global_.CHX_2V5_EX_REF
 
 
-def get_samples_find_average(device):
+def get_samples_find_average(device, settle_samples=None):
     """Get samples.
 
     Get channels voltage and current value and return mean and buffer data.
     """
-    voltage_channel_a_list = []
-    current_channel_a_list = []
-    voltage_channel_b_list = []
-    current_channel_b_list = []
-    buffer_data = device.get_samples(global_.SAMPLES)
-    for index in range(global_.SAMPLES_USED):
-        channel_a_data = buffer_data[index + global_.SAMPLES_OFFSET][0]
-        channel_b_data = buffer_data[index + global_.SAMPLES_OFFSET][1]
-
-        voltage_channel_a = float(channel_a_data[0])
-        voltage_channel_a_list.append(voltage_channel_a)
-
-        current_channel_a = float(channel_a_data[1])
-        current_channel_a_list.append(current_channel_a)
-
-        voltage_channel_b = float(channel_b_data[0])
-        voltage_channel_b_list.append(voltage_channel_b)
-
-        current_channel_b = float(channel_b_data[1])
-        current_channel_b_list.append(current_channel_b)
-
-    global_.CHX_V_I = [round(mean(voltage_channel_a_list), 6),
-                       round(mean(current_channel_a_list), 6),
-                       round(mean(voltage_channel_b_list), 6),
-                       round(mean(current_channel_b_list), 6),
-                       [voltage_channel_a_list, current_channel_a_list,
-                        voltage_channel_b_list, current_channel_b_list]]
+    samples = get_samples_array(device, settle_samples)
+    means = global_.CHX_STATS['mean']
+    global_.CHX_V_I = [round(float(means[0]), 6),
+                       round(float(means[1]), 6),
+                       round(float(means[2]), 6),
+                       round(float(means[3]), 6),
+                       samples]
     return global_.CHX_V_I
 
 
+def capture_with_adc(device, adc_measure, settle_samples=None):
+    """Get samples and measure with the external ADC at the same time.
+
+    adc_measure is called without arguments on another thread once the
+    settle samples are streamed, so both see the same settled condition.
+    Channel values are saved as by get_samples_find_average.
+    Return an OverlappedMeasurement.
+    """
+    if settle_samples is None:
+        settle_samples = global_.SAMPLES_OFFSET
+    adc = {}
+
+    def measure():
+        """Run ADC measurement after the settle samples."""
+        sleep(STREAM_START_DELAY + settle_samples / float(SAMPLE_RATE))
+        adc['start'] = time()
+        try:
+            adc['result'] = adc_measure()
+        except Exception as error:
+            adc['error'] = error
+        adc['end'] = time()
+
+    thread = Thread(target=measure)
+    capture_start = time()
+    thread.start()
+    try:
+        samples = get_samples_find_average(device, settle_samples)[4]
+    finally:
+        capture_end = time()
+        thread.join()
+    if 'error' in adc:
+        raise adc['error']
+    return OverlappedMeasurement(
+        samples, adc['result'], settle_samples, capture_start, capture_end,
+        adc['start'], adc['end'])
+
+
 def source_0v(channel, mode_1, mode_value, mode_2, device):
     """Source 0V.
 
@@ -159,14 +368,14 @@ def source_0v(channel, mode_1, mode_value, mode_2, device):
 
 def channel_a_mode_and_value(a_mode, a_val=None):
     """Set mode for channel A."""
-    global_.CHA.mode = a_mode
+    set_channel_mode('A', a_mode)
     if a_val is not None:
         global_.CHA.constant(a_val)
 
 
 def channel_b_mode_and_value(b_mode, b_val=None):
     """Set mode for channel B."""
-    global_.CHB.mode = b_mode
+    set_channel_mode('B', b_mode)
     if b_val is not None:
         global_.CHB.constant(b_val)
 
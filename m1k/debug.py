@@ -1,25 +1,73 @@
 """Module used for debugging."""
 
+import atexit
 import os
 import signal
 import sys
+from Queue import Queue
+from threading import Thread
+
+from numpy import array, savez
+
+import global_
+
+SAMPLE_COLUMNS = ['Ch_A_Voltage', 'Ch_A_Current',
+                  'Ch_B_Voltage', 'Ch_B_Current']
+
+# Sample log writer of this process, started by the first log_samples
+sample_log_queue = None
+sample_log_pid = None
+
+
+def write_sample_logs():
+    """Write sample logs taken from the queue."""
+    while True:
+        file_name, samples, highlight = sample_log_queue.get()
+        try:
+            directory = os.path.dirname(file_name)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            savez(file_name, samples=samples, columns=SAMPLE_COLUMNS,
+                  highlight=highlight)
+        except Exception as error:
+            # The writer keeps running, flush_sample_logs waits for the
+            # items queued after this one
+            sys.stderr.write(global_.TEXT_COLOR_MAP['red'] +
+                             'Sample log ' + file_name + ' not written: ' +
+                             str(error) + global_.TEXT_COLOR_MAP['default'] +
+                             '\n')
+        finally:
+            sample_log_queue.task_done()
+
+
+def flush_sample_logs():
+    """Wait until queued sample logs are written."""
+    if sample_log_pid == os.getpid():
+        sample_log_queue.join()
 
 
 def log_samples(directory, file_name, data_list, highlight=''):
-    """Log samples."""
+    """Log samples in the device log directory.
+
+    Rows of data_list are channel A voltage and current, channel B
+    voltage and current. They are saved as NumPy .npz in the last
+    component of directory by a background thread, samples_to_csv.py
+    converts them to CSV.
+    """
+    global sample_log_queue, sample_log_pid
     print file_name
-    with open(str(file_name) + ".csv", "w") as results_file:
-        results_file.write(
-            'Ch_A_Voltage' + ',' +
-            'Ch_A_Current' + ',' +
-            'Ch_B_Voltage' + ',' +
-            'Ch_B_Current' + '\n')
-        for index in range(len(data_list[0])):
-            results_file.write(
-                str(data_list[0][index]) + ',' +
-                str(data_list[1][index]) + ',' +
-                str(data_list[2][index]) + ',' +
-                str(data_list[3][index]) + '\n')
+    if sample_log_pid != os.getpid():
+        # No writer thread in this process, e.g. a board worker fork
+        sample_log_queue = Queue()
+        sample_log_pid = os.getpid()
+        writer = Thread(target=write_sample_logs)
+        writer.daemon = True
+        writer.start()
+        atexit.register(flush_sample_logs)
+    sample_log_queue.put((
+        os.path.join(global_.device_log_dir(),
+                     os.path.basename(directory), str(file_name) + '.npz'),
+        array(data_list, dtype=float), str(highlight)))
 
 
 def add_break_point(message):
@@ -1,11 +1,14 @@
 """Module to control EEPROM M24C02."""
 
-from time import sleep
+from time import time
 
 import global_
 
 global_.init()
 
+# Internal write cycle lasts maximum 5 ms, poll it with margin
+WRITE_CYCLE_TIMEOUT = 0.02
+
 
 def pack_memory_data(source):
     """Prepare data to be writed in memory."""
@@ -39,9 +42,7 @@ def read_write(page, data='', nr_of_bytes=0, float_or_hex=''):
             nr_of_bytes = global_.PAGE_SIZE
             print 'nr_of_bytes was resized from ' + str(def_nr_of_bytes) + \
                 ' to ' + str(nr_of_bytes)
-        global_.bus.write_i2c_block_data(
-            global_.EEPROM_ID, page, pack_memory_data(data))
-        sleep(0.01)
+        write_sequential(page, pack_memory_data(data))
     if nr_of_bytes > 0:
         data_out = unpack_memory_data(global_.bus.read_i2c_block_data(
             global_.EEPROM_ID, page, nr_of_bytes), 0, nr_of_bytes)
@@ -56,35 +57,76 @@ def read_write(page, data='', nr_of_bytes=0, float_or_hex=''):
         return 'Conversion fail... Check EEPROM content'
 
 
+def read_sequential(address, nr_of_bytes):
+    """Read consecutive bytes starting at address.
+
+    With combined transfers the whole range is one sequential read,
+    else it is split in SMBus block reads of maximum 32 bytes.
+    """
+    if global_.i2c_msg is not None and hasattr(global_.bus, 'i2c_rdwr'):
+        read = global_.i2c_msg.read(global_.EEPROM_ID, nr_of_bytes)
+        global_.bus.i2c_rdwr(
+            global_.i2c_msg.write(global_.EEPROM_ID, [address]), read)
+        return list(read)
+    data = []
+    while len(data) < nr_of_bytes:
+        data += global_.bus.read_i2c_block_data(
+            global_.EEPROM_ID, address + len(data),
+            min(nr_of_bytes - len(data), 32))
+    return data
+
+
+def wait_write_cycle():
+    """Poll the memory until the internal write cycle ends.
+
+    The memory does not acknowledge its address while it is writing.
+    """
+    deadline = time() + WRITE_CYCLE_TIMEOUT
+    while True:
+        try:
+            global_.bus.write_quick(global_.EEPROM_ID)
+            return
+        except IOError:
+            if time() > deadline:
+                raise IOError('EEPROM write cycle timeout')
+
+
+def write_sequential(address, data):
+    """Write consecutive bytes starting at address.
+
+    Data is split on page boundaries, every page write is followed by
+    acknowledge polling instead of a fixed delay.
+    """
+    data = list(data)
+    while data:
+        nr_of_bytes = min(
+            len(data), global_.PAGE_SIZE - address % global_.PAGE_SIZE)
+        global_.bus.write_i2c_block_data(
+            global_.EEPROM_ID, address, data[:nr_of_bytes])
+        wait_write_cycle()
+        address += nr_of_bytes
+        data = data[nr_of_bytes:]
+
+
 def read_memory_content(brut_data_or_char_data=False):
     """Read memory content."""
-    add = 0x00
+    memory_content = read_sequential(0x00, global_.MEMORY_ARRAY_BYTES)
     print
-    while add <= global_.MEMORY_ARRAY_BYTES - global_.PAGE_SIZE:
+    for add in range(0, global_.MEMORY_ARRAY_BYTES, global_.PAGE_SIZE):
         if brut_data_or_char_data:
-            sleep(0.01)
-            data_out = global_.bus.read_i2c_block_data(
-                global_.EEPROM_ID, add, global_.PAGE_SIZE)
+            data_out = memory_content[add:add + global_.PAGE_SIZE]
         else:
-            sleep(0.01)
-            read_data = global_.bus.read_i2c_block_data(
-                global_.EEPROM_ID, add, global_.PAGE_SIZE)
-            data_out = unpack_memory_data(read_data, 0, global_.PAGE_SIZE)
+            data_out = unpack_memory_data(
+                memory_content, add, add + global_.PAGE_SIZE)
         print 'EEPROM content: ' + str(data_out)
-        add += global_.PAGE_SIZE
     return 'Done reading EEPROM content'
 
 
 def clear_memory_content():
     """Clear memory content."""
-    add = 0x00
+    write_sequential(0x00, [0xff] * global_.MEMORY_ARRAY_BYTES)
+    memory_content = read_sequential(0x00, global_.MEMORY_ARRAY_BYTES)
     print '\nEEPROM content after clean:'
-    while add <= global_.MEMORY_ARRAY_BYTES - global_.PAGE_SIZE:
-        global_.bus.write_i2c_block_data(
-            global_.EEPROM_ID, add, [0xff] * global_.PAGE_SIZE)
-        sleep(0.01)
-        print global_.bus.read_i2c_block_data(
-            global_.EEPROM_ID, add, global_.PAGE_SIZE)
-        sleep(0.01)
-        add += global_.PAGE_SIZE
+    for add in range(0, global_.MEMORY_ARRAY_BYTES, global_.PAGE_SIZE):
+        print memory_content[add:add + global_.PAGE_SIZE]
     print
@@ -0,0 +1,136 @@
+"""Module used to flash the next board while the current one is tested.
+
+With M1K_PIPELINE=1 the jig has a second USB port, not switched by the
+M1K USB power output, where the next board is flashed. A thread of the
+m1k_runner stage worker uploads the firmware on this port while the
+stages run on the board of the test port. The operator moves the
+flashed board to the test port and main_measure_voltage.py skips the
+upload.
+
+Boards on the flash port must enumerate in SAM-BA mode (new or erased
+boards). The upload goes through a pysmu session of the worker without
+devices, which opens only the board in SAM-BA mode: smu -f would claim
+the test board held by the stages session and fail with "Device or
+resource busy". If the upload fails, the port is failed and
+main_measure_voltage.py flashes the board on the test port as before.
+The pipeline runs only in the m1k_runner stage worker: a stage run
+directly exits with the upload in progress. Without the runner every
+board is flashed on the test port.
+
+Flash port states:
+    idle -> waiting -> flashed -> idle (board moved)
+                   \\-> failed -> waiting (next run)
+Transitions and upload errors are appended to _flash_port.log.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from time import sleep, strftime
+
+import global_
+from pysmu import Session, SessionError
+
+ENABLED = os.getenv('M1K_PIPELINE', '0') == '1'
+
+# Interval between uploads while no board in SAM-BA mode is found
+POLL_INTERVAL = float(os.getenv('M1K_FLASH_POLL_INTERVAL', '1'))
+
+IDLE = 'idle'
+WAITING = 'waiting'
+FLASHED = 'flashed'
+FAILED = 'failed'
+
+# Upload errors while no board in SAM-BA mode is found, retried
+RETRY_ERRORS = ['no devices found in SAM-BA mode',
+                'failed to read SAM-BA response: Operation timed out']
+
+
+def log(state, message=''):
+    """Append flash port state and message to the jig log."""
+    with open(os.path.join(global_.LOGDIR, '_flash_port.log'),
+              'a') as log_file:
+        log_file.write(strftime('%Y-%m-%d_%H-%M-%S') + ' ' + state +
+                       ' ' + message + '\n')
+
+
+class FlashPort(object):
+    """State of the flash port, updated by the flashing thread."""
+
+    def __init__(self):
+        self.state = IDLE
+        self.message = ''
+        self.firmware_file = None
+        self.thread = None
+        self.lock = threading.Lock()
+        # Held by each upload, smu flashes any board in SAM-BA mode
+        self.upload_lock = threading.Lock()
+
+    def set_state(self, state, message=''):
+        """Change state, message is the last upload error."""
+        with self.lock:
+            self.state, self.message = state, message
+        log(state, message)
+
+    def start(self, firmware_file):
+        """Start flashing the next board, if not already started."""
+        with self.lock:
+            if self.state in (WAITING, FLASHED):
+                return
+            self.firmware_file = firmware_file
+            self.thread = threading.Thread(target=self.run)
+            # The runner is stopped with the jig, an upload is redone
+            self.thread.daemon = True
+        self.set_state(WAITING)
+        self.thread.start()
+
+    def run(self):
+        """Upload firmware when a board in SAM-BA mode is found."""
+        session = Session(add_all=False)
+        while True:
+            with self.upload_lock:
+                try:
+                    session.flash_firmware(self.firmware_file)
+                    break
+                except (SessionError, ValueError) as error:
+                    message = str(error)
+            if not any(retry in message for retry in RETRY_ERRORS):
+                self.set_state(FAILED, message)
+                return
+            sleep(POLL_INTERVAL)
+        self.set_state(FLASHED)
+
+    def take_flashed(self):
+        """Return True if a flashed board was moved to the test port."""
+        with self.lock:
+            if self.state != FLASHED:
+                return False
+            self.state = IDLE
+        log(IDLE, 'moved to test port')
+        return True
+
+
+port = FlashPort()
+
+
+def take_flashed():
+    """Return True if the board on the test port was flashed in
+    advance."""
+    return ENABLED and port.take_flashed()
+
+
+@contextmanager
+def test_port_upload():
+    """Pause the flash port uploads while the board of the test port is
+    in SAM-BA mode."""
+    with port.upload_lock:
+        yield
+
+
+def flash_next(firmware_file, text):
+    """Start flashing the next board and print the flash port state."""
+    if not ENABLED or not global_.runner:
+        # The upload thread would die with a stage run directly
+        return
+    port.start(firmware_file)
+    print text['turquoise'] + 'Flash port: ' + port.state + ' ' + \
+        port.message + text['default']
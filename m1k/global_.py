@@ -2,10 +2,15 @@
 import os
 import datetime
 
-import serial
-
-import smbus
 from pysmu import Mode
+from shadow_bus import ShadowBus
+
+try:
+    # smbus2 adds combined I2C_RDWR transfers used for ADC bursts
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    from smbus import SMBus
+    i2c_msg = None
 
 EXPANDER_ID = 0x34
 DAC_ID = 0x0E
@@ -15,16 +20,33 @@ PAGE_SIZE = 16
 MEMORY_ARRAY_BYTES = 256
 CHX_V_I = [None] * 4
 CHX_2V5_EX_REF = [None] * 4
+CHX_STATS = {}
 SAMPLES = 0
 SAMPLES_OFFSET = 0
 SAMPLES_USED = 0
 CHA = None
 CHB = None
+session = None
+# Changes each time a session detects the M1K boards
+session_id = None
+# Set in the m1k_runner stage worker, which outlives the stages
+runner = False
+usb = None
+# Hardware context, created once by init()
+bus = None
+ser = None
+dev = None
+# Addresses of the I2C devices initialized by init_device()
+initialized_devices = set()
 
 LOGDIR = os.getenv('LOGDIR', './log')
 if not os.path.exists(LOGDIR):
     os.makedirs(LOGDIR)
 
+CACHEDIR = os.getenv('CACHEDIR', './cache')
+if not os.path.exists(CACHEDIR):
+    os.makedirs(CACHEDIR)
+
 TEXT_COLOR_MAP = {'green': '\033[1;32m', 'red': '\033[1;31m',
                   'purple': '\033[1;35m', 'orange': '\033[1;33m',
                   'turquoise': '\033[1;36m', 'default': '\033[m'}
@@ -39,9 +61,25 @@ def device_log_dir():
     return device_dir
 
 def init(enable_serial=False):
-    """Initialize variables used globaly."""
-    global bus, ser, session, dev
-    # Get I2C bus
-    bus = smbus.SMBus(1)
-    if enable_serial:
+    """Initialize variables used globaly.
+
+    Every module calls it when imported, only the first call creates the
+    bus, so the modules share it and its register shadow. The bus device
+    is opened at its first transfer.
+    """
+    global bus, ser
+    if bus is None:
+        # Expander, DAC and ADC writes are shadowed
+        bus = ShadowBus(lambda: SMBus(1), register_devices=(EXPANDER_ID,),
+                        command_devices=(DAC_ID, ADC_ID))
+    if enable_serial and ser is None:
+        # Imported here, pyserial is only used with the display
+        import serial
         ser = serial.Serial("/dev/ttyUSB0", baudrate=115200, timeout=0.5)
+
+
+def init_device(addr, init_function):
+    """Run init_function of the I2C device at addr once per process."""
+    if addr not in initialized_devices:
+        init_function()
+        initialized_devices.add(addr)
@@ -0,0 +1,115 @@
+"""Measure the import time of the modules used by a stage script.
+
+Usage: python import_profile.py <script.py> [--all]
+    Import the modules imported at the top of the script, without
+    running it, and print the time spent importing each module: self
+    time and time including the modules it imported first. Only modules
+    taking 1 ms or more are printed, unless --all is given. Modules of
+    this directory run their import time code, e.g. global_.init().
+
+Run it on the Pi, where numpy, pysmu, gpiozero and serial are the jig
+modules. Jig modules already imported when the profile starts, e.g.
+replaced by simulator.py, are timed in a new interpreter instead.
+"""
+import __builtin__
+import ast
+import subprocess
+import sys
+from time import time
+
+JIG_MODULES = ['numpy', 'pysmu', 'gpiozero', 'serial', 'smbus2', 'smbus',
+               'pyudev']
+
+# [module, nesting depth, self time, total time], in import order
+records = []
+# Time spent in imports nested in the imports being timed
+stack = []
+builtin_import = __builtin__.__import__
+
+
+def timed_import(name, globals=None, locals=None, fromlist=None,
+                 level=-1):
+    """Import module, recording its time the first time it is loaded."""
+    if name in sys.modules:
+        return builtin_import(name, globals, locals, fromlist, level)
+    module = name
+    if level > 0:
+        # Explicit relative import, e.g. from . import core
+        module = '.' * level + (name or ', '.join(fromlist))
+    record = [module, len(stack), 0.0, 0.0]
+    records.append(record)
+    start = time()
+    stack.append(0.0)
+    try:
+        return builtin_import(name, globals, locals, fromlist, level)
+    finally:
+        total = time() - start
+        record[2], record[3] = total - stack.pop(), total
+        if stack:
+            stack[-1] += total
+
+
+def script_imports(script):
+    """Return module names imported at the top level of script."""
+    with open(script, 'r') as script_file:
+        tree = ast.parse(script_file.read(), script)
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names.append(node.module)
+    return names
+
+
+def print_profile(minimum):
+    """Print import tree, nested imports below their importer."""
+    print '{0:>9} {1:>9}  module'.format('self ms', 'total ms')
+    for name, depth, self_time, total in records:
+        if total >= minimum:
+            print '{0:>9.1f} {1:>9.1f}  {2}{3}'.format(
+                self_time * 1000, total * 1000, '  ' * depth, name)
+    print '{0:>9} {1:>9.1f}  all imports'.format(
+        '', sum(total for _, depth, _, total in records if depth == 0) *
+        1000)
+
+
+def fresh_import_time(name):
+    """Return import time of module in a new interpreter, None if it is
+    not installed."""
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'from time import time\nstart = time()\n'
+         'import ' + name + '\nprint time() - start'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return None
+    return float(output)
+
+
+def print_preloaded(names):
+    """Print import time of jig modules imported before the profile."""
+    if not names:
+        return
+    print '\nImported before the profile, timed in a new interpreter:'
+    for name in names:
+        total = fresh_import_time(name)
+        print '{0:>9} {1:>9}  {2}'.format(
+            '', 'missing' if total is None else
+            '{0:.1f}'.format(total * 1000), name)
+
+
+if __name__ == '__main__':
+    if not sys.argv[1:2]:
+        print __doc__
+        exit(1)
+    sys.argv = sys.argv[1:]
+    PRELOADED = [name for name in JIG_MODULES if name in sys.modules]
+    __builtin__.__import__ = timed_import
+    try:
+        for module_name in script_imports(sys.argv[0]):
+            __import__(module_name)
+    finally:
+        __builtin__.__import__ = builtin_import
+    print_profile(0.0 if '--all' in sys.argv else 0.001)
+    print_preloaded(PRELOADED)
@@ -0,0 +1,161 @@
+"""Module used to measure time and transfers of the test steps.
+
+With M1K_INSTRUMENT=1 the step functions of check_m1k and calibrate_m1k
+are wrapped to record their wall time, the I2C transactions per device
+counted by the bus, the M1K ctrl_transfer and get_samples calls and the
+sleeps. Records of a board are appended to timing.jsonl in the device
+log directory when the stage ends, timing_summary.py aggregates them.
+"""
+import atexit
+import json
+import os
+import sys
+import time
+from functools import wraps
+
+import global_
+
+ENABLED = os.getenv('M1K_INSTRUMENT', '0') == '1'
+
+# Step functions wrapped by install, per module
+STEP_FUNCTIONS = {
+    'check_m1k': ['supply_output_5v0', 'supply_output_2v5',
+                  'user_digital_in_out', 'run_step', 'check_current_offset'],
+    'calibrate_m1k': ['measure_chx_external_2v5', 'measure_chx_gnd',
+                      'source_chx_0v_without_load',
+                      'source_chx_2v5_without_load',
+                      'measure_chx_positive_current',
+                      'measure_chx_negative_current',
+                      'source_chx_0a_current',
+                      'source_chx_positive_current',
+                      'source_chx_negative_current',
+                      'calculate_currents']}
+
+# Counters of the current process and step records not yet written
+counters = {'ctrl_transfer': 0, 'get_samples': 0, 'sleep': 0,
+            'sleep_time': 0.0}
+records = []
+step_depth = [0]
+report_pid = None
+
+
+def step_name(function, args):
+    """Return step name, with the channel and PLAN step when known."""
+    name = function.__name__
+    if name == 'run_step':
+        return name + ' CH_' + chr(args[0] + 65) + ' ' + \
+            sys.modules['check_m1k'].PLAN[args[1]].name
+    for arg in args:
+        if isinstance(arg, dict) and 'channel_name' in arg:
+            return name + ' CH_' + arg['channel_name']
+    return name
+
+
+def snapshot():
+    """Return counters and bus transactions."""
+    state = dict(counters)
+    state['i2c'] = dict(getattr(global_.bus, 'transactions', {}))
+    return state
+
+
+def timed(function):
+    """Wrap step function to record its time and transfers."""
+    @wraps(function)
+    def step(*args, **kwargs):
+        global report_pid
+        if report_pid != os.getpid():
+            # Exit handlers are not kept by board worker forks
+            report_pid = os.getpid()
+            atexit.register(write_report)
+        if step_depth[0]:
+            # Steps called by steps are part of the outer step
+            return function(*args, **kwargs)
+        start, before = time.time(), snapshot()
+        step_depth[0] += 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            step_depth[0] -= 1
+            after = snapshot()
+            record = dict(
+                (name, after[name] - before[name]) for name in counters)
+            record['sleep_time'] = round(record['sleep_time'], 6)
+            record['i2c'] = dict(
+                ('0x%02X' % addr, count - before['i2c'].get(addr, 0))
+                for addr, count in after['i2c'].items()
+                if count != before['i2c'].get(addr, 0))
+            record.update(step=step_name(function, args),
+                          wall=round(time.time() - start, 6),
+                          time=round(start, 3))
+            records.append(record)
+    step.instrumented = True
+    return step
+
+
+def counting_sleep(seconds):
+    """Sleep and count it."""
+    counters['sleep'] += 1
+    counters['sleep_time'] += seconds
+    time.sleep(seconds)
+
+
+def install(*modules):
+    """Wrap step functions of modules and count sleeps of the test modules.
+
+    Nothing is changed when instrumentation is disabled, modules already
+    instrumented are kept.
+    """
+    if not ENABLED:
+        return
+    for module in modules:
+        for name in STEP_FUNCTIONS.get(module.__name__, []):
+            function = getattr(module, name, None)
+            if function is not None and \
+                    not getattr(function, 'instrumented', False):
+                setattr(module, name, timed(function))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in sys.modules.values():
+        if getattr(module, 'sleep', None) is time.sleep and \
+                os.path.dirname(os.path.abspath(
+                    getattr(module, '__file__', '/'))) == directory:
+            module.sleep = counting_sleep
+
+
+class CountingDevice(object):
+    """M1K device counting ctrl_transfer and get_samples calls."""
+
+    def __init__(self, device):
+        self.device = device
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def ctrl_transfer(self, *args):
+        counters['ctrl_transfer'] += 1
+        return self.device.ctrl_transfer(*args)
+
+    def get_samples(self, nr_of_samples):
+        counters['get_samples'] += 1
+        return self.device.get_samples(nr_of_samples)
+
+
+def device(m1k_device):
+    """Return device, counting its transfers when enabled."""
+    if not ENABLED or isinstance(m1k_device, CountingDevice):
+        return m1k_device
+    return CountingDevice(m1k_device)
+
+
+def write_report():
+    """Append step records to timing.jsonl of the current device."""
+    if not records or getattr(global_, 'dev', None) is None:
+        return
+    stage = os.path.basename(sys.argv[0])
+    with open(os.path.join(global_.device_log_dir(), 'timing.jsonl'),
+              'a') as timing_file:
+        for record in records:
+            record.update(stage=stage, serial=global_.dev.serial,
+                          fwver=global_.dev.fwver,
+                          run=os.getenv('RUN_TIMESTAMP', 'unknown_time'))
+            timing_file.write(json.dumps(record, sort_keys=True) + '\n')
+    del records[:]
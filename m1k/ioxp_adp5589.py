@@ -99,16 +99,14 @@ def setup_digital_in_out():
 
 
 def get_status_digital_in_out():
-    """Set pins used for DIO test to return logic state.
+    """Return GPI_STATUS_B as a hex string."""
+    return hex(read_status_digital_in_out())
 
-    Interrupt is active high and debunce is disable for used pins as input.
-    Write GPI_INT_LEVEL_B and DEBOUNCE_DIS_B registers and read GPI_STATUS_B.
-    """
+
+def read_status_digital_in_out():
+    """Return GPI_STATUS_B as a number, pins set by setup_digital_in_out."""
     gpi_status_b_reg = 0x17
-    status = hex(global_.bus.read_byte_data(
-        global_.EXPANDER_ID, gpi_status_b_reg))
-    # print status
-    return status
+    return global_.bus.read_byte_data(global_.EXPANDER_ID, gpi_status_b_reg)
 
 
 def get_button_status():
@@ -130,6 +128,53 @@ def get_button_status():
         global_.EXPANDER_ID, gpi_status_b_reg))
 
 
+def enable_button_interrupt():
+    """Set the button pin to pull the INT output low when pressed.
+
+    GPI interrupt of port B pin 3 is active low and debounced. Write
+    GPI_INT_LEVEL_B, DEBOUNCE_DIS_B, GPI_INTERRUPT_EN_B, GENERAL_CFG
+    (oscillator on) and INT_EN, then clear a pending interrupt.
+    """
+    direction_port_b(0x00)
+    gpi_int_level_b_reg = 0x1F
+    gpi_interrupt_en_b_reg = 0x25
+    debounce_dis_b_reg = 0x28
+    general_cfg_reg = 0x4D
+    int_en_reg = 0x4E
+    global_.bus.write_byte_data(global_.EXPANDER_ID, gpi_int_level_b_reg, 0x00)
+    global_.bus.write_byte_data(global_.EXPANDER_ID, debounce_dis_b_reg, 0x00)
+    global_.bus.write_byte_data(
+        global_.EXPANDER_ID, gpi_interrupt_en_b_reg, 0x08)
+    global_.bus.write_byte_data(global_.EXPANDER_ID, general_cfg_reg, 0x80)
+    global_.bus.write_byte_data(global_.EXPANDER_ID, int_en_reg, 0x02)
+    clear_button_interrupt()
+
+
+def disable_button_interrupt():
+    """Release the INT output, the button pin is no more an interrupt."""
+    gpi_interrupt_en_b_reg = 0x25
+    int_en_reg = 0x4E
+    global_.bus.write_byte_data(global_.EXPANDER_ID, int_en_reg, 0x00)
+    global_.bus.write_byte_data(
+        global_.EXPANDER_ID, gpi_interrupt_en_b_reg, 0x00)
+    clear_button_interrupt()
+
+
+def clear_button_interrupt():
+    """Return True if the button raised the interrupt, and clear it.
+
+    GPI_INT_STAT_B is cleared by its read, GPI_INT of INT_STATUS by
+    writing 1.
+    """
+    int_status_reg = 0x01
+    gpi_int_stat_b_reg = 0x14
+    pressed = global_.bus.read_byte_data(
+        global_.EXPANDER_ID, gpi_int_stat_b_reg) & 0x08
+    global_.bus.invalidate(global_.EXPANDER_ID, int_status_reg)
+    global_.bus.write_byte_data(global_.EXPANDER_ID, int_status_reg, 0x02)
+    return pressed != 0
+
+
 def update(list_item, string_reference, data_reg_val, direction_reg_val):
     """Update data and direction registers."""
     if list_item == string_reference:
@@ -290,12 +335,14 @@ def gpo_set_port_c(status_list):
 
 def gpo_set(status_list):
     """Set selected pins as output and their logis state."""
-    gpo_set_port_a(status_list)
-    gpo_set_port_b(status_list)
-    gpo_set_port_c(status_list)
+    with global_.bus.coalesce():
+        gpo_set_port_a(status_list)
+        gpo_set_port_b(status_list)
+        gpo_set_port_c(status_list)
 
 
 def gpo_set_ac(status_list):
     """Set selected pins as output and their logis state."""
-    gpo_set_port_a(status_list)
-    gpo_set_port_c(status_list)
+    with global_.bus.coalesce():
+        gpo_set_port_a(status_list)
+        gpo_set_port_c(status_list)
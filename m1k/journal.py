@@ -0,0 +1,78 @@
+"""Module used to journal calibration steps of a device.
+
+Each step is one JSON line with time, step, channel, inputs, means and
+factors. Lines are written through one buffered file handle, flushed
+at the stage flush points and closed when the stage ends. Latest values
+are indexed by name and channel, so later stages look them up instead
+of parsing the journal.
+"""
+
+import atexit
+import json
+import os
+from time import time
+
+# Journals opened by this process, closed when the stage ends
+journals = []
+
+
+class Journal(object):
+    """Append-only JSON lines journal with an index of latest values."""
+
+    def __init__(self, file_name, new=False):
+        self.file_name = file_name
+        self.index = {}
+        if not new and os.path.exists(file_name):
+            with open(file_name, 'r') as journal_file:
+                for line in journal_file:
+                    if line.strip():
+                        self.add_to_index(json.loads(line))
+        self.journal_file = open(file_name, 'w' if new else 'a')
+        journals.append(self)
+
+    def add_to_index(self, record):
+        """Index means and factors of record by name and channel."""
+        for group in ('means', 'factors'):
+            for name, value in record.get(group, {}).items():
+                self.index[name, record['channel']] = value
+
+    def record(self, step, channel, means=None, factors=None, inputs=None):
+        """Append step record, written at the next flush point."""
+        record = {'time': round(time(), 3), 'step': step,
+                  'channel': channel, 'inputs': inputs or {},
+                  'means': means or {}, 'factors': factors or {}}
+        # Values are copied, step functions keep updating their lists
+        record = json.loads(json.dumps(record, default=float))
+        self.journal_file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.add_to_index(record)
+        return record
+
+    def lookup(self, name, channel):
+        """Return latest value of name recorded for channel 'A' or 'B'."""
+        return self.index[name, channel]
+
+    def flush(self):
+        """Write buffered records."""
+        if not self.journal_file.closed:
+            self.journal_file.flush()
+
+    def close(self):
+        """Flush and close journal."""
+        self.journal_file.close()
+        if self in journals:
+            journals.remove(self)
+
+
+def flush_all():
+    """Flush journals opened by this process."""
+    for journal in journals:
+        journal.flush()
+
+
+def close_all():
+    """Close journals opened by this process, at the end of a stage."""
+    for journal in list(journals):
+        journal.close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,275 @@
+"""Persistent runner for the M1K test stages.
+
+Server: python m1k_runner.py --serve
+    Import the test modules once, keep the pysmu session, the I2C bus and
+    the USB power pin open and run the stage scripts sent by clients in
+    a forked worker. A stage whose client is stopped (by its timeout) is
+    killed with its worker.
+
+Client: python m1k_runner.py <script.py> [arguments]
+    Run a stage script in the server, print its output and exit with its
+    exit status. When no server is listening the script is run directly.
+"""
+import json
+import os
+import select
+import signal
+import socket
+import sys
+
+SOCKET_PATH = os.getenv('M1K_RUNNER_SOCKET', '/tmp/m1k_runner.sock')
+
+# Frames sent to the client: channel, 8 hex digits of length, data
+STDOUT = '1'
+STDERR = '2'
+STATUS = 's'
+HEADER_SIZE = 9
+# Board workers forked by a stage write to the same socket, frames are
+# sent in one call each so they do not interleave
+FRAME_MAX = 4096
+
+
+def frame(channel, data):
+    """Return frame of data for channel."""
+    return channel + '%08x' % len(data) + data
+
+
+def read_frames(buffer_):
+    """Return complete frames of buffer and the bytes left."""
+    frames = []
+    while len(buffer_) >= HEADER_SIZE:
+        size = int(buffer_[1:HEADER_SIZE], 16)
+        if len(buffer_) < HEADER_SIZE + size:
+            break
+        frames.append((buffer_[0], buffer_[HEADER_SIZE:HEADER_SIZE + size]))
+        buffer_ = buffer_[HEADER_SIZE + size:]
+    return frames, buffer_
+
+
+class ChannelFile(object):
+    """File sending what is written as frames of a channel."""
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        for start in range(0, len(data), FRAME_MAX):
+            self.connection.sendall(
+                frame(self.channel, data[start:start + FRAME_MAX]))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def exit_status(code):
+    """Convert SystemExit code in exit status."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print code
+    return 1
+
+
+def run_stage(request, connection):
+    """Run a stage script with stdout and stderr sent to the client."""
+    import runpy
+    import traceback
+
+    # The stage gets the client environment only, nothing left by the
+    # previous stages
+    os.environ.clear()
+    os.environ.update(dict(
+        (key.encode('utf-8'), value.encode('utf-8'))
+        for key, value in request['env'].items()))
+    os.chdir(request['cwd'].encode('utf-8'))
+    stdout, stderr, argv = sys.stdout, sys.stderr, sys.argv
+    sys.stdout = ChannelFile(connection, STDOUT)
+    sys.stderr = ChannelFile(connection, STDERR)
+    sys.argv = [arg.encode('utf-8') for arg in request['argv']]
+    try:
+        try:
+            runpy.run_path(sys.argv[0], run_name='__main__')
+            status = 0
+        except SystemExit as error:
+            status = exit_status(error.code)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        # Logs are complete when the stage reports its status
+        if sys.modules.get('debug'):
+            sys.modules['debug'].flush_sample_logs()
+        if sys.modules.get('journal'):
+            sys.modules['journal'].close_all()
+        if sys.modules.get('results_db'):
+            sys.modules['results_db'].flush()
+        if sys.modules.get('instrumentation'):
+            sys.modules['instrumentation'].write_report()
+    finally:
+        sys.stdout, sys.stderr, sys.argv = stdout, stderr, argv
+    if sys.modules.get('parallel_boards') and \
+            sys.modules['parallel_boards'].WORKER:
+        # Board worker forked by the stage, the stage worker is the parent
+        os._exit(status)
+    return status
+
+
+def serve_stages(connection):
+    """Run the requests relayed by the server, in the stage worker."""
+    import global_
+    global_.runner = True
+    # Registers written by a killed worker are unknown
+    global_.bus.invalidate()
+    requests = connection.makefile('rb', 0)
+    while True:
+        line = requests.readline()
+        if not line:
+            # Server stopped
+            os._exit(0)
+        status = run_stage(json.loads(line), connection)
+        connection.sendall(frame(STATUS, str(status)))
+
+
+def start_worker(server):
+    """Fork the stage worker, return its pid and connection."""
+    connection, worker_connection = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        server.close()
+        connection.close()
+        # Own process group, killed with the board workers it forks
+        os.setpgid(0, 0)
+        try:
+            serve_stages(worker_connection)
+        finally:
+            os._exit(1)
+    worker_connection.close()
+    return pid, connection
+
+
+def stop_worker(pid, connection):
+    """Kill the stage worker and the processes it started."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    os.waitpid(pid, 0)
+    connection.close()
+
+
+def relay(client, worker):
+    """Send request of client to the worker and relay its output.
+
+    Return False if the worker must be stopped: the client disconnected
+    (stopped by its timeout) before the status or the worker died.
+    """
+    request_line = client.makefile('rb', 0).readline()
+    try:
+        json.loads(request_line)
+    except ValueError:
+        return True
+    worker.sendall(request_line)
+    pending = ''
+    while True:
+        readable = select.select([client, worker], [], [])[0]
+        if client in readable and not client.recv(4096, socket.MSG_PEEK):
+            return False
+        if worker not in readable:
+            continue
+        data = worker.recv(65536)
+        if not data:
+            # Worker died, report the stage failed
+            client.sendall(frame(STATUS, '1'))
+            return False
+        client.sendall(data)
+        frames, pending = read_frames(pending + data)
+        if any(channel == STATUS for channel, _ in frames):
+            return True
+
+
+def serve():
+    """Accept stage requests until the process is stopped.
+
+    The stages run in a forked worker, which keeps the pysmu session
+    between stages. The worker is killed when the client disconnects
+    before the stage ends, a new one is forked for the next request.
+    """
+    # Pay the imports, bus and GPIO set-up once for all stages
+    import calibrate_m1k
+    import check_m1k
+    import control_m1k
+    import instrumentation
+    instrumentation.install(calibrate_m1k, check_m1k)
+    control_m1k.usb_power()
+
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen(1)
+    worker = None
+    while True:
+        client = server.accept()[0]
+        if worker is None:
+            worker = start_worker(server)
+        try:
+            done = relay(client, worker[1])
+        except socket.error:
+            done = False
+        if not done:
+            stop_worker(*worker)
+            worker = None
+        try:
+            client.close()
+        except socket.error:
+            pass
+
+
+def request(argv):
+    """Run stage in the server, return exit status or None if no server."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(SOCKET_PATH)
+    except socket.error:
+        return None
+    client.sendall(json.dumps({'argv': argv, 'env': dict(os.environ),
+                               'cwd': os.getcwd()}) + '\n')
+    files = {STDOUT: sys.stdout, STDERR: sys.stderr}
+    pending = ''
+    status = None
+    while status is None:
+        data = client.recv(65536)
+        if not data:
+            break
+        frames, pending = read_frames(pending + data)
+        for channel, payload in frames:
+            if channel == STATUS:
+                status = payload
+            else:
+                files[channel].write(payload)
+                files[channel].flush()
+    client.close()
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return 1
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--serve']:
+        serve()
+    STATUS = request(sys.argv[1:])
+    if STATUS is None:
+        os.execv(sys.executable, [sys.executable, '-u'] + sys.argv[1:])
+    exit(STATUS)
@@ -3,12 +3,14 @@ import inspect
 import sys
 from time import sleep
 
+import calibration_record
 import check_m1k
-import eeprom_m24c02
+import checkpoint
+import control_m1k
 import global_
+import instrumentation
 import ioxp_adp5589
-from gpiozero import LED
-from pysmu import Session
+import parallel_boards
 
 # print debug values chosen by developer
 VIEW_DEBUG_MESSAGES = False
@@ -31,15 +33,13 @@ TEXT = global_.TEXT_COLOR_MAP
 # number of samples colected through I2C from ADC
 ADC_SAMPLES = 500
 
+# stop ADC averaging when the check result is clear,
+# ADC_SAMPLES is then the maximum number of samples
+ADAPTIVE_ADC_AVERAGING = True
+
 # index used to calibrate first detected board
 ORDER_INDEX = 0
 
-# variable used to switch between channels and vector data
-CHANNEL_INDEX = 0
-
-# Switch configuration between calibration and verification steps
-RESTART_VERIFICATION = 0
-
 # Verification status list for each step
 # If each element of this list has 'True' value
 # the M1K LED will be green else red
@@ -49,22 +49,24 @@ STATUS_VALUES = []
 # Stop script execution until user press ENTER
 BRAKE_SCRIPT = False
 
-# Read from EEPROM parameters used to
-# calibrate current measurement using CSA and ADC
-ADC_OFFSET_POZ = int(eeprom_m24c02.read_write(0x70, '', 3, 'hex'), 16)
-ADC_GAIN_POZ = int(eeprom_m24c02.read_write(0x75, '', 3, 'hex'), 16)
-I_GAIN_POZ = eeprom_m24c02.read_write(0x7A, '', 6, 'float')
+# Read calibration board record from EEPROM
+RECORD = calibration_record.load()
+
+# Parameters used to calibrate current measurement using CSA and ADC
+ADC_OFFSET_POZ = RECORD.adc_offset_poz
+ADC_GAIN_POZ = RECORD.adc_gain_poz
+I_GAIN_POZ = RECORD.i_gain_poz
 
-ADC_OFFSET_NEG = int(eeprom_m24c02.read_write(0x80, '', 3, 'hex'), 16)
-ADC_GAIN_NEG = int(eeprom_m24c02.read_write(0x85, '', 3, 'hex'), 16)
-I_GAIN_NEG = eeprom_m24c02.read_write(0x89, '', 7, 'float')
+ADC_OFFSET_NEG = RECORD.adc_offset_neg
+ADC_GAIN_NEG = RECORD.adc_gain_neg
+I_GAIN_NEG = RECORD.i_gain_neg
 
 # Tolerance values for all measurement
 TOLERANCE_VOLTAGE = 0.011
 TOLERANCE_CURRENT = 0.004
 
-# Read from EEPROM External 2V5 and 1V2 references value
-EX_1V2_REF = eeprom_m24c02.read_write(0x08, '', 6, 'float')
+# External 1V2 reference value
+EX_1V2_REF = RECORD.ex_1v2_ref
 
 # Voltage setpoints for positive and
 # negative current when M1K is in SVMI mode
@@ -72,14 +74,9 @@ SVMI_SETPOINT_POZ = 3.85
 SVMI_SETPOINT_NEG = 1.15
 
 # PARAMETERS_USED_TO_CHECK_MEASURE_VOLTAGE_PERFORMANCES_AFTER_CALIBRATION___
-# Read from EEPROM MSB and LSB bytes for DAC
-# to source 1V25, 3V75 and create DAC command
-MSB_DAC_SRS_1V25 = int(eeprom_m24c02.read_write(0x20, '', 2, 'hex'), 16)
-LSB_DAC_SRS_1V25 = int(eeprom_m24c02.read_write(0x22, '', 2, 'hex'), 16)
-DAC_SRS_1V25_CMD = [MSB_DAC_SRS_1V25, LSB_DAC_SRS_1V25]
-MSB_DAC_SRS_3V75 = int(eeprom_m24c02.read_write(0x25, '', 2, 'hex'), 16)
-LSB_DAC_SRS_3V75 = int(eeprom_m24c02.read_write(0x27, '', 2, 'hex'), 16)
-DAC_SRS_3V75_CMD = [MSB_DAC_SRS_3V75, LSB_DAC_SRS_3V75]
+# DAC commands to source 1V25 and 3V75
+DAC_SRS_1V25_CMD = RECORD.dac_srs_1v25_cmd()
+DAC_SRS_3V75_CMD = RECORD.dac_srs_3v75_cmd()
 
 # PARAMETERS_USED_TO_CHECK_SOURCE_VOLTAGE_PERFORMANCES_AFTER_CALIBRATION____
 # Define voltage setpoint and tolerance for 0V8, 2V5 and 4V5 measurement
@@ -93,41 +90,25 @@ SRS_4V5_SETPOINT = 4.5
 SRS_I_SETPOINT_POZ = 0.1
 SRS_I_SETPOINT_NEG = -0.1
 
-# Read from EEPROM parametters for external
-# ADC calibration for channel 2,3 and 4
-ADC_OFFSET_VIN1 = int(eeprom_m24c02.read_write(0x30, '', 2, 'float'))
-ADC_SCALE_VIN1 = eeprom_m24c02.read_write(0x33, '', 6, 'float')
-ADC_GAIN_VIN1 = eeprom_m24c02.read_write(0x3A, '', 6, 'float')
-CALIBRATION_FACTORS_VIN1 = [
-    EX_1V2_REF, ADC_OFFSET_VIN1, ADC_SCALE_VIN1, ADC_GAIN_VIN1]
-
-ADC_OFFSET_VIN2 = int(eeprom_m24c02.read_write(0x40, '', 2, 'float'))
-ADC_SCALE_VIN2 = eeprom_m24c02.read_write(0x43, '', 6, 'float')
-ADC_GAIN_VIN2 = eeprom_m24c02.read_write(0x4A, '', 6, 'float')
-CALIBRATION_FACTORS_VIN2 = [
-    EX_1V2_REF, ADC_OFFSET_VIN2, ADC_SCALE_VIN2, ADC_GAIN_VIN2]
-
-ADC_OFFSET_VIN3 = int(eeprom_m24c02.read_write(0x50, '', 2, 'float'))
-ADC_SCALE_VIN3 = eeprom_m24c02.read_write(0x53, '', 6, 'float')
-ADC_GAIN_VIN3 = eeprom_m24c02.read_write(0x5A, '', 6, 'float')
-CALIBRATION_FACTORS_VIN3 = [
-    EX_1V2_REF, ADC_OFFSET_VIN3, ADC_SCALE_VIN3, ADC_GAIN_VIN3]
-
-USB = LED(12)
-if __name__ == '__main__':
-    USB.off()
-    sleep(2)
-    USB.on()
-    sleep(2)
+# Parametters for external ADC calibration for channel 2,3 and 4
+CALIBRATION_FACTORS_VIN1 = RECORD.adc_factors(1)
+CALIBRATION_FACTORS_VIN2 = RECORD.adc_factors(2)
+CALIBRATION_FACTORS_VIN3 = RECORD.adc_factors(3)
 
-    global_.session = Session()
+instrumentation.install(check_m1k)
+USB = control_m1k.usb_power()
+if __name__ == '__main__':
+    # A session kept open by m1k_runner skips the power cycle
+    if global_.session is None:
+        USB.off()
+        sleep(2)
+        USB.on()
 
     # print 'Wait for device to be detected...', \
     #     TEXT['orange'], inspect.stack()[0][1], TEXT['default']
     print TEXT['turquoise'], inspect.stack()[0][1], TEXT['default']
-    while not global_.session.devices:
-        global_.session = Session()
-        sleep(1)
+    control_m1k.wait_for_device(TEXT)
+    parallel_boards.fork_per_device(TEXT, power_off=True)
     # print 'Device detected... Start verification...'
 
     BOARD_NUMBER = len(global_.session.devices)
@@ -140,7 +121,8 @@ if __name__ == '__main__':
                 print 'ORDER_INDEX:', ORDER_INDEX, '\tbrdnum:', BOARD_NUMBER
 
             # Grab the first device from the session.
-            global_.dev = global_.session.devices[0]
+            global_.dev = instrumentation.device(
+                global_.session.devices[0])
             global_.CHA = global_.dev.channels['A']
             global_.CHB = global_.dev.channels['B']
 
@@ -153,87 +135,65 @@ if __name__ == '__main__':
                     '\tDevFwVer', DEVICE_FIRMWARE_VERSION, '\tDevHwVer', \
                     DEVICE_HARDWARE_VERSION
 
-            CHANNEL_INDEX = 0
-            ioxp_adp5589.gpo_set_port_a(['EN_1V2__1'])
+            with parallel_boards.calibration_board():
+                ioxp_adp5589.gpo_set_port_a(['EN_1V2__1'])
             # USB.on()
             # sleep(1)
 
-            while RESTART_VERIFICATION <= 1:
-                CHANNEL_NAME = chr(CHANNEL_INDEX + 65)
-
-                DB_CHECK = \
-                    {'channel_name': CHANNEL_NAME,
-                     'device_id': DEVICE_ID,
-                     'view_debug_messages': VIEW_DEBUG_MESSAGES,
-                     'view_short_debug_messages': VIEW_SHORT_DEBUG_MESSAGES,
-                     'enable_debug_mode': ENABLE_DEBUG_MODE,
-                     'log_samples': LOG_SAMPLES,
-                     'brake_script': BRAKE_SCRIPT,
-                     'device': global_.dev,
-                     'restart_verification': RESTART_VERIFICATION,
-                     'calibration_factors_vin2': CALIBRATION_FACTORS_VIN2,
-                     'adc_samples': ADC_SAMPLES,
-                     'tolerance_voltage': TOLERANCE_VOLTAGE,
-                     'tolerance_current': TOLERANCE_CURRENT,
-                     'dac_srs_1v25_cmd': DAC_SRS_1V25_CMD,
-                     'dac_srs_3v75_cmd': DAC_SRS_3V75_CMD,
-                     'srs_0v8_setpoint': SRS_0V8_SETPOINT,
-                     'srs_2v5_setpoint': SRS_2V5_SETPOINT,
-                     'srs_4v5_setpoint': SRS_4V5_SETPOINT,
-                     'adc_offset_poz': ADC_OFFSET_POZ,
-                     'adc_gain_poz': ADC_GAIN_POZ,
-                     'i_gain_poz': I_GAIN_POZ,
-                     'adc_offset_neg': ADC_OFFSET_NEG,
-                     'adc_gain_neg': ADC_GAIN_NEG,
-                     'i_gain_neg': I_GAIN_NEG,
-                     'svmi_setpoint_poz': SVMI_SETPOINT_POZ,
-                     'svmi_setpoint_neg': SVMI_SETPOINT_NEG,
-                     'srs_i_setpoint_poz': SRS_I_SETPOINT_POZ,
-                     'srs_i_setpoint_neg': SRS_I_SETPOINT_NEG,
-                     'channel_index': CHANNEL_INDEX,
-                     'status': STATUS,
-                     'status_values': STATUS_VALUES}
-
+            DB_CHECK = \
+                {'device_id': DEVICE_ID,
+                 'view_debug_messages': VIEW_DEBUG_MESSAGES,
+                 'view_short_debug_messages': VIEW_SHORT_DEBUG_MESSAGES,
+                 'enable_debug_mode': ENABLE_DEBUG_MODE,
+                 'log_samples': LOG_SAMPLES,
+                 'brake_script': BRAKE_SCRIPT,
+                 'device': global_.dev,
+                 'calibration_factors_vin2': CALIBRATION_FACTORS_VIN2,
+                 'adc_samples': ADC_SAMPLES,
+                 'adaptive_adc_averaging': ADAPTIVE_ADC_AVERAGING,
+                 'tolerance_voltage': TOLERANCE_VOLTAGE,
+                 'tolerance_current': TOLERANCE_CURRENT,
+                 'dac_srs_1v25_cmd': DAC_SRS_1V25_CMD,
+                 'dac_srs_3v75_cmd': DAC_SRS_3V75_CMD,
+                 'srs_0v8_setpoint': SRS_0V8_SETPOINT,
+                 'srs_2v5_setpoint': SRS_2V5_SETPOINT,
+                 'srs_4v5_setpoint': SRS_4V5_SETPOINT,
+                 'adc_offset_poz': ADC_OFFSET_POZ,
+                 'adc_gain_poz': ADC_GAIN_POZ,
+                 'i_gain_poz': I_GAIN_POZ,
+                 'adc_offset_neg': ADC_OFFSET_NEG,
+                 'adc_gain_neg': ADC_GAIN_NEG,
+                 'i_gain_neg': I_GAIN_NEG,
+                 'svmi_setpoint_poz': SVMI_SETPOINT_POZ,
+                 'svmi_setpoint_neg': SVMI_SETPOINT_NEG,
+                 'srs_i_setpoint_poz': SRS_I_SETPOINT_POZ,
+                 'srs_i_setpoint_neg': SRS_I_SETPOINT_NEG,
+                 'status': STATUS,
+                 'status_values': STATUS_VALUES}
+
+            with parallel_boards.calibration_board():
                 if VIEW_DEBUG_MESSAGES:
-                    print '\nwhile restart performance \trestart: ' + \
-                        str(RESTART_VERIFICATION)
-
-                if RESTART_VERIFICATION == 0:
-                    if VIEW_DEBUG_MESSAGES:
-                        print check_m1k.check_current_offset(DB_CHECK, TEXT)
-                    STATUS = check_m1k.supply_output_5v0(
-                        4.9, 5.1, CALIBRATION_FACTORS_VIN1,
-                        ADC_SAMPLES, DB_CHECK)
-                    STATUS = check_m1k.supply_output_2v5(
-                        2.4, 2.6, CALIBRATION_FACTORS_VIN3,
-                        ADC_SAMPLES, DB_CHECK)
-                    STATUS = check_m1k.user_digital_in_out(
-                        global_.dev, DB_CHECK)
-
-                STATUS = check_m1k.voltage_measurement_2v5(DB_CHECK, TEXT)
-                STATUS = check_m1k.voltage_measurement_2v5_aux(DB_CHECK, TEXT)
-                STATUS = check_m1k.voltage_measurement_1v25(DB_CHECK, TEXT)
-                STATUS = check_m1k.voltage_measurement_3v75(DB_CHECK, TEXT)
-                STATUS = check_m1k.source_0v8(DB_CHECK, TEXT)
-                STATUS = check_m1k.source_2v5(DB_CHECK, TEXT)
-                STATUS = check_m1k.source_4v5(DB_CHECK, TEXT)
-                STATUS = check_m1k.positive_current_measurement(DB_CHECK, TEXT)
-                STATUS = check_m1k.negative_current_measurement(DB_CHECK, TEXT)
-                STATUS = check_m1k.positive_current_source(DB_CHECK, TEXT)
-                STATUS = check_m1k.negative_current_source(DB_CHECK, TEXT)
-
-                RESTART_VERIFICATION += 1
-                CHANNEL_INDEX += 1
+                    print check_m1k.check_current_offset(DB_CHECK, TEXT)
+                STATUS = check_m1k.supply_output_5v0(
+                    4.9, 5.1, CALIBRATION_FACTORS_VIN1, ADC_SAMPLES, DB_CHECK)
+                STATUS = check_m1k.supply_output_2v5(
+                    2.4, 2.6, CALIBRATION_FACTORS_VIN3, ADC_SAMPLES, DB_CHECK)
+            with parallel_boards.calibration_board():
+                STATUS = check_m1k.user_digital_in_out(global_.dev, DB_CHECK)
+            # Channel A and B steps, ordered to minimize transitions, each
+            # step takes the calibration board
+            STATUS = check_m1k.run_plan(DB_CHECK, TEXT)
 
             ORDER_INDEX += 1
-            RESTART_VERIFICATION = 0
-            CHANNEL_INDEX = 0
 
             if ORDER_INDEX == BOARD_NUMBER:
-                USB.off()
-                sleep(1)
+                # Other workers are still using the USB power
+                if not parallel_boards.WORKER:
+                    USB.off()
+                    sleep(1)
                 check_m1k.tft_check_status(DB_CHECK, TEXT)
-                ioxp_adp5589.gpo_set_port_a([])
+                with parallel_boards.calibration_board():
+                    ioxp_adp5589.gpo_set_port_a([])
                 if ('v' + str(DEVICE_FIRMWARE_VERSION)) != sys.argv[1]:
                     print TEXT['red'] + "Firmware version mismatch:"
                     print "Got: v" + str(DEVICE_FIRMWARE_VERSION)
@@ -241,6 +201,7 @@ if __name__ == '__main__':
                     print TEXT['default']
                     exit(1)
                 if (all(x is True for x in STATUS)):
+                    checkpoint.discard(DEVICE_ID)
                     exit(0)
                 else:
                     exit(1)
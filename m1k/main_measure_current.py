@@ -5,10 +5,14 @@ from time import sleep
 
 import calibrate_m1k
 import calibration_file
-import eeprom_m24c02
+import checkpoint
+import calibration_record
+import control_m1k
 import global_
-from gpiozero import LED
-from pysmu import Session
+import instrumentation
+import journal
+import parallel_boards
+import results_db
 
 # print calibration coeficients calculated by M1K
 VIEW_CALIBRATION_FACTORS = False
@@ -69,34 +73,34 @@ FOURTH_STAGE = False
 BRAKE_SCRIPT = False
 
 # PARAMETERS_USED_TO_CHECK_MEASURE_CURRENT_PERFORMANCES_AFTER_CALIBRATION___
-# Read from EEPROM resistor value when channel A or B
-# source or sink current
-R_CH_SRS = eeprom_m24c02.read_write(0x10, '', 8, 'float')
-R_CH_SNK = eeprom_m24c02.read_write(0x18, '', 8, 'float')
+# Read calibration board record from EEPROM
+RECORD = calibration_record.load()
+# Resistor value when channel A or B source or sink current
+R_CH_SRS = RECORD.r_ch_srs
+R_CH_SNK = RECORD.r_ch_snk
 # Voltage setpoints for positive and
 # negative current when M1K is in SVMI mode
 SVMI_SETPOINT_POZ = 3.85
 SVMI_SETPOINT_NEG = 1.15
 # Voltage offsets between CHA and CHB
 # caused by the voltage drop on the connector
-COMP_POZ = eeprom_m24c02.read_write(0x61, '', 6, 'float')
-COMP_NEG = eeprom_m24c02.read_write(0x68, '', 7, 'float')
+COMP_POZ = RECORD.comp_poz
+COMP_NEG = RECORD.comp_neg
 
-USB = LED(12)
+instrumentation.install(calibrate_m1k)
+USB = control_m1k.usb_power()
 if __name__ == '__main__':
-    USB.off()
-    sleep(2)
-    USB.on()
-    sleep(2)
-
-    global_.session = Session()
+    # A session kept open by m1k_runner skips the power cycle
+    if global_.session is None:
+        USB.off()
+        sleep(2)
+        USB.on()
 
     # print 'Wait for device to be detected...', \
     #     TEXT['orange'], inspect.stack()[0][1], TEXT['default']
     print TEXT['turquoise'], inspect.stack()[0][1], TEXT['default']
-    while not global_.session.devices:
-        global_.session = Session()
-        sleep(1)
+    control_m1k.wait_for_device(TEXT)
+    parallel_boards.fork_per_device(TEXT)
     # print 'Device detected... Continue calibration...'
 
     BOARD_NUMBER = len(global_.session.devices)
@@ -109,7 +113,8 @@ if __name__ == '__main__':
                 print 'ORDER_INDEX:', ORDER_INDEX, '\tbrdnum:', BOARD_NUMBER
 
             # Grab the first device from the session.
-            global_.dev = global_.session.devices[0]
+            global_.dev = instrumentation.device(
+                global_.session.devices[0])
             global_.CHA = global_.dev.channels['A']
             global_.CHB = global_.dev.channels['B']
 
@@ -119,6 +124,8 @@ if __name__ == '__main__':
 
             device_dir = global_.device_log_dir()
             FILE_NAME = os.path.join(device_dir, 'calib.txt')
+            CALIBRATION = calibration_file.CalibrationFile.load(FILE_NAME)
+            JOURNAL = journal.Journal(os.path.join(device_dir, 'log.jsonl'))
 
             if VIEW_DEBUG_MESSAGES:
                 print '\nORDER_INDEX', ORDER_INDEX, '\tDevID', DEVICE_ID, \
@@ -151,19 +158,21 @@ if __name__ == '__main__':
                      'svmi_setpoint_neg': SVMI_SETPOINT_NEG,
                      'comp_poz': COMP_POZ,
                      'comp_neg': COMP_NEG,
-                     'log_name': os.path.join(device_dir, 'log.txt')}
+                     'journal': JOURNAL}
 
                 INDEX = CHANNEL_INDEX * 2 + 1
                 CHX_F0V_RAW[INDEX] = \
-                    float(calibration_file.extract_data_from_log(
-                        DB_CAL['log_name'], 14 + CHANNEL_INDEX * 6)[INDEX])
-
-                DATA = calibrate_m1k.measure_chx_positive_current(
-                    DB_CAL, TEXT)
-                CHX_S5V_RAW, M1K_HI_Z_CHX, M1K_2V5 = DATA[0], DATA[1], DATA[2]
-                DATA = calibrate_m1k.measure_chx_negative_current(
-                    DB_CAL, TEXT)
-                CHX_S0V_RAW, M1K_HI_Z_CHX, M1K_2V5 = DATA[0], DATA[1], DATA[2]
+                    JOURNAL.lookup('chx_f0v_raw', CHANNEL_NAME)[INDEX]
+
+                with parallel_boards.calibration_board():
+                    DATA = calibrate_m1k.measure_chx_positive_current(
+                        DB_CAL, TEXT)
+                    CHX_S5V_RAW, M1K_HI_Z_CHX, M1K_2V5 = \
+                        DATA[0], DATA[1], DATA[2]
+                    DATA = calibrate_m1k.measure_chx_negative_current(
+                        DB_CAL, TEXT)
+                    CHX_S0V_RAW, M1K_HI_Z_CHX, M1K_2V5 = \
+                        DATA[0], DATA[1], DATA[2]
 
                 DATA = calibrate_m1k.calculate_currents(DB_CAL, TEXT)
                 CALCULATED_I_POZ_REF, CALCULATED_I_NEG_REF = DATA[0], DATA[1]
@@ -179,10 +188,15 @@ if __name__ == '__main__':
                         'calculated_i_neg_ref': CALCULATED_I_NEG_REF,
                         'chx_s0v_raw': CHX_S0V_RAW}
 
-                calibration_file.update(CHANNEL_INDEX, FILE_NAME, STAGES, DATA)
+                calibration_file.update(
+                    CHANNEL_INDEX, CALIBRATION, STAGES, DATA)
 
                 if RESTART_CALIBRATION in range(1, 8, 2):
+                    JOURNAL.flush()
+                    results_db.flush()
+                    CALIBRATION.save(FILE_NAME)
                     global_.dev.write_calibration(FILE_NAME)
+                    checkpoint.save(RESTART_CALIBRATION, FILE_NAME, JOURNAL)
 
                     if VIEW_CALIBRATION_FACTORS:
                         print '\n' + TEXT['turquoise'] + \
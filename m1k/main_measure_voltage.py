@@ -6,11 +6,16 @@ from time import sleep
 
 import calibrate_m1k
 import calibration_file
+import checkpoint
+import calibration_record
 import control_m1k
 import eeprom_m24c02
+import flash_pipeline
 import global_
-from gpiozero import LED
-from pysmu import Session
+import instrumentation
+import journal
+import parallel_boards
+import results_db
 
 # print calibration coeficients calculated by M1K
 VIEW_CALIBRATION_FACTORS = False
@@ -58,31 +63,40 @@ FOURTH_STAGE = False
 BRAKE_SCRIPT = False
 
 # Read from EEPROM External 2V5 reference value
-EX_2V5_REF = eeprom_m24c02.read_write(0x00, '', 6, 'float')
+EX_2V5_REF = calibration_record.load().ex_2v5_ref
 
-USB = LED(12)
+instrumentation.install(calibrate_m1k)
+USB = control_m1k.usb_power()
 if __name__ == '__main__':
-    USB.on()
-    sleep(2)
+    # Firmware upload needs the device released by a kept session
+    global_.session = None
+    if flash_pipeline.take_flashed():
+        print TEXT['green'] + '\nDevice flashed on the flash port' + \
+            TEXT['default']
+        USB.off()
+        sleep(2)
+        USB.on()
+    else:
+        with flash_pipeline.test_port_upload():
+            USB.on()
+            sleep(2)
 
-    if VIEW_DEBUG_MESSAGES:
-        print eeprom_m24c02.read_memory_content()
-
-    control_m1k.upload_firmware(sys.argv[1], 6, TEXT)
+            if VIEW_DEBUG_MESSAGES:
+                print eeprom_m24c02.read_memory_content()
 
-    USB.off()
-    sleep(2)
-    USB.on()
-    sleep(2)
+            control_m1k.upload_firmware(sys.argv[1], 6, TEXT)
 
-    global_.session = Session()
+            USB.off()
+            sleep(2)
+            USB.on()
 
     # print 'Wait for device to be detected...', \
     #     TEXT['orange'], inspect.stack()[0][1], TEXT['default']
     print TEXT['turquoise'], inspect.stack()[0][1], TEXT['default']
-    while not global_.session.devices:
-        global_.session = Session()
-        sleep(1)
+    control_m1k.wait_for_device(TEXT)
+    # Next board is flashed while this one is calibrated and checked
+    flash_pipeline.flash_next(sys.argv[1], TEXT)
+    parallel_boards.fork_per_device(TEXT)
     # print 'Device detected... Start calibration...'
 
     BOARD_NUMBER = len(global_.session.devices)
@@ -95,7 +109,8 @@ if __name__ == '__main__':
                 print 'ORDER_INDEX:', ORDER_INDEX, '\tbrdnum:', BOARD_NUMBER
 
             # Grab the first device from the session.
-            global_.dev = global_.session.devices[0]
+            global_.dev = instrumentation.device(
+                global_.session.devices[0])
             global_.CHA = global_.dev.channels['A']
             global_.CHB = global_.dev.channels['B']
 
@@ -117,15 +132,17 @@ if __name__ == '__main__':
 
             device_dir = global_.device_log_dir()
             FILE_NAME = os.path.join(device_dir, 'calib.txt')
-            calibration_file.copy_text_file('calib_default.txt', FILE_NAME)
+            CALIBRATION = calibration_file.CalibrationFile.load(
+                'calib_default.txt')
 
             if VIEW_DEBUG_MESSAGES:
                 print '\nORDER_INDEX', ORDER_INDEX, '\tDevID', DEVICE_ID,\
                     '\tDevFwVer', DEVICE_FIRMWARE_VERSION, '\tDevHwVer',\
                     DEVICE_HARDWARE_VERSION
 
-            log_name = os.path.join(device_dir, 'log.txt')
-            calibration_file.create_log(log_name)
+            # First stage, the journal of a previous run is replaced
+            JOURNAL = journal.Journal(
+                os.path.join(device_dir, 'log.jsonl'), new=True)
 
             while RESTART_CALIBRATION <= 1:
                 CHANNEL_NAME = chr(CHANNEL_INDEX + 65)
@@ -141,12 +158,13 @@ if __name__ == '__main__':
                     'channel_index': CHANNEL_INDEX,
                     'chx_2v5_ex_ref_raw': CHX_2V5_EX_REF_RAW,
                     'chx_v_i_gnd_raw': CHX_V_I_GND_RAW,
-                    'log_name': log_name}
+                    'journal': JOURNAL}
 
-                CHX_2V5_EX_REF_RAW = calibrate_m1k.measure_chx_external_2v5(
-                    DB_CAL, TEXT)
-                CHX_V_I_GND_RAW = calibrate_m1k.measure_chx_gnd(
-                    DB_CAL, TEXT)
+                with parallel_boards.calibration_board():
+                    CHX_2V5_EX_REF_RAW = \
+                        calibrate_m1k.measure_chx_external_2v5(DB_CAL, TEXT)
+                    CHX_V_I_GND_RAW = calibrate_m1k.measure_chx_gnd(
+                        DB_CAL, TEXT)
 
                 STAGES = {'first_stage': FIRST_STAGE,
                           'second_stage': SECOND_STAGE,
@@ -157,10 +175,15 @@ if __name__ == '__main__':
                         'ex_2v5_ref': EX_2V5_REF,
                         'chx_2v5_ex_ref_raw': CHX_2V5_EX_REF_RAW}
 
-                calibration_file.update(CHANNEL_INDEX, FILE_NAME, STAGES, DATA)
+                calibration_file.update(
+                    CHANNEL_INDEX, CALIBRATION, STAGES, DATA)
 
                 if RESTART_CALIBRATION in range(1, 8, 2):
+                    JOURNAL.flush()
+                    results_db.flush()
+                    CALIBRATION.save(FILE_NAME)
                     global_.dev.write_calibration(FILE_NAME)
+                    checkpoint.save(RESTART_CALIBRATION, FILE_NAME, JOURNAL)
 
                     if VIEW_CALIBRATION_FACTORS:
                         print '\n' + TEXT['turquoise'] + \
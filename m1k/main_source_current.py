@@ -5,10 +5,13 @@ from time import sleep
 
 import calibrate_m1k
 import calibration_file
+import checkpoint
 import control_m1k
 import global_
-from gpiozero import LED
-from pysmu import Session
+import instrumentation
+import journal
+import parallel_boards
+import results_db
 
 # print calibration coeficients calculated by M1K
 VIEW_CALIBRATION_FACTORS = False
@@ -68,21 +71,20 @@ BRAKE_SCRIPT = False
 SRS_I_SETPOINT_POZ = 0.1
 SRS_I_SETPOINT_NEG = -0.1
 
-USB = LED(12)
+instrumentation.install(calibrate_m1k)
+USB = control_m1k.usb_power()
 if __name__ == '__main__':
-    USB.off()
-    sleep(2)
-    USB.on()
-    sleep(2)
-
-    global_.session = Session()
+    # A session kept open by m1k_runner skips the power cycle
+    if global_.session is None:
+        USB.off()
+        sleep(2)
+        USB.on()
 
     # print 'Wait for device to be detected...', \
     #     TEXT['orange'], inspect.stack()[0][1], TEXT['default']
     print TEXT['turquoise'], inspect.stack()[0][1], TEXT['default']
-    while not global_.session.devices:
-        global_.session = Session()
-        sleep(1)
+    control_m1k.wait_for_device(TEXT)
+    parallel_boards.fork_per_device(TEXT)
     # print 'Device detected... Continue calibration...'
 
     BOARD_NUMBER = len(global_.session.devices)
@@ -95,7 +97,8 @@ if __name__ == '__main__':
                 print 'ORDER_INDEX:', ORDER_INDEX, '\tbrdnum:', BOARD_NUMBER
 
             # Grab the first device from the session.
-            global_.dev = global_.session.devices[0]
+            global_.dev = instrumentation.device(
+                global_.session.devices[0])
             global_.CHA = global_.dev.channels['A']
             global_.CHB = global_.dev.channels['B']
 
@@ -105,14 +108,17 @@ if __name__ == '__main__':
 
             device_dir = global_.device_log_dir()
             FILE_NAME = os.path.join(device_dir, 'calib.txt')
-            log_name = os.path.join(device_dir, 'log.txt')
+            CALIBRATION = calibration_file.CalibrationFile.load(FILE_NAME)
+            JOURNAL = journal.Journal(os.path.join(device_dir, 'log.jsonl'))
 
             if VIEW_DEBUG_MESSAGES:
                 print '\nORDER_INDEX', ORDER_INDEX, '\tDevID', DEVICE_ID, \
                     '\tDevFwVer', DEVICE_FIRMWARE_VERSION, '\tDevHwVer', \
                     DEVICE_HARDWARE_VERSION
 
-            LOG_M1K_2V5 = calibration_file.extract_data_from_log(log_name, 47)
+            # M1K 2V5 values of both channels measured by the last
+            # measure current step, channel B negative current
+            LOG_M1K_2V5 = JOURNAL.lookup('m1k_2v5', 'B')
             M1K_2V5[0] = float(LOG_M1K_2V5[0])
             M1K_2V5[1] = float(LOG_M1K_2V5[1])
             M1K_2V5[5] = float(LOG_M1K_2V5[5])
@@ -137,16 +143,20 @@ if __name__ == '__main__':
                      'chx_s_poz_raw': CHX_S_POZ_RAW,
                      'chx_s_neg_raw': CHX_S_NEG_RAW,
                      'm1k_2v5': M1K_2V5,
-                     'log_name': log_name}
+                     'journal': JOURNAL}
 
-                DATA = calibrate_m1k.source_chx_0a_current(DB_CAL, TEXT)
-                CHX_S0A_RAW, M1K_2V5 = DATA[0], DATA[1]
+                # Current is sourced in the calibration board load
+                with parallel_boards.calibration_board():
+                    DATA = calibrate_m1k.source_chx_0a_current(DB_CAL, TEXT)
+                    CHX_S0A_RAW, M1K_2V5 = DATA[0], DATA[1]
 
-                DATA = calibrate_m1k.source_chx_positive_current(DB_CAL, TEXT)
-                CHX_S_POZ_RAW, M1K_2V5 = DATA[0], DATA[1]
+                    DATA = calibrate_m1k.source_chx_positive_current(
+                        DB_CAL, TEXT)
+                    CHX_S_POZ_RAW, M1K_2V5 = DATA[0], DATA[1]
 
-                DATA = calibrate_m1k.source_chx_negative_current(DB_CAL, TEXT)
-                CHX_S_NEG_RAW, M1K_2V5 = DATA[0], DATA[1]
+                    DATA = calibrate_m1k.source_chx_negative_current(
+                        DB_CAL, TEXT)
+                    CHX_S_NEG_RAW, M1K_2V5 = DATA[0], DATA[1]
 
                 # Disconnect channels from GND and 2V5
                 # using internal M1K switches
@@ -164,10 +174,15 @@ if __name__ == '__main__':
                         'srs_i_setpoint_neg': SRS_I_SETPOINT_NEG,
                         'chx_s_neg_raw': CHX_S_NEG_RAW}
 
-                calibration_file.update(CHANNEL_INDEX, FILE_NAME, STAGES, DATA)
+                calibration_file.update(
+                    CHANNEL_INDEX, CALIBRATION, STAGES, DATA)
 
                 if RESTART_CALIBRATION in range(1, 8, 2):
+                    JOURNAL.flush()
+                    results_db.flush()
+                    CALIBRATION.save(FILE_NAME)
                     global_.dev.write_calibration(FILE_NAME)
+                    checkpoint.save(RESTART_CALIBRATION, FILE_NAME, JOURNAL)
 
                     if VIEW_CALIBRATION_FACTORS:
                         print '\n' + TEXT['turquoise'] + \
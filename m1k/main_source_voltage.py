@@ -5,9 +5,13 @@ from time import sleep
 
 import calibrate_m1k
 import calibration_file
+import checkpoint
+import control_m1k
 import global_
-from gpiozero import LED
-from pysmu import Session
+import instrumentation
+import journal
+import parallel_boards
+import results_db
 
 # print calibration coeficients calculated by M1K
 VIEW_CALIBRATION_FACTORS = False
@@ -56,21 +60,20 @@ FOURTH_STAGE = False
 # Stop script execution until user press ENTER
 BRAKE_SCRIPT = False
 
-USB = LED(12)
+instrumentation.install(calibrate_m1k)
+USB = control_m1k.usb_power()
 if __name__ == '__main__':
-    USB.off()
-    sleep(2)
-    USB.on()
-    sleep(2)
-
-    global_.session = Session()
+    # A session kept open by m1k_runner skips the power cycle
+    if global_.session is None:
+        USB.off()
+        sleep(2)
+        USB.on()
 
     # print 'Wait for device to be detected...', \
     #     TEXT['orange'], inspect.stack()[0][1], TEXT['default']
     print TEXT['turquoise'], inspect.stack()[0][1], TEXT['default']
-    while not global_.session.devices:
-        global_.session = Session()
-        sleep(1)
+    control_m1k.wait_for_device(TEXT)
+    parallel_boards.fork_per_device(TEXT)
     # print 'Device detected... Continue calibration...'
 
     BOARD_NUMBER = len(global_.session.devices)
@@ -83,7 +86,8 @@ if __name__ == '__main__':
                 print 'ORDER_INDEX:', ORDER_INDEX, '\tbrdnum:', BOARD_NUMBER
 
             # Grab the first device from the session.
-            global_.dev = global_.session.devices[0]
+            global_.dev = instrumentation.device(
+                global_.session.devices[0])
             global_.CHA = global_.dev.channels['A']
             global_.CHB = global_.dev.channels['B']
 
@@ -93,6 +97,8 @@ if __name__ == '__main__':
 
             device_dir = global_.device_log_dir()
             FILE_NAME = os.path.join(device_dir, 'calib.txt')
+            CALIBRATION = calibration_file.CalibrationFile.load(FILE_NAME)
+            JOURNAL = journal.Journal(os.path.join(device_dir, 'log.jsonl'))
 
             if VIEW_DEBUG_MESSAGES:
                 print '\nORDER_INDEX', ORDER_INDEX, '\tDevID', DEVICE_ID, \
@@ -114,7 +120,7 @@ if __name__ == '__main__':
                      'chx_f0v_raw': CHX_F0V_RAW,
                      'chx_f2v5_raw': CHX_F2V5_RAW,
                      'do_not_get_m1k_2v5_val': DO_NOT_GET_M1K_2V5_VAL,
-                     'log_name': os.path.join(device_dir, 'log.txt')}
+                     'journal': JOURNAL}
 
                 CHX_F0V_RAW = calibrate_m1k.source_chx_0v_without_load(
                     DB_CAL, TEXT)
@@ -129,10 +135,15 @@ if __name__ == '__main__':
                 DATA = {'chx_f0v_raw': CHX_F0V_RAW,
                         'chx_f2v5_raw': CHX_F2V5_RAW}
 
-                calibration_file.update(CHANNEL_INDEX, FILE_NAME, STAGES, DATA)
+                calibration_file.update(
+                    CHANNEL_INDEX, CALIBRATION, STAGES, DATA)
 
                 if RESTART_CALIBRATION in range(1, 8, 2):
+                    JOURNAL.flush()
+                    results_db.flush()
+                    CALIBRATION.save(FILE_NAME)
                     global_.dev.write_calibration(FILE_NAME)
+                    checkpoint.save(RESTART_CALIBRATION, FILE_NAME, JOURNAL)
 
                     if VIEW_CALIBRATION_FACTORS:
                         print '\n' + TEXT['turquoise'] + \
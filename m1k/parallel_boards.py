@@ -0,0 +1,91 @@
+"""Module used to calibrate several M1K boards at the same time.
+
+With M1K_PARALLEL=1 a main script forks one worker process per detected
+board and each worker runs the rest of the script with a session that
+contains only its board. Module state in global_ is per process, so the
+workers do not share it. The calibration board (ADP5589, AD5647R and
+AD7091R5) is shared, so steps using it run inside calibration_board(),
+while steps using only the M1K overlap between workers.
+"""
+import atexit
+import multiprocessing
+import os
+from contextlib import contextmanager
+
+import control_m1k
+import global_
+from pysmu import Session
+
+ENABLED = os.getenv('M1K_PARALLEL', '0') == '1'
+
+# Set in worker processes
+WORKER = False
+BOARD_LOCK = None
+
+
+@contextmanager
+def calibration_board():
+    """Get exclusive access to the calibration board.
+
+    Registers written by other workers are unknown, so the bus shadow
+    is invalidated when the access is granted.
+    """
+    if BOARD_LOCK is None:
+        yield
+        return
+    with BOARD_LOCK:
+        global_.bus.invalidate()
+        yield
+
+
+def device_session(serial):
+    """Create session containing only the device with serial number."""
+    control_m1k.forget_m1k_state()
+    session = Session(add_all=False)
+    session.scan()
+    for device in session.available_devices:
+        if device.serial == serial:
+            session.add(device)
+    return session
+
+
+def fork_per_device(text, power_off=False):
+    """Fork a worker for each device when more boards are detected.
+
+    Returns in the workers, with global_.session holding one board.
+    The parent waits for all workers and exits with status 1 if any
+    worker failed.
+    """
+    global WORKER, BOARD_LOCK
+    if not ENABLED or len(global_.session.devices) <= 1:
+        return
+    serials = [device.serial for device in global_.session.devices]
+    # Devices are claimed again by the workers sessions
+    global_.session = global_.dev = global_.CHA = global_.CHB = None
+    BOARD_LOCK = multiprocessing.Lock()
+    workers = {}
+    for serial in serials:
+        pid = os.fork()
+        if pid == 0:
+            WORKER = True
+            # Exit handlers (GPIO cleanup) belong to the parent
+            del atexit._exithandlers[:]
+            global_.session = device_session(serial)
+            return
+        workers[pid] = serial
+
+    failed = []
+    while workers:
+        pid, status = os.wait()
+        if status != 0:
+            failed.append(workers[pid])
+        del workers[pid]
+    BOARD_LOCK = None
+    if power_off:
+        global_.usb.off()
+    for serial in serials:
+        if serial in failed:
+            print text['red'] + serial + ' FAIL' + text['default']
+        else:
+            print text['green'] + serial + ' PASS' + text['default']
+    exit(1 if failed else 0)
@@ -0,0 +1,95 @@
+"""Module used to shorten reference measurements repeated on every board.
+
+The 5V0 and 2V5 rails checked by main_check_performances.py barely move
+between consecutive boards. Each full measurement of a reference is
+cached with its time and the Pi CPU temperature. While the cached value
+is valid, the next boards read one block of conversions and keep it if
+it is within MAX_DRIFT volts of the cached value and clear of the check
+limits by MAX_DRIFT, else the reference is measured in full again and
+cached. A cached value is valid if:
+- it is not older than M1K_REFERENCE_MAX_AGE seconds,
+- the CPU temperature moved less than M1K_REFERENCE_MAX_TEMP_DRIFT
+  degrees since (not checked where the temperature is not available),
+- it was reused less than M1K_REFERENCE_SENTINEL times, so every Nth
+  board measures the reference in full.
+Every board is still measured. The external 2.5 V read by the M1K
+channels is not cached, it is the gain reference of each calibration.
+"""
+import json
+import os
+from time import time
+
+import global_
+
+CACHE_FILE = os.path.join(global_.CACHEDIR, 'references.json')
+
+MAX_AGE = float(os.getenv('M1K_REFERENCE_MAX_AGE', '600'))
+MAX_TEMP_DRIFT = float(os.getenv('M1K_REFERENCE_MAX_TEMP_DRIFT', '3'))
+MAX_DRIFT = float(os.getenv('M1K_REFERENCE_MAX_DRIFT', '0.01'))
+SENTINEL = int(os.getenv('M1K_REFERENCE_SENTINEL', '10'))
+
+THERMAL_FILE = '/sys/class/thermal/thermal_zone0/temp'
+
+
+def cpu_temperature():
+    """Return Pi CPU temperature in degrees, None if not available."""
+    try:
+        with open(THERMAL_FILE, 'r') as thermal:
+            return int(thermal.read()) / 1000.0
+    except (IOError, ValueError):
+        return None
+
+
+def load():
+    """Return cached references by name."""
+    try:
+        with open(CACHE_FILE, 'r') as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def save(references):
+    """Write cached references."""
+    # Board workers write the file too, it is replaced in one step
+    temporary = CACHE_FILE + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'w') as cache_file:
+        json.dump(references, cache_file)
+    os.rename(temporary, CACHE_FILE)
+
+
+def is_valid(reference, temperature):
+    """Check if cached reference can be reused at CPU temperature."""
+    if reference is None or reference['reused'] >= SENTINEL - 1:
+        return False
+    if time() - reference['time'] > MAX_AGE:
+        return False
+    if temperature is None or reference['temperature'] is None:
+        return True
+    return abs(temperature - reference['temperature']) <= MAX_TEMP_DRIFT
+
+
+def measure(name, limits, full_measure, quick_measure):
+    """Return value of reference name checked against limits.
+
+    full_measure and quick_measure return the value measured with all
+    the samples and with one block of samples.
+    """
+    references = load()
+    temperature = cpu_temperature()
+    reference = references.get(name)
+    if is_valid(reference, temperature):
+        value = quick_measure()
+        if abs(value - reference['value']) <= MAX_DRIFT and \
+                limits[0] + MAX_DRIFT <= value < limits[1] - MAX_DRIFT:
+            reference['reused'] += 1
+            save(references)
+            return value
+    value = full_measure()
+    if not limits[0] <= value < limits[1]:
+        # A failed board does not replace the reference
+        return value
+    references[name] = {'value': value, 'time': round(time(), 3),
+                        'temperature': temperature, 'reused': 0}
+    save(references)
+    return value
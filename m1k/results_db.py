@@ -0,0 +1,193 @@
+"""Module used to store board results in a local SQLite database.
+
+Every check of main_check_performances.py and every mean value measured
+by the calibration stages (steps named cal_*) is a measurement row with
+the serial number, run, step, channel, value, limits and pass/fail. The
+result of each run (PASSED/FAILED) is a board row added by
+adalm_1000_factory.sh. Measurements are buffered and written in one
+transaction when the stage ends or a calibrated channel is saved.
+
+Usage: python results_db.py <command> [--since 7d|12h|YYYY-MM-DD]
+    yield [--by day|fwver]        runs, passed boards and yield
+    steps                         distribution of each step and channel
+    drift <step> [--channel A|B]  daily mean, deviation and range of step
+    result <serial> PASSED|FAILED record the result of the current run
+The database is M1K_RESULTS_DB, log/_results.db by default.
+"""
+import atexit
+import os
+import sqlite3
+import sys
+from math import sqrt
+from time import mktime, strptime, time
+
+# Queries run off the jig too, so the hardware modules are not imported
+DB_FILE = os.getenv('M1K_RESULTS_DB', os.path.join(
+    os.getenv('LOGDIR', './log'), '_results.db'))
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS measurements (serial TEXT, run TEXT, '
+    'fwver TEXT, time REAL, step TEXT, channel TEXT, value REAL, '
+    'reference REAL, low REAL, high REAL, unit TEXT, passed INTEGER)',
+    'CREATE INDEX IF NOT EXISTS measurements_serial '
+    'ON measurements (serial, run)',
+    'CREATE INDEX IF NOT EXISTS measurements_step '
+    'ON measurements (step, channel, time)',
+    'CREATE TABLE IF NOT EXISTS boards (serial TEXT, run TEXT, '
+    'fwver TEXT, time REAL, result TEXT)',
+    'CREATE INDEX IF NOT EXISTS boards_time ON boards (time)']
+
+# Measurements not yet written, by the process that recorded them
+pending = []
+pending_pid = None
+
+DAY = "date(time, 'unixepoch', 'localtime')"
+
+
+def connect():
+    """Return connection to the database, created if missing."""
+    connection = sqlite3.connect(DB_FILE, timeout=30)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def record(device, step, channel, value, reference=None,
+           limits=(None, None), unit='', passed=None):
+    """Buffer measurement of step on device for channel 'A', 'B' or
+    None."""
+    global pending_pid
+    if pending_pid != os.getpid():
+        # Board worker forks write their own measurements
+        del pending[:]
+        pending_pid = os.getpid()
+        atexit.register(flush)
+    pending.append((
+        device.serial, os.getenv('RUN_TIMESTAMP', 'unknown_time'),
+        str(device.fwver), time(), step, channel, value, reference,
+        limits[0], limits[1], unit, None if passed is None else int(passed)))
+
+
+def flush():
+    """Write buffered measurements."""
+    if pending_pid != os.getpid() or not pending:
+        return
+    connection = connect()
+    with connection:
+        connection.executemany(
+            'INSERT INTO measurements VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', pending)
+    connection.close()
+    del pending[:]
+
+
+def record_result(serial, result):
+    """Add result of the current run of the board."""
+    run = os.getenv('RUN_TIMESTAMP', 'unknown_time')
+    connection = connect()
+    with connection:
+        # Firmware of the run is known if its checks were recorded
+        row = connection.execute(
+            'SELECT fwver FROM measurements WHERE serial = ? AND run = ? '
+            'LIMIT 1', (serial, run)).fetchone()
+        connection.execute('INSERT INTO boards VALUES (?, ?, ?, ?, ?)',
+                           (serial, run, row[0] if row else None, time(),
+                            result))
+    connection.close()
+
+
+def parse_since(since):
+    """Return time of '7d', '12h' or 'YYYY-MM-DD', 0 for None."""
+    if since is None:
+        return 0
+    if since[-1] in 'dh':
+        return time() - float(since[:-1]) * \
+            (86400 if since[-1] == 'd' else 3600)
+    return mktime(strptime(since, '%Y-%m-%d'))
+
+
+def statistics(values):
+    """Return mean, standard deviation, minimum and maximum of values."""
+    mean = sum(values) / len(values)
+    deviation = sqrt(sum((value - mean) ** 2 for value in values) /
+                     len(values))
+    return mean, deviation, min(values), max(values)
+
+
+def print_yield(connection, since, group_by):
+    """Print runs, passed boards and yield, per day or firmware."""
+    group = DAY if group_by == 'day' else group_by or "'all'"
+    print '{0:<12} {1:>6} {2:>7} {3:>7} {4:>7}'.format(
+        group_by or '', 'runs', 'boards', 'passed', 'yield')
+    for row in connection.execute(
+            'SELECT ' + group + ', COUNT(*), COUNT(DISTINCT serial), '
+            "COUNT(DISTINCT CASE WHEN result = 'PASSED' THEN serial END) "
+            'FROM boards WHERE time >= ? GROUP BY 1 ORDER BY 1', (since,)):
+        print '{0:<12} {1:>6} {2:>7} {3:>7} {4:>6.1f}%'.format(
+            row[0], row[1], row[2], row[3], 100.0 * row[3] / row[2])
+
+
+def print_steps(connection, since):
+    """Print distribution and failures of each step and channel."""
+    values = {}
+    for step, channel, value, passed in connection.execute(
+            'SELECT step, channel, value, passed FROM measurements '
+            'WHERE time >= ? AND value IS NOT NULL', (since,)):
+        values.setdefault((step, channel or '-'), []).append(
+            (value, passed))
+    print '{0:<31} {1:>2} {2:>6} {3:>5} {4:>9} {5:>8} {6:>9} {7:>9}'.format(
+        'step', 'CH', 'count', 'fail', 'mean', 'std', 'min', 'max')
+    for step, channel in sorted(values):
+        measured = values[step, channel]
+        print '{0:<31} {1:>2} {2:>6} {3:>5} {4:>9.4f} {5:>8.4f} ' \
+            '{6:>9.4f} {7:>9.4f}'.format(
+                step, channel, len(measured),
+                len([passed for _, passed in measured if passed == 0]),
+                *statistics([value for value, _ in measured]))
+
+
+def print_drift(connection, since, step, channel):
+    """Print daily statistics of a step."""
+    query = 'SELECT ' + DAY + ', value FROM measurements ' \
+        'WHERE step = ? AND time >= ? AND value IS NOT NULL'
+    parameters = [step, since]
+    if channel:
+        query += ' AND channel = ?'
+        parameters.append(channel)
+    days = {}
+    for day, value in connection.execute(query, parameters):
+        days.setdefault(day, []).append(value)
+    print step + (' CH_' + channel if channel else '')
+    print '{0:<12} {1:>6} {2:>9} {3:>8} {4:>9} {5:>9}'.format(
+        'day', 'count', 'mean', 'std', 'min', 'max')
+    for day in sorted(days):
+        print '{0:<12} {1:>6} {2:>9.4f} {3:>8.4f} {4:>9.4f} ' \
+            '{5:>9.4f}'.format(day, len(days[day]),
+                               *statistics(days[day]))
+
+
+def option(args, name):
+    """Remove option and its value from args, return value or None."""
+    if name not in args:
+        return None
+    value = args[args.index(name) + 1]
+    del args[args.index(name):args.index(name) + 2]
+    return value
+
+
+if __name__ == '__main__':
+    ARGS = sys.argv[1:]
+    SINCE = parse_since(option(ARGS, '--since'))
+    GROUP_BY = option(ARGS, '--by')
+    CHANNEL = option(ARGS, '--channel')
+    if ARGS[:1] == ['result'] and len(ARGS) == 3:
+        record_result(ARGS[1], ARGS[2])
+    elif ARGS == ['yield'] and GROUP_BY in (None, 'day', 'fwver'):
+        print_yield(connect(), SINCE, GROUP_BY)
+    elif ARGS == ['steps']:
+        print_steps(connect(), SINCE)
+    elif ARGS[:1] == ['drift'] and len(ARGS) == 2:
+        print_drift(connect(), SINCE, ARGS[1], CHANNEL)
+    else:
+        print __doc__
+        exit(1)
@@ -0,0 +1,37 @@
+"""Convert sample logs saved by debug.log_samples in CSV files.
+
+Usage: python samples_to_csv.py <log.npz or directory> ...
+The CSV file is written next to each .npz file.
+"""
+import os
+import sys
+
+from numpy import load, savetxt
+
+
+def convert(file_name):
+    """Write CSV file of a sample log, return its name."""
+    log = load(file_name)
+    csv_name = os.path.splitext(file_name)[0] + '.csv'
+    savetxt(csv_name, log['samples'].T, fmt='%.12g', delimiter=',',
+            header=','.join(log['columns']), comments='')
+    return csv_name
+
+
+def sample_logs(path):
+    """Return sample logs in path, a file or a directory."""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(directory, name)
+        for directory, _, names in os.walk(path)
+        for name in names if name.endswith('.npz'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        exit(1)
+    for PATH in sys.argv[1:]:
+        for LOG in sample_logs(PATH):
+            print convert(LOG)
@@ -33,7 +33,9 @@ setup_apt_install_prereqs() {
 		cmake build-essential git bison flex locales-all \
 		expect usbutils screen python-smbus python-matplotlib \
 		cython wget curl libusb-dev libusb-1.0-0-dev \
-		libboost-dev openssh-server i2c-tools pmount htpdate
+		libboost-dev openssh-server i2c-tools pmount htpdate python-pip \
+		python-pyudev
+	pip install smbus2
 	EOF
 	sudo /etc/init.d/htpdate restart
 }
@@ -0,0 +1,170 @@
+"""Module with an I2C bus wrapper that shadows written registers."""
+
+from contextlib import contextmanager
+
+# SMBus block transfers are limited to 32 data bytes
+BLOCK_MAX = 32
+
+
+class ShadowBus(object):
+    """SMBus wrapper with register shadow, write coalescing and counters.
+
+    Register devices (ADP5589) have byte registers with address
+    auto-increment, they are shadowed per register and adjacent registers
+    written inside coalesce() are merged in block writes.
+    Command devices (AD5647R, AD7091R5) are shadowed per command byte
+    with the whole payload. Writes to other devices (M24C02) pass through.
+    The wrapped bus is opened by open_bus at the first transaction.
+    """
+
+    def __init__(self, open_bus, register_devices=(), command_devices=()):
+        self.open_bus = open_bus
+        self.opened = None
+        self.register_devices = register_devices
+        self.command_devices = command_devices
+        self.shadow = {}
+        self.pending = {}
+        self.coalesce_depth = 0
+        self.transactions = {}
+        self.suppressed = {}
+
+    def __getattr__(self, name):
+        if name in ('bus', 'open_bus', 'opened'):
+            raise AttributeError(name)
+        return getattr(self.bus, name)
+
+    @property
+    def bus(self):
+        """Wrapped bus, opened on first use."""
+        if self.opened is None:
+            self.opened = self.open_bus()
+        return self.opened
+
+    def count(self, addr, counter=None):
+        """Count one transaction for device."""
+        counter = self.transactions if counter is None else counter
+        counter[addr] = counter.get(addr, 0) + 1
+
+    def invalidate(self, addr=None, reg=None):
+        """Forget shadowed registers of a device or of all devices.
+
+        With reg only that register is forgotten, so the next write of a
+        write 1 to clear register reaches the device.
+        """
+        for key in self.shadow.keys():
+            if (addr is None or key[0] == addr) and \
+                    (reg is None or key[1] == reg):
+                del self.shadow[key]
+
+    @contextmanager
+    def coalesce(self):
+        """Delay register writes and flush them as merged block writes."""
+        self.coalesce_depth += 1
+        try:
+            yield
+        finally:
+            self.coalesce_depth -= 1
+            if self.coalesce_depth == 0:
+                self.flush()
+
+    def flush(self):
+        """Write pending registers which differ from the shadow."""
+        pending, self.pending = self.pending, {}
+        for addr in sorted(set(key[0] for key in pending)):
+            registers = sorted(
+                reg for (dev, reg) in pending if dev == addr and
+                self.shadow.get((addr, reg)) != pending[(addr, reg)])
+            self.suppressed[addr] = self.suppressed.get(addr, 0) + \
+                len([key for key in pending if key[0] == addr]) - \
+                len(registers)
+            for run in self.register_runs(addr, registers):
+                self.write_run(addr, run[0], [
+                    pending.get((addr, reg), self.shadow.get((addr, reg)))
+                    for reg in range(run[0], run[1] + 1)])
+
+    def register_runs(self, addr, registers):
+        """Group registers in runs, gaps are filled from the shadow."""
+        runs = []
+        for reg in registers:
+            if runs and reg - runs[-1][0] < BLOCK_MAX and all(
+                    (addr, gap) in self.shadow or (addr, gap) in self.pending
+                    for gap in range(runs[-1][1] + 1, reg)):
+                runs[-1][1] = reg
+            else:
+                runs.append([reg, reg])
+        return runs
+
+    def write_run(self, addr, reg, data):
+        """Write consecutive registers in one transaction."""
+        if len(data) == 1:
+            self.bus.write_byte_data(addr, reg, data[0])
+        else:
+            self.bus.write_i2c_block_data(addr, reg, data)
+        self.count(addr)
+        for offset, value in enumerate(data):
+            self.shadow[(addr, reg + offset)] = value
+
+    def write_registers(self, addr, reg, data):
+        """Write registers of a register device."""
+        if self.coalesce_depth:
+            for offset, value in enumerate(data):
+                self.pending[(addr, reg + offset)] = value
+            return
+        changed = [offset for offset, value in enumerate(data)
+                   if self.shadow.get((addr, reg + offset)) != value]
+        if not changed:
+            self.count(addr, self.suppressed)
+            return
+        self.write_run(
+            addr, reg + changed[0], list(data[changed[0]:changed[-1] + 1]))
+
+    def write_command(self, addr, cmd, data, write):
+        """Write command of a command device unless already written."""
+        if self.shadow.get((addr, cmd)) == tuple(data):
+            self.count(addr, self.suppressed)
+            return
+        write()
+        self.count(addr)
+        self.shadow[(addr, cmd)] = tuple(data)
+
+    def write_byte_data(self, addr, reg, value):
+        """Write one byte register."""
+        if addr in self.register_devices:
+            self.write_registers(addr, reg, [value])
+        elif addr in self.command_devices:
+            self.write_command(addr, reg, [value], lambda: (
+                self.bus.write_byte_data(addr, reg, value)))
+        else:
+            self.bus.write_byte_data(addr, reg, value)
+            self.count(addr)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        """Write a block of data."""
+        if addr in self.register_devices:
+            self.write_registers(addr, reg, data)
+        elif addr in self.command_devices:
+            self.write_command(addr, reg, data, lambda: (
+                self.bus.write_i2c_block_data(addr, reg, data)))
+        else:
+            self.bus.write_i2c_block_data(addr, reg, data)
+            self.count(addr)
+
+    def write_quick(self, addr):
+        """Send device address only, used for acknowledge polling."""
+        self.count(addr)
+        return self.bus.write_quick(addr)
+
+    def read_byte_data(self, addr, reg):
+        """Read one byte register."""
+        self.count(addr)
+        return self.bus.read_byte_data(addr, reg)
+
+    def read_i2c_block_data(self, addr, reg, length):
+        """Read a block of data."""
+        self.count(addr)
+        return self.bus.read_i2c_block_data(addr, reg, length)
+
+    def i2c_rdwr(self, *messages):
+        """Run combined transfer, counted as one transaction."""
+        self.count(messages[0].addr)
+        return self.bus.i2c_rdwr(*messages)
@@ -0,0 +1,900 @@
+"""Simulated calibration board and M1K for running the stages without a jig.
+
+Usage: python simulator.py <script.py> [arguments]
+    Install simulated smbus, smbus2, pysmu, gpiozero and serial modules
+    and run the script, e.g. main_check_performances.py, or
+    m1k_runner.py --serve to serve the stages from the simulator.
+
+The I2C bus has register models of the ADP5589 relays expander, the
+AD5647R DAC, the AD7091R5 ADC and the M24C02 EEPROM. The M1K devices have
+measurement and source errors, noise, settling and USB latency, and use
+the calibration file written to them. Transfers take the time they take
+on the jig, scaled by M1K_SIM_TIME_SCALE (0 runs without delays).
+
+The EEPROM content and the M1K calibration are kept in M1K_SIM_STATE, so
+the stages run one after another as by adalm_1000_factory.sh.
+"""
+import atexit
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+import weakref
+import zlib
+from time import sleep, time
+
+from numpy import arange, array, clip
+from numpy import exp as array_exp
+from numpy.random import RandomState
+
+import calibration_file
+
+TIME_SCALE = float(os.getenv('M1K_SIM_TIME_SCALE', '1'))
+I2C_CLOCK = float(os.getenv('M1K_SIM_I2C_CLOCK', '100000'))
+USB_LATENCY = float(os.getenv('M1K_SIM_USB_LATENCY', '0.005'))
+SETTLING_TIME = float(os.getenv('M1K_SIM_SETTLING', '0.0005'))
+NOISE_V = float(os.getenv('M1K_SIM_NOISE_V', '0.0005'))
+NOISE_I = float(os.getenv('M1K_SIM_NOISE_I', '0.00005'))
+ADC_NOISE = float(os.getenv('M1K_SIM_ADC_NOISE', '1.0'))
+DEVICES = int(os.getenv('M1K_SIM_DEVICES', '1'))
+# A board in SAM-BA mode waits on the flash port (M1K_PIPELINE=1)
+FLASH_PORT = os.getenv('M1K_SIM_FLASH_PORT', '1') == '1'
+STATE_DIR = os.getenv(
+    'M1K_SIM_STATE', os.path.join(tempfile.gettempdir(), 'm1k_sim'))
+REPORT = os.getenv('M1K_SIM_REPORT', '1') == '1'
+POPEN = subprocess.Popen
+
+# Bus costs: I2C ioctl overhead, a byte is 8 bits and ACK, a message
+# adds start and stop conditions
+I2C_TRANSFER_OVERHEAD = 0.00005
+I2C_BYTE_BITS = 9
+I2C_MESSAGE_BITS = 2
+# M1K: control transfer round trip, sample rate, enumeration after power
+# on and firmware upload
+USB_CONTROL_LATENCY = 0.001
+SAMPLE_RATE = 100000
+ENUMERATION_TIME = 1.0
+FIRMWARE_UPLOAD_TIME = 3.0
+EEPROM_WRITE_CYCLE = 0.005
+
+EXPANDER_ID = 0x34
+DAC_ID = 0x0E
+ADC_ID = 0x2A
+EEPROM_ID = 0x50
+
+# Expander data out registers and their pins, bit 0 first
+PORT_PINS = {
+    0x2A: ['GPIO_7', 'GPIO_9', 'GPIO_10', 'EN_1V2', 'GPIO_0', 'GPIO_3',
+           'GPIO_1', 'GPIO_2'],
+    0x2B: ['GPIO_5', 'GPIO_6', '3V3_M1K', 'LED_1', 'PIO_3', 'PIO_2',
+           'PIO_1', 'PIO_0'],
+    0x2C: ['LED_2', 'USB_GPO', 'GPIO_8']}
+GPI_STATUS_REGS = {0x16: 0x2A, 0x17: 0x2B, 0x18: 0x2C}
+GPI_INT_LEVEL_REGS = {0x16: 0x1E, 0x17: 0x1F, 0x18: 0x20}
+# Port B inputs: M1K PIO 0 to 3, M1K 3V3 and the start button
+PIO_BITS = [0x80, 0x40, 0x20, 0x10]
+M1K_3V3_BIT = 0x04
+BUTTON_BIT = 0x08
+# Interrupt of the button: GPI_INT_STAT_B, GPI_INTERRUPT_EN_B and the GPI
+# interrupt enable of INT_EN, the INT output goes to EXPANDER_INT_PIN
+GPI_INT_STAT_B = 0x14
+GPI_INTERRUPT_EN_B = 0x25
+INT_EN = 0x4E
+GPI_IEN = 0x02
+EXPANDER_INT_PIN = os.getenv('M1K_EXPANDER_INT_PIN')
+
+# Relays connecting M1K channel and aux input to the board
+CHANNEL_RELAYS = {'A': ('GPIO_8', 'GPIO_10'), 'B': ('GPIO_7', 'GPIO_9')}
+# M1K switches and PIO pins set by ctrl_transfer 0x50 (close, low) and
+# 0x51 (open, high)
+SWITCHES = {32: ('A', '2v5'), 33: ('A', 'gnd'), 37: ('B', '2v5'),
+            38: ('B', 'gnd')}
+PIO_PINS = {4: 0, 5: 1, 6: 2, 7: 3}
+
+# Board: external 2V5 reference, ADC 1V2 reference and input dividers,
+# current sense amplifier, load resistors, DAC and its amplifier
+EX_2V5 = 2.5004
+ADC_REF = 1.2
+ADC_DIVIDERS = [None, 5.0, 5.0, 2.5]
+CSA_OFFSET_CODE = 2048.5
+CSA_CODES_PER_AMP = 10000.0
+LOAD_RESISTOR = 13.5
+SENSE_RESISTOR = 1e6
+DAC_REF = 2.5
+DAC_GAIN = 2.0
+DAC_OFFSET = 0.0015
+
+# Sealed EEPROM record matching the board model
+RECORD_TEXT = {
+    'ex_2v5_ref': '2.5004', 'ex_1v2_ref': '1.2000',
+    'r_ch_srs': '13.50000', 'r_ch_snk': '13.50000',
+    'msb_dac_srs_1v25': '40', 'lsb_dac_srs_1v25': '00',
+    'msb_dac_srs_3v75': 'C0', 'lsb_dac_srs_3v75': '00',
+    'adc_offset_vin1': '0', 'adc_scale_vin1': '5.0000',
+    'adc_gain_vin1': '1.0000', 'adc_offset_vin2': '0',
+    'adc_scale_vin2': '5.0000', 'adc_gain_vin2': '1.0000',
+    'adc_offset_vin3': '0', 'adc_scale_vin3': '2.5000',
+    'adc_gain_vin3': '1.0000', 'comp_poz': '0.0000', 'comp_neg': '0.0000',
+    'adc_offset_poz': '800', 'adc_gain_poz': 'BE8', 'i_gain_poz': '0.1000',
+    'adc_offset_neg': '800', 'adc_gain_neg': '418',
+    'i_gain_neg': '-0.1000'}
+
+HI_Z, SVMI, SIMV = 0, 1, 2
+
+jig = None
+noise = RandomState(
+    int(os.getenv('M1K_SIM_SEED')) if os.getenv('M1K_SIM_SEED') else None)
+
+
+def delay(seconds):
+    """Wait for a simulated duration."""
+    if TIME_SCALE > 0:
+        sleep(seconds * TIME_SCALE)
+
+
+def now():
+    """Return simulated time, inf when running without delays."""
+    if TIME_SCALE > 0:
+        return time() / TIME_SCALE
+    return float('inf')
+
+
+def state_file(name):
+    """Return path of a file kept between stages."""
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    return os.path.join(STATE_DIR, name)
+
+
+def default_eeprom():
+    """Return memory content of a configured and sealed board."""
+    import calibration_record
+    memory = bytearray(' ' * 256)
+    for name, address, nr_of_bytes, _ in calibration_record.FIELDS:
+        memory[address:address + nr_of_bytes] = \
+            RECORD_TEXT[name].ljust(nr_of_bytes)
+    crc = calibration_record.checksum(memory)
+    memory[calibration_record.CHECKSUM_ADDRESS:] = '%08x' % crc
+    return memory
+
+
+class Expander(object):
+    """ADP5589 registers, GPI status reads return the pin levels."""
+
+    def __init__(self, board):
+        self.board = board
+        self.registers = bytearray(0x50)
+        self.pointer = 0
+
+    def write(self, data):
+        """Write registers from data[0] with address auto-increment."""
+        self.pointer = data[0]
+        if len(data) < 2:
+            return
+        self.registers[data[0]:data[0] + len(data) - 1] = bytearray(data[1:])
+        self.board.changed()
+
+    def pins(self):
+        """Return names of the output pins set high."""
+        return set(name for reg, names in PORT_PINS.items()
+                   for bit, name in enumerate(names)
+                   if self.registers[reg] & (1 << bit))
+
+    def input_levels(self, status_reg):
+        """Return pin levels of the port read by a GPI status register."""
+        if status_reg != 0x17:
+            return self.registers[GPI_STATUS_REGS[status_reg]]
+        levels = 0 if 'EXPANDER' in pressed_buttons() else BUTTON_BIT
+        device = self.board.first_device()
+        if device is not None:
+            levels |= M1K_3V3_BIT
+            for pio, bit in enumerate(PIO_BITS):
+                if device.pio[pio]:
+                    levels |= bit
+        return levels
+
+    def button_interrupt(self):
+        """Check if the pressed button pulls the INT output low."""
+        return 'EXPANDER' in pressed_buttons() and \
+            self.registers[GPI_INTERRUPT_EN_B] & BUTTON_BIT and \
+            not self.registers[GPI_INT_LEVEL_REGS[0x17]] & BUTTON_BIT and \
+            self.registers[INT_EN] & GPI_IEN
+
+    def read(self, nr_of_bytes):
+        """Read registers from pointer with address auto-increment."""
+        data = []
+        for reg in range(self.pointer, self.pointer + nr_of_bytes):
+            if reg == GPI_INT_STAT_B:
+                data.append(BUTTON_BIT if self.button_interrupt() else 0)
+            elif reg in GPI_STATUS_REGS:
+                # Only pins configured by GPI_INT_LEVEL report a level
+                data.append(self.input_levels(reg) &
+                            self.registers[GPI_INT_LEVEL_REGS[reg]])
+            else:
+                data.append(self.registers[reg])
+        return data
+
+
+class Dac(object):
+    """AD5647R, both channels updated by 'write to input n update all'."""
+
+    def __init__(self, board):
+        self.board = board
+        self.reference_on = False
+        self.code = 0
+
+    def write(self, data):
+        """Execute command data[0] with a 16 bit data word."""
+        command = data[0]
+        if command == 0xff:
+            self.reference_on = True
+        elif command & 0x38 == 0x10 and len(data) == 3:
+            self.code = ((data[1] << 8) | data[2]) >> 2
+        self.board.changed()
+
+    def read(self, nr_of_bytes):
+        """Read back the input register."""
+        word = self.code << 2
+        return ([word >> 8, word & 0xff] * nr_of_bytes)[:nr_of_bytes]
+
+    def output(self):
+        """Return amplified DAC output voltage."""
+        if not self.reference_on:
+            return 0.0
+        return self.code / 16384.0 * DAC_REF * DAC_GAIN + DAC_OFFSET
+
+
+class Adc(object):
+    """AD7091R5 in command mode, reads convert the selected channels."""
+
+    def __init__(self, board):
+        self.board = board
+        self.registers = {0x01: 0x00, 0x02: 0x0000}
+        self.pointer = 0
+        self.sequence = []
+
+    def write(self, data):
+        """Set register pointer and write the register."""
+        self.pointer = data[0]
+        if self.pointer == 0x01 and len(data) > 1:
+            self.registers[0x01] = data[1]
+            self.sequence = [channel for channel in range(4)
+                             if data[1] & (1 << channel)]
+        elif self.pointer == 0x02 and len(data) > 2:
+            self.registers[0x02] = (data[1] << 8) | data[2]
+
+    def convert(self):
+        """Return conversion word of the next channel in the sequence."""
+        if not self.sequence:
+            self.sequence = [0]
+        channel = self.sequence.pop(0)
+        self.sequence.append(channel)
+        code = self.board.adc_input(channel) / ADC_REF * 4096 + \
+            noise.normal(0.0, ADC_NOISE)
+        return (channel << 13) | int(min(max(round(code), 0), 4095))
+
+    def read(self, nr_of_bytes):
+        """Read conversion results or the register at pointer."""
+        data = []
+        while len(data) < nr_of_bytes:
+            if self.pointer == 0x00:
+                word = self.convert()
+            else:
+                word = self.registers.get(self.pointer, 0)
+            data += [word >> 8, word & 0xff]
+        return data[:nr_of_bytes]
+
+
+class Eeprom(object):
+    """M24C02 with 16 byte pages and a write cycle without acknowledge."""
+
+    def __init__(self, board):
+        self.board = board
+        self.pointer = 0
+        self.busy_until = 0.0
+        try:
+            with open(state_file('eeprom.bin'), 'rb') as memory_file:
+                self.memory = bytearray(memory_file.read())
+        except IOError:
+            self.memory = None
+
+    def check_ready(self):
+        """Do not acknowledge during the write cycle."""
+        if now() < self.busy_until:
+            raise IOError(121, 'Remote I/O error')
+
+    def content(self):
+        """Return memory array, loaded when first used."""
+        if self.memory is None:
+            self.memory = default_eeprom()
+        return self.memory
+
+    def write(self, data):
+        """Set address, bytes after it are written in its page."""
+        self.check_ready()
+        self.pointer = data[0]
+        if len(data) < 2:
+            return
+        memory = self.content()
+        page = self.pointer & ~0x0f
+        for offset, value in enumerate(data[1:]):
+            memory[page + (self.pointer + offset) % 16] = value
+        self.busy_until = now() + EEPROM_WRITE_CYCLE
+        with open(state_file('eeprom.bin'), 'wb') as memory_file:
+            memory_file.write(memory)
+
+    def read(self, nr_of_bytes):
+        """Read sequentially from the current address."""
+        self.check_ready()
+        memory = self.content()
+        data = [memory[(self.pointer + offset) % 256]
+                for offset in range(nr_of_bytes)]
+        self.pointer = (self.pointer + nr_of_bytes) % 256
+        return data
+
+
+class Channel(object):
+    """M1K channel with mode and constant value."""
+
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+        self._mode = HI_Z
+        self.value = 0.0
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        delay(USB_CONTROL_LATENCY)
+        self._mode = mode
+        self.device.board.changed()
+
+    def constant(self, value):
+        """Source value in the current mode."""
+        self.value = value
+        self.device.board.changed()
+
+    def write(self, values, cycle=False):
+        """Source the first value, waveforms are not simulated."""
+        self.constant(values[0])
+
+    def output(self):
+        """Return value produced for the requested value.
+
+        The source calibration maps the requested value to the raw
+        command, which the channel produces with its source error.
+        """
+        quantity = 'V' if self._mode == SVMI else 'I'
+        gain, offset = self.device.source_fit[self.name, quantity]
+        command = (self.value - offset) / gain
+        error_gain, error_offset = \
+            self.device.errors['source', self.name, quantity]
+        return command * (1 + error_gain) + error_offset
+
+
+class Device(object):
+    """ADALM1000 with errors seeded by its serial number."""
+
+    def __init__(self, board, serial):
+        self.board = board
+        self.serial = serial
+        self.fwver = '2.17'
+        self.hwver = 'F'
+        self.channels = {'A': Channel(self, 'A'), 'B': Channel(self, 'B')}
+        random = RandomState(zlib.crc32(serial) & 0xffffffff)
+        self.errors = {}
+        for function in ('measure', 'source'):
+            for name in 'AB':
+                self.errors[function, name, 'V'] = (
+                    random.normal(0.0, 0.002), random.normal(0.0, 0.003))
+                self.errors[function, name, 'I'] = (
+                    random.normal(0.0, 0.002), random.normal(0.0, 0.0005))
+        self.ref_2v5 = 2.5 + random.normal(0.0, 0.002)
+        self.rail_5v0 = 5.0 + random.normal(0.0, 0.02)
+        self.reset()
+        self.calibration_text = None
+        self.measure_fit = dict(((name, quantity), (1.0, 0.0))
+                                for name in 'AB' for quantity in 'VI')
+        self.source_fit = dict(self.measure_fit)
+        if os.path.exists(state_file(serial + '.txt')):
+            self.load_calibration(state_file(serial + '.txt'))
+
+    def reset(self):
+        """Power on state."""
+        for channel in self.channels.values():
+            channel._mode = HI_Z
+            channel.value = 0.0
+        self.switches = set()
+        self.pio = [True] * 4
+
+    def load_calibration(self, file_name):
+        """Fit measure and source corrections to the file pairs."""
+        with open(file_name, 'r') as text_file:
+            self.calibration_text = text_file.read()
+        calib = calibration_file.CalibrationFile(self.calibration_text)
+        for (index, section), numbers in calib.sections.items():
+            pairs = array([calib.pairs[number] for number in numbers])
+            reference, raw = pairs[:, 0], pairs[:, 1]
+            key = (chr(index + 65), section[-1])
+            if section.startswith('measure'):
+                self.measure_fit[key] = fit(raw, reference)
+            else:
+                self.source_fit[key] = fit(reference, raw)
+
+    def write_calibration(self, file_name):
+        """Upload calibration file."""
+        delay(20 * USB_CONTROL_LATENCY)
+        self.load_calibration(file_name)
+        with open(state_file(self.serial + '.txt'), 'w') as text_file:
+            text_file.write(self.calibration_text)
+        self.board.changed()
+
+    @property
+    def calibration(self):
+        """Return [gain, offset] of the corrections."""
+        return [list(self.measure_fit[name, quantity]) +
+                list(self.source_fit[name, quantity])
+                for name in 'AB' for quantity in 'VI']
+
+    def ctrl_transfer(self, request_type, request, value, index, data,
+                      length, timeout):
+        """Set M1K switches and PIO pins."""
+        delay(USB_CONTROL_LATENCY)
+        if value in SWITCHES:
+            if request == 0x50:
+                self.switches.add(SWITCHES[value])
+            else:
+                self.switches.discard(SWITCHES[value])
+        elif value in PIO_PINS:
+            self.pio[PIO_PINS[value]] = request == 0x51
+        self.board.changed()
+        return 0
+
+    def get_samples(self, nr_of_samples):
+        """Stream samples, values are measured with errors and noise."""
+        times = now() + USB_LATENCY + arange(nr_of_samples) / \
+            float(SAMPLE_RATE)
+        delay(USB_LATENCY + nr_of_samples / float(SAMPLE_RATE))
+        self.board.count_usb(USB_LATENCY + nr_of_samples /
+                             float(SAMPLE_RATE))
+        values = self.board.values_at(times)
+        rows = []
+        for name in 'AB':
+            for quantity, sigma in (('V', NOISE_V), ('I', NOISE_I)):
+                gain, offset = self.errors['measure', name, quantity]
+                raw = values[self.serial, name, quantity] * (1 + gain) + \
+                    offset + noise.normal(0.0, sigma, nr_of_samples)
+                cal_gain, cal_offset = self.measure_fit[name, quantity]
+                rows.append(raw * cal_gain + cal_offset)
+        return array(rows).T.reshape(nr_of_samples, 2, 2).tolist()
+
+    def read(self, nr_of_samples, timeout=0):
+        """Read samples of a continuous session."""
+        return self.get_samples(nr_of_samples)
+
+
+def fit(x, y):
+    """Return gain and offset of the line fitted to y(x)."""
+    if len(x) < 2 or x.max() == x.min():
+        return 1.0, 0.0
+    gain = ((x - x.mean()) * (y - y.mean())).sum() / \
+        ((x - x.mean()) ** 2).sum()
+    return gain, y.mean() - gain * x.mean()
+
+
+class Board(object):
+    """Calibration board with the M1K devices plugged in.
+
+    Board and device changes start a first order transition from the
+    values at the time of the change to the new steady state values.
+    """
+
+    def __init__(self, serials):
+        self.lock = threading.RLock()
+        self.devices = [Device(self, serial) for serial in serials]
+        self.expander = Expander(self)
+        self.dac = Dac(self)
+        self.adc = Adc(self)
+        self.eeprom = Eeprom(self)
+        self.models = {EXPANDER_ID: self.expander, DAC_ID: self.dac,
+                       ADC_ID: self.adc, EEPROM_ID: self.eeprom}
+        self.usb_power = True
+        self.power_on_time = float('-inf')
+        self.bus_stats = {}
+        self.usb_stats = [0, 0.0]
+        self.target = self.solve()
+        self.start = self.target
+        self.change_time = now()
+
+    def enumerated_devices(self):
+        """Return devices seen on USB."""
+        if not self.usb_power or \
+                now() - self.power_on_time < ENUMERATION_TIME:
+            return []
+        return list(self.devices)
+
+    def first_device(self):
+        """Return the device wired to the board PIO and load, or None."""
+        devices = self.enumerated_devices()
+        return devices[0] if devices else None
+
+    def set_usb_power(self, state):
+        """Switch M1K USB power."""
+        if state and not self.usb_power:
+            self.power_on_time = now()
+        if not state:
+            for device in self.devices:
+                device.reset()
+        self.usb_power = state
+        self.changed()
+
+    def changed(self):
+        """Start transition to the steady state of the new settings."""
+        with self.lock:
+            time_of_change = now()
+            self.start = self.values_at(time_of_change)
+            self.target = self.solve()
+            self.change_time = time_of_change
+
+    def values_at(self, times):
+        """Return board and channel values at time or array of times."""
+        with self.lock:
+            if TIME_SCALE <= 0:
+                return self.target
+            elapsed = clip(array(times) - self.change_time, 0.0, None)
+            settled = 1 - array_exp(-elapsed / SETTLING_TIME)
+            return dict(
+                (key, self.start[key] +
+                 (self.target[key] - self.start[key]) * settled)
+                for key in self.target)
+
+    def solve(self):
+        """Return steady state node, load current and channel values."""
+        pins = self.expander.pins()
+        devices = self.enumerated_devices()
+        reference = devices[0].ref_2v5 if devices else 0.0
+        connected = [(device, name) for device in devices for name in 'AB'
+                     if pins & set(CHANNEL_RELAYS[name])]
+        load = 1 / LOAD_RESISTOR if 'GPIO_1' in pins else 0.0
+        sense = 1 / SENSE_RESISTOR if 'GPIO_3' in pins else 0.0
+        drivers = [(device, name) for device, name in connected
+                   if device.channels[name].mode != HI_Z]
+        currents = {}
+        if 'GPIO_0' in pins:
+            node = EX_2V5
+        elif 'GPIO_2' in pins:
+            node = self.dac.output()
+        elif drivers:
+            channel = drivers[0][0].channels[drivers[0][1]]
+            if channel.mode == SVMI:
+                node = channel.output()
+            elif load + sense > 0:
+                node = (channel.output() + load * reference) / (load + sense)
+            else:
+                node = 5.0 if channel.output() > 0 else 0.0
+            node = min(max(node, 0.0), 5.0)
+            currents[drivers[0]] = (node - reference) * load + node * sense
+        elif load > 0:
+            node = reference
+        else:
+            node = 0.0
+
+        values = {'node': node, 'load': (node - reference) * load,
+                  'rail_5v0': devices[0].rail_5v0 if devices else 0.0,
+                  'ref_2v5': reference}
+        for device in self.devices:
+            for name in 'AB':
+                channel = device.channels[name]
+                voltage = current = 0.0
+                if device not in devices:
+                    pass
+                elif (device, name) in connected:
+                    voltage = node
+                    current = currents.get((device, name), 0.0)
+                elif channel.mode == SVMI:
+                    voltage = channel.output()
+                elif channel.mode == SIMV:
+                    # Open circuit, the output is at its compliance limit
+                    voltage = 5.0 if channel.output() > 0 else 0.0
+                elif (name, '2v5') in device.switches:
+                    voltage = device.ref_2v5
+                values[device.serial, name, 'V'] = voltage
+                values[device.serial, name, 'I'] = current
+        return values
+
+    def adc_input(self, channel):
+        """Return voltage at an ADC input now."""
+        values = self.values_at(now())
+        if channel == 0:
+            return (CSA_OFFSET_CODE + CSA_CODES_PER_AMP * values['load']) * \
+                ADC_REF / 4096
+        return [None, values['rail_5v0'], values['node'],
+                values['ref_2v5']][channel] / ADC_DIVIDERS[channel]
+
+    def transfer(self, addr, messages, nr_of_bytes):
+        """Wait for an I2C transfer and count it."""
+        duration = I2C_TRANSFER_OVERHEAD + \
+            (nr_of_bytes * I2C_BYTE_BITS + messages * I2C_MESSAGE_BITS) / \
+            I2C_CLOCK
+        stats = self.bus_stats.setdefault(addr, [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += nr_of_bytes
+        stats[2] += duration
+        delay(duration)
+        if addr not in self.models:
+            raise IOError(121, 'Remote I/O error')
+        return self.models[addr]
+
+    def count_usb(self, duration):
+        """Count a sample transfer."""
+        self.usb_stats[0] += 1
+        self.usb_stats[1] += duration
+
+    def report(self):
+        """Print simulated transfer counts and times."""
+        for addr, (count, nr_of_bytes, duration) in \
+                sorted(self.bus_stats.items()):
+            sys.stderr.write(
+                'simulator: I2C 0x%02X %d transfers %d bytes %.3f s\n' %
+                (addr, count, nr_of_bytes, duration))
+        sys.stderr.write('simulator: USB %d sample transfers %.3f s\n' %
+                         tuple(self.usb_stats))
+
+
+class Message(object):
+    """smbus2 i2c_msg."""
+
+    def __init__(self, addr, read, data):
+        self.addr = addr
+        self.flags = 1 if read else 0
+        self.len = len(data)
+        self.buf = list(data)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    @classmethod
+    def read(cls, addr, nr_of_bytes):
+        return cls(addr, True, [0] * nr_of_bytes)
+
+    @classmethod
+    def write(cls, addr, data):
+        return cls(addr, False, bytearray(data))
+
+
+class SMBus(object):
+    """SMBus and smbus2 SMBus on the simulated board."""
+
+    def __init__(self, bus=None):
+        self.bus = bus
+
+    def write_byte_data(self, addr, reg, value):
+        jig.transfer(addr, 1, 3).write([reg, value])
+
+    def write_i2c_block_data(self, addr, reg, data):
+        jig.transfer(addr, 1, 2 + len(data)).write([reg] + list(data))
+
+    def read_byte_data(self, addr, reg):
+        model = jig.transfer(addr, 2, 4)
+        model.write([reg])
+        return model.read(1)[0]
+
+    def read_i2c_block_data(self, addr, reg, nr_of_bytes):
+        model = jig.transfer(addr, 2, 3 + nr_of_bytes)
+        model.write([reg])
+        return model.read(nr_of_bytes)
+
+    def write_quick(self, addr):
+        model = jig.transfer(addr, 1, 1)
+        if hasattr(model, 'check_ready'):
+            model.check_ready()
+
+    def i2c_rdwr(self, *messages):
+        """Combined transfer, one ioctl for all messages."""
+        model = jig.transfer(
+            messages[0].addr, len(messages),
+            sum(1 + message.len for message in messages))
+        for message in messages:
+            if message.flags:
+                message.buf = model.read(message.len)
+            else:
+                model.write(message.buf)
+
+    def close(self):
+        pass
+
+
+class SessionError(Exception):
+    """pysmu session error."""
+
+
+class Session(object):
+    """pysmu Session with the devices enumerated on the simulated USB."""
+
+    # Sessions of the process, their devices are claimed
+    sessions = weakref.WeakSet()
+
+    def __init__(self, add_all=True):
+        Session.sessions.add(self)
+        self.devices = []
+        self.available_devices = []
+        self.queue_size = 10000
+        self.scan()
+        if add_all:
+            self.devices = list(self.available_devices)
+
+    def scan(self):
+        delay(USB_CONTROL_LATENCY * len(jig.devices))
+        self.available_devices = jig.enumerated_devices()
+
+    def add(self, device):
+        self.devices.append(device)
+
+    def start(self, nr_of_samples):
+        pass
+
+    def flash_firmware(self, firmware_file, device=None):
+        """Flash the board in SAM-BA mode on the flash port."""
+        if not os.path.exists(firmware_file):
+            raise SessionError('failed to open firmware file')
+        if not FLASH_PORT:
+            raise SessionError('no devices found in SAM-BA mode')
+        delay(FIRMWARE_UPLOAD_TIME)
+
+    @staticmethod
+    def claimed():
+        """Check if a session of the process holds M1K devices."""
+        return any(session.devices for session in Session.sessions)
+
+    def end(self):
+        pass
+
+
+class LED(object):
+    """gpiozero output, pin 12 switches M1K USB power."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = 0
+
+    def on(self):
+        self.value = 1
+        if self.pin == 12:
+            jig.set_usb_power(True)
+
+    def off(self):
+        self.value = 0
+        if self.pin == 12:
+            jig.set_usb_power(False)
+
+    @property
+    def is_lit(self):
+        return bool(self.value)
+
+    def close(self):
+        pass
+
+
+def pressed_buttons():
+    """Return buttons held, GPIO numbers or EXPANDER in M1K_SIM_BUTTONS."""
+    return os.getenv('M1K_SIM_BUTTONS', '').split(',')
+
+
+class Button(object):
+    """gpiozero button pressed when listed in M1K_SIM_BUTTONS."""
+
+    def __init__(self, pin, **kwargs):
+        self.pin = pin
+        self.when_pressed = None
+        self.when_released = None
+
+    @property
+    def is_pressed(self):
+        if EXPANDER_INT_PIN and self.pin == int(EXPANDER_INT_PIN):
+            return bool(jig.expander.button_interrupt())
+        return str(self.pin) in pressed_buttons()
+
+    def close(self):
+        pass
+
+
+class Serial(object):
+    """pyserial port without a display connected."""
+
+    def __init__(self, port=None, baudrate=9600, timeout=None):
+        self.port = port
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        return ''
+
+    def readline(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+class SmuProcess(object):
+    """smu process, the firmware upload is simulated with its progress."""
+
+    def __init__(self, firmware_file):
+        self.returncode = None
+        read_end, write_end = os.pipe()
+        self.stdout = os.fdopen(read_end, 'rb', 0)
+        self.writer = threading.Thread(
+            target=self.upload,
+            args=(firmware_file, os.fdopen(write_end, 'wb', 0)))
+        self.writer.start()
+
+    def upload(self, firmware_file, output):
+        if Session.claimed():
+            # smu adds all the devices to its session
+            output.write('smu: error initializing session: Device or '
+                         'resource busy\n')
+            self.returncode = 1
+        elif not os.path.exists(firmware_file):
+            output.write('smu: failed updating firmware: failed to open '
+                         'firmware file\n')
+            self.returncode = 1
+        else:
+            for percent in range(0, 101, 25):
+                delay(FIRMWARE_UPLOAD_TIME / 5)
+                output.write('smu: writing firmware %d%%\r' % percent)
+            output.write('\nsmu: simulated firmware upload\n')
+            self.returncode = 0
+        output.close()
+
+    def wait(self):
+        self.writer.join()
+        return self.returncode
+
+
+def smu_popen(args, *popen_args, **kwargs):
+    """Start process, smu firmware upload is simulated."""
+    if list(args[:2]) == ['smu', '-f']:
+        return SmuProcess(args[2])
+    return POPEN(args, *popen_args, **kwargs)
+
+
+def module(name, **attributes):
+    """Create a simulated module."""
+    simulated = types.ModuleType(name)
+    simulated.__dict__.update(attributes)
+    return simulated
+
+
+def install():
+    """Replace the hardware modules by the simulated ones."""
+    global jig
+    jig = Board(['SIM%09d' % index for index in range(DEVICES)])
+    i2c_msg = type('i2c_msg', (object,), {'read': Message.read,
+                                          'write': Message.write})
+    mode = type('Mode', (object,), {'HI_Z': HI_Z, 'SVMI': SVMI,
+                                    'SIMV': SIMV})
+    sys.modules['smbus'] = module('smbus', SMBus=SMBus)
+    sys.modules['smbus2'] = module('smbus2', SMBus=SMBus, i2c_msg=i2c_msg)
+    sys.modules['pysmu'] = module('pysmu', Session=Session,
+                                   SessionError=SessionError, Mode=mode)
+    sys.modules['gpiozero'] = module('gpiozero', LED=LED, Button=Button)
+    sys.modules['serial'] = module('serial', Serial=Serial)
+    # Without pyudev the device detection polls the session
+    sys.modules['pyudev'] = None
+    subprocess.Popen = smu_popen
+    if REPORT:
+        atexit.register(jig.report)
+
+
+if __name__ == '__main__':
+    install()
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+    runpy.run_path(sys.argv[0], run_name='__main__')
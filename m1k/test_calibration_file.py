@@ -0,0 +1,63 @@
+"""Tests of the calibration file round trip.
+
+Usage: python -m unittest test_calibration_file
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from calibration_file import CalibrationFile
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'calib_default.txt')
+
+
+class CalibrationFileTest(unittest.TestCase):
+    """CalibrationFile serialization of calib_default.txt."""
+
+    def setUp(self):
+        with open(DEFAULT_FILE, 'rb') as default_file:
+            self.default_text = default_file.read()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Loaded file is serialized byte for byte."""
+        calib = CalibrationFile.load(DEFAULT_FILE)
+        self.assertEqual(calib.serialize(), self.default_text)
+
+    def test_set_changes_only_target_lines(self):
+        """Saved file differs from the default file on set rows only."""
+        calib = CalibrationFile.load(DEFAULT_FILE)
+        changed = [(0, 'measure V', 1, 2.4991, 2.5123),
+                   (1, 'source I', 2, -0.1, -0.0987)]
+        targets = set()
+        for channel_index, section, row, reference, raw in changed:
+            calib.set(channel_index, section, row, reference, raw)
+            targets.add(calib.sections[channel_index, section][row])
+        file_name = os.path.join(self.directory, 'calib.txt')
+        calib.save(file_name)
+        with open(file_name, 'rb') as saved_file:
+            saved_lines = saved_file.read().splitlines(True)
+        default_lines = self.default_text.splitlines(True)
+
+        self.assertEqual(len(saved_lines), len(default_lines))
+        for number, (saved, default) in enumerate(
+                zip(saved_lines, default_lines)):
+            if number not in targets:
+                self.assertEqual(saved, default)
+        self.assertEqual(
+            saved_lines[calib.sections[0, 'measure V'][1]],
+            '<2.4991, 2.5123>\n')
+        self.assertEqual(
+            saved_lines[calib.sections[1, 'source I'][2]],
+            '<-0.1000, -0.0987>\n')
+        self.assertEqual(CalibrationFile.load(file_name).get(
+            0, 'measure V', 1), (2.4991, 2.5123))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Summarize step timing recorded with M1K_INSTRUMENT=1.
+
+Usage: python timing_summary.py [log directory] [--by fwver|run|serial]
+The timing.jsonl files of all device directories are aggregated per
+stage and step: number of boards, mean and maximum wall time, mean I2C
+transactions, ctrl_transfer and get_samples calls and sleep time.
+With --by, the table is split by firmware version, run or board.
+"""
+import json
+import os
+import sys
+
+COLUMNS = '{0:<44} {1:>6} {2:>8} {3:>8} {4:>7} {5:>6} {6:>6} {7:>8}'
+
+
+def timing_records(log_dir):
+    """Return records of the timing.jsonl files in log_dir."""
+    records = []
+    for directory, _, names in os.walk(log_dir):
+        if 'timing.jsonl' in names:
+            with open(os.path.join(directory, 'timing.jsonl')) as timing:
+                records += [json.loads(line) for line in timing
+                            if line.strip()]
+    return records
+
+
+def mean(values):
+    """Return mean of values."""
+    return sum(values) / float(len(values))
+
+
+def summarize(records, group_by=None):
+    """Return {group: {(stage, step): [records]}} and board totals."""
+    groups = {}
+    for record in records:
+        group = record.get(group_by) if group_by else None
+        steps = groups.setdefault(group, {})
+        steps.setdefault((record['stage'], record['step']), []).append(record)
+        total = steps.setdefault((record['stage'], '(stage total)'), [])
+        board = (record['serial'], record['run'])
+        for board_total in total:
+            if board_total['board'] == board:
+                break
+        else:
+            board_total = {'board': board, 'wall': 0.0, 'i2c': {},
+                           'ctrl_transfer': 0, 'get_samples': 0,
+                           'sleep_time': 0.0}
+            total.append(board_total)
+        for name in ('wall', 'ctrl_transfer', 'get_samples', 'sleep_time'):
+            board_total[name] += record[name]
+        for addr, count in record['i2c'].items():
+            board_total['i2c'][addr] = board_total['i2c'].get(addr, 0) + \
+                count
+    return groups
+
+
+def print_summary(groups, group_by=None):
+    """Print a table per group."""
+    for group in sorted(groups):
+        if group_by:
+            print '\n' + group_by + ': ' + str(group)
+        print COLUMNS.format('stage / step', 'boards', 'mean s', 'max s',
+                             'I2C', 'ctrl', 'get', 'sleep s')
+        for stage, step in sorted(groups[group]):
+            records = groups[group][stage, step]
+            walls = [record['wall'] for record in records]
+            label = step if step == '(stage total)' else '  ' + step
+            if step == '(stage total)':
+                print stage
+            print COLUMNS.format(
+                label[:44], len(records), '%.3f' % mean(walls),
+                '%.3f' % max(walls),
+                '%.1f' % mean([sum(record['i2c'].values())
+                               for record in records]),
+                '%.1f' % mean([record['ctrl_transfer']
+                               for record in records]),
+                '%.1f' % mean([record['get_samples'] for record in records]),
+                '%.3f' % mean([record['sleep_time'] for record in records]))
+
+
+if __name__ == '__main__':
+    ARGS = sys.argv[1:]
+    GROUP_BY = None
+    if '--by' in ARGS:
+        GROUP_BY = ARGS[ARGS.index('--by') + 1]
+        del ARGS[ARGS.index('--by'):ARGS.index('--by') + 2]
+    LOG_DIR = ARGS[0] if ARGS else os.getenv('LOGDIR', './log')
+    RECORDS = timing_records(LOG_DIR)
+    if not RECORDS:
+        print 'No timing records in ' + LOG_DIR
+        exit(1)
+    print_summary(summarize(RECORDS, GROUP_BY), GROUP_BY)
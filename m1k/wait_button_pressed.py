@@ -1,9 +1,23 @@
-"""Wait for buttons module."""
+"""Wait for buttons module.
 
-from time import sleep
+Print the description of the first button pressed. The Pi buttons wake
+the script with their edge. The calibration board button wakes it with
+the ADP5589 INT output when it is wired to the Pi GPIO given by
+M1K_EXPANDER_INT_PIN, else its status is read every
+EXPANDER_POLL_INTERVAL seconds. USB_GPO and LED_2 blink every
+BLINK_PERIOD seconds while waiting.
+"""
+import os
+from Queue import Empty, Queue
+from time import time
 
+import control_m1k
 import ioxp_adp5589
-from gpiozero import LED, Button
+from gpiozero import Button
+
+EXPANDER_INT_PIN = os.getenv('M1K_EXPANDER_INT_PIN')
+EXPANDER_POLL_INTERVAL = 0.05
+BLINK_PERIOD = 0.25
 
 buttons = [
     {'id': 17, 'desc': 'START', 'button': None},
@@ -11,23 +25,59 @@ buttons = [
     {'id': 23, 'desc': 'RESTART', 'button': None}
 ]
 
+# Pressed buttons, put by the gpiozero callbacks, I2C is used only by
+# the main thread
+PRESSED = Queue()
+
 for b in buttons:
     b['button'] = Button(b['id'])
+    b['button'].when_pressed = lambda desc=b['desc']: PRESSED.put(desc)
+    if b['button'].is_pressed:
+        PRESSED.put(b['desc'])
+
+EXPANDER_INT = None
+if EXPANDER_INT_PIN:
+    # INT is an open drain output, low while an interrupt is pending
+    EXPANDER_INT = Button(int(EXPANDER_INT_PIN), pull_up=True)
+    EXPANDER_INT.when_pressed = lambda: PRESSED.put('EXPANDER')
+    ioxp_adp5589.enable_button_interrupt()
+    if EXPANDER_INT.is_pressed:
+        PRESSED.put('EXPANDER')
 
-USB = LED(12)
+USB = control_m1k.usb_power()
 USB.off()
 
-while True:
-    BUTTON_STATUS = ioxp_adp5589.get_button_status()
-    ioxp_adp5589.gpo_set_port_c(['USB_GPO__1', 'LED_2__1'])
-    sleep(0.01)
+# Buttons are released on exit so m1k_runner can run this script again
+try:
+    BLINK = 1
+    NEXT_BLINK = time()
+    while True:
+        if time() >= NEXT_BLINK:
+            ioxp_adp5589.gpo_set_port_c(
+                ['USB_GPO__' + str(BLINK), 'LED_2__' + str(BLINK)])
+            BLINK ^= 1
+            NEXT_BLINK += BLINK_PERIOD
+        try:
+            BUTTON = PRESSED.get(timeout=max(0.0, min(
+                NEXT_BLINK - time(), BLINK_PERIOD if EXPANDER_INT
+                else EXPANDER_POLL_INTERVAL)))
+        except Empty:
+            BUTTON = None
+        if EXPANDER_INT is None and BUTTON is None:
+            if ioxp_adp5589.get_button_status() == '0x0':
+                print "GPIO_EXP_BUTTON"
+                break
+        elif BUTTON == 'EXPANDER':
+            if ioxp_adp5589.clear_button_interrupt():
+                print "GPIO_EXP_BUTTON"
+                break
+        elif BUTTON is not None:
+            print BUTTON
+            exit(0)
+finally:
     ioxp_adp5589.gpo_set_port_c(['USB_GPO__0', 'LED_2__0'])
-    sleep(0.01)
-    if BUTTON_STATUS == '0x0':
-        print "GPIO_EXP_BUTTON"
-        break
-    sleep(0.01)
+    if EXPANDER_INT is not None:
+        ioxp_adp5589.disable_button_interrupt()
+        EXPANDER_INT.close()
     for b in buttons:
-        if b['button'].is_pressed:
-            print b['desc']
-            exit(0)
+        b['button'].close()